@@ -1,18 +1,86 @@
 """Custom integration to integrate helixer with Home Assistant."""
 from __future__ import annotations
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import CONF_PASSWORD, CONF_USERNAME, Platform
-from homeassistant.core import HomeAssistant
+from homeassistant.const import (
+    CONF_PASSWORD,
+    CONF_USERNAME,
+    EVENT_HOMEASSISTANT_FINAL_WRITE,
+    Platform,
+)
+from homeassistant.core import Event, HomeAssistant, callback
+from homeassistant.exceptions import ConfigEntryError, ConfigEntryNotReady
+from homeassistant.helpers.storage import STORAGE_DIR
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.components import mqtt
 from homeassistant.components.mqtt import valid_publish_topic
-from .client import HelixerClient
+from .backfill import HelixerBackfill, async_setup_services
+from .buffer import HelixerOfflineBuffer
+from .client import HelixerClient, HelixerClientAuthenticationError
+from .commands import HelixerCommandHandler
+from .compression import HelixerCompressor
+from .coordinator import HelixerDataUpdateCoordinator
+from .deadband import HelixerDeadband
+from .encoder import FlattenLimits
+from .entity_filter import HelixerEntityFilter
+from .host import HelixerPrimaryHost
 from .listener import HelixerListener
-from .const import DOMAIN, LOGGER, DOMAIN, LOGGER
+from .pipeline import HelixerPipeline
+from .publisher import HelixerBatchPublisher
+from .registry import HelixerMetricRegistry
+from .session import HelixerSessionStore
+from .sharding import HelixerShardedClient, HelixerShardMap, shard_node_ids
+from .stats import HelixerStats
+from .templates import HelixerTemplates
+from .wire import PayloadWriter, protobuf_backend, self_check
+from .const import (
+    COMPRESSION_NONE,
+    CONF_BUFFER_DISK,
+    CONF_BUFFER_MEMORY,
+    CONF_COMMANDS,
+    CONF_COMPRESSION,
+    CONF_CONNECTIONS,
+    CONF_COMPRESSION_THRESHOLD,
+    CONF_DEADBAND_RULES,
+    CONF_DROP_POLICY,
+    CONF_FLATTEN_DEPTH,
+    CONF_FLATTEN_MAX_METRICS,
+    CONF_FLATTEN_MAX_SIZE,
+    CONF_FLUSH_INTERVAL_MAX,
+    CONF_FLUSH_INTERVAL_MIN,
+    CONF_MAX_METRICS,
+    CONF_PRIMARY_HOST_ID,
+    CONF_QUEUE_SIZE,
+    CONF_REPLAY_RATE,
+    CONF_SERIALIZER,
+    CONF_TEMPLATES,
+    DEFAULT_BUFFER_DISK,
+    DEFAULT_BUFFER_MEMORY,
+    DEFAULT_COMMANDS,
+    DEFAULT_COMPRESSION,
+    DEFAULT_CONNECTIONS,
+    DEFAULT_COMPRESSION_THRESHOLD,
+    DEFAULT_DROP_POLICY,
+    DEFAULT_FLATTEN_DEPTH,
+    DEFAULT_FLATTEN_MAX_METRICS,
+    DEFAULT_FLATTEN_MAX_SIZE,
+    DEFAULT_FLUSH_INTERVAL_MAX,
+    DEFAULT_FLUSH_INTERVAL_MIN,
+    DEFAULT_MAX_METRICS,
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_REPLAY_RATE,
+    DEFAULT_SERIALIZER,
+    DEFAULT_TEMPLATES,
+    DOMAIN,
+    LOGGER,
+    SERIALIZER_STREAMING,
+)
 from homeassistant.helpers.start import async_at_start
 
+PLATFORMS: list[Platform] = [Platform.SENSOR]
+
 
 async def async_setup(hass: HomeAssistant, config: dict) -> bool:
+    async_setup_services(hass)
     return True
 
 
@@ -21,28 +89,279 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up this integration using UI."""
     hass.data.setdefault(DOMAIN, {})
 
-    client = HelixerClient(
-        entry.data[CONF_USERNAME],
-        entry.data[CONF_PASSWORD],
-        entry.data["endpoint"],
-        entry.data["port"],
-        entry.data["key"],
-        entry.data["certificate"],
-        entry.data["ca"],
+    compressor = None
+    algorithm = entry.options.get(CONF_COMPRESSION, DEFAULT_COMPRESSION)
+    if algorithm != COMPRESSION_NONE:
+        compressor = HelixerCompressor(
+            algorithm,
+            int(
+                entry.options.get(
+                    CONF_COMPRESSION_THRESHOLD, DEFAULT_COMPRESSION_THRESHOLD
+                )
+            ),
+        )
+
+    # One connection, offline buffer and edge node ID per shard, the first
+    # shard keeps the node ID and buffer of a single connection setup.
+    connections = int(entry.options.get(CONF_CONNECTIONS, DEFAULT_CONNECTIONS))
+    node_ids = shard_node_ids("helixer", connections)
+    # Every client counts on its own, the listener counts events in the
+    # statistics of the first one.
+    stats = HelixerStats()
+    session_store = HelixerSessionStore(hass)
+    await session_store.async_load()
+    offline_buffers = []
+    clients = {}
+    for index, node_id in enumerate(node_ids):
+        offline_buffer = await hass.async_add_executor_job(
+            HelixerOfflineBuffer,
+            hass.config.path(
+                STORAGE_DIR,
+                f"{DOMAIN}_buffer",
+                entry.entry_id if index == 0 else f"{entry.entry_id}_{node_id}",
+            ),
+            entry.options.get(CONF_BUFFER_MEMORY, DEFAULT_BUFFER_MEMORY)
+            * 1024
+            * 1024
+            // connections,
+            entry.options.get(CONF_BUFFER_DISK, DEFAULT_BUFFER_DISK)
+            * 1024
+            * 1024
+            // connections,
+            entry.options.get(CONF_REPLAY_RATE, DEFAULT_REPLAY_RATE),
+        )
+        offline_buffers.append(offline_buffer)
+        clients[node_id] = HelixerClient(
+            entry.data[CONF_USERNAME],
+            entry.data[CONF_PASSWORD],
+            entry.data["endpoint"],
+            entry.data["port"],
+            entry.data["key"],
+            entry.data["certificate"],
+            entry.data["ca"],
+            offline_buffer=offline_buffer,
+            stats=stats if index == 0 else None,
+            compressor=compressor,
+            session=session_store.session(node_id),
+        )
+
+    shard_map = None
+    if connections > 1:
+        shard_map = HelixerShardMap(node_ids)
+        client = HelixerShardedClient(clients)
+    else:
+        client = clients[node_ids[0]]
+
+    registry = HelixerMetricRegistry(hass)
+    await registry.async_load()
+
+    publisher = HelixerBatchPublisher(
+        client,
+        registry,
+        HelixerDeadband(entry.options.get(CONF_DEADBAND_RULES, {})),
+        "helixer",
+        min_interval=entry.options.get(
+            CONF_FLUSH_INTERVAL_MIN, DEFAULT_FLUSH_INTERVAL_MIN
+        )
+        / 1000,
+        max_interval=entry.options.get(
+            CONF_FLUSH_INTERVAL_MAX, DEFAULT_FLUSH_INTERVAL_MAX
+        )
+        / 1000,
+        max_metrics=int(entry.options.get(CONF_MAX_METRICS, DEFAULT_MAX_METRICS)),
+        shard_map=shard_map,
+        templates=(
+            HelixerTemplates()
+            if entry.options.get(CONF_TEMPLATES, DEFAULT_TEMPLATES)
+            else None
+        ),
+        flatten=FlattenLimits(
+            int(entry.options.get(CONF_FLATTEN_DEPTH, DEFAULT_FLATTEN_DEPTH)),
+            int(
+                entry.options.get(
+                    CONF_FLATTEN_MAX_METRICS, DEFAULT_FLATTEN_MAX_METRICS
+                )
+            ),
+            int(entry.options.get(CONF_FLATTEN_MAX_SIZE, DEFAULT_FLATTEN_MAX_SIZE)),
+        ),
+        writer=_payload_writer(entry),
     )
+    # With a primary host, nothing is published until it reports online.
+    host_id = entry.options.get(CONF_PRIMARY_HOST_ID)
+    pipeline = HelixerPipeline(
+        publisher,
+        max_queue=int(entry.options.get(CONF_QUEUE_SIZE, DEFAULT_QUEUE_SIZE)),
+        drop_policy=entry.options.get(CONF_DROP_POLICY, DEFAULT_DROP_POLICY),
+        paused=bool(host_id),
+    )
+    pipeline.start()
+    entity_filter = HelixerEntityFilter(hass, entry.options)
+    listener = HelixerListener(pipeline, entity_filter, stats)
+
+    command_handler = None
+    if entry.options.get(CONF_COMMANDS, DEFAULT_COMMANDS):
+        command_handler = HelixerCommandHandler(
+            hass, registry, entity_filter, publisher.topic
+        )
+
+    @callback
+    def _async_rebirth() -> None:
+        if command_handler is not None:
+            command_handler.async_build_index()
+        listener.async_rebirth()
+
+    def _node_command(topic: str, data: bytes) -> None:
+        if publisher.is_rebirth_command(data):
+            hass.loop.call_soon_threadsafe(_async_rebirth)
+
+    # Births have to be (re)published after every (re)connect and whenever
+    # the host asks for them.
+    client.add_connect_callback(
+        lambda: hass.loop.call_soon_threadsafe(_async_rebirth)
+    )
+    for node_id in node_ids:
+        client.subscribe(publisher.topic("NCMD", node_id=node_id), _node_command)
+        if command_handler is not None:
+            client.subscribe(
+                f"{publisher.topic('DCMD', node_id=node_id)}/#",
+                command_handler.handle_message,
+            )
+
+    backfill = HelixerBackfill(hass, pipeline, entity_filter)
+
+    primary_host = None
+    if host_id:
+
+        @callback
+        def _async_resume() -> None:
+            # Resume with a fresh snapshot, devices that did not change while
+            # paused have to be born again too.
+            if primary_host.online:
+                listener.async_resume()
+
+        primary_host = HelixerPrimaryHost(
+            host_id,
+            lambda: hass.loop.call_soon_threadsafe(_async_resume),
+            pipeline.pause,
+        )
+        client.subscribe(primary_host.topic, primary_host.handle_message)
 
     try:
-        client.connect_mqtt()
+        await client.async_connect_mqtt()
+    except HelixerClientAuthenticationError as exception:
+        await _async_stop(hass, pipeline, client)
+        raise ConfigEntryError(exception) from exception
     except Exception as exception:  # pylint: disable=broad-except
-        LOGGER.warning(exception)
-        return False
+        # Home Assistant retries the setup with an increasing delay.
+        await _async_stop(hass, pipeline, client)
+        raise ConfigEntryNotReady(exception) from exception
+
+    coordinator = HelixerDataUpdateCoordinator(
+        hass,
+        client,
+        pipeline,
+        publisher,
+        offline_buffers,
+        compressor,
+        command_handler,
+        primary_host,
+        shard_map,
+        backfill,
+    )
+    try:
+        await coordinator.async_config_entry_first_refresh()
+    except Exception:
+        await _async_stop(hass, pipeline, client)
+        raise
+
+    hass.data[DOMAIN][entry.entry_id] = {
+        "client": client,
+        "offline_buffers": offline_buffers,
+        "compressor": compressor,
+        "publisher": publisher,
+        "pipeline": pipeline,
+        "listener": listener,
+        "command_handler": command_handler,
+        "primary_host": primary_host,
+        "backfill": backfill,
+        "coordinator": coordinator,
+    }
+
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+
+    entry.async_on_unload(async_at_start(hass, listener.ha_started))
+    if command_handler is not None:
+        entry.async_on_unload(
+            async_at_start(
+                hass, callback(lambda _: command_handler.async_build_index())
+            )
+        )
+        entry.async_on_unload(command_handler.async_stop)
+    entry.async_on_unload(backfill.async_stop)
 
-    listener = HelixerListener(client, "helixer")
+    async def _async_final_write(_: Event) -> None:
+        # Entries are not unloaded when Home Assistant stops, flush the
+        # pipeline and persist the offline buffers before it exits.
+        await _async_stop(hass, pipeline, client)
 
-    async_at_start(hass, listener.ha_started)
+    entry.async_on_unload(
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_FINAL_WRITE, _async_final_write)
+    )
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
     return True
 
 
+async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    """Handle removal of an entry."""
+    if not await hass.config_entries.async_unload_platforms(entry, PLATFORMS):
+        return False
+
+    data = hass.data[DOMAIN].pop(entry.entry_id)
+    data["listener"].stop()
+    await _async_stop(hass, data["pipeline"], data["client"])
+    return True
+
+
+def _payload_writer(entry: ConfigEntry) -> PayloadWriter | None:
+    """Return the streaming writer if it is configured and serializes correctly.
+
+    The generated classes are used otherwise, on the protobuf backend that
+    is reported here.
+    """
+    backend = protobuf_backend()
+    if backend == "python":
+        LOGGER.warning(
+            "Protobuf runs on its pure Python backend, install a protobuf wheel"
+            " with the upb backend for faster serialization"
+        )
+    if entry.options.get(CONF_SERIALIZER, DEFAULT_SERIALIZER) != SERIALIZER_STREAMING:
+        LOGGER.info("Serializing payloads with the protobuf %s backend", backend)
+        return None
+    if not self_check():
+        LOGGER.warning(
+            "The streaming serializer does not match protobuf %s, using protobuf",
+            backend,
+        )
+        return None
+    LOGGER.info(
+        "Serializing data payloads with the streaming serializer, protobuf %s"
+        " for the others",
+        backend,
+    )
+    return PayloadWriter()
+
+
+async def _async_stop(
+    hass: HomeAssistant,
+    pipeline: HelixerPipeline,
+    client: HelixerClient | HelixerShardedClient,
+) -> None:
+    """Flush the pipeline, then close the connections and offline buffers."""
+    pipeline.stop()
+    await hass.async_add_executor_job(pipeline.join)
+    await client.async_disconnect_mqtt()
+
+
 async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
     """Reload config entry."""
-    await async_setup_entry(hass, entry)
+    await hass.config_entries.async_reload(entry.entry_id)
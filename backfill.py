@@ -0,0 +1,178 @@
+"""Recorder history backfill for Helixer."""
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime
+from typing import Any
+
+import voluptuous as vol
+from homeassistant.const import ATTR_ENTITY_ID
+from homeassistant.core import HomeAssistant, ServiceCall, State, callback
+from homeassistant.exceptions import ServiceValidationError
+from homeassistant.helpers import config_validation as cv
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN, LOGGER
+from .encoder import parse_state
+from .entity_filter import HelixerEntityFilter
+from .pipeline import HelixerPipeline
+
+SERVICE_BACKFILL = "backfill"
+ATTR_START_TIME = "start_time"
+ATTR_END_TIME = "end_time"
+
+BACKFILL_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+        vol.Required(ATTR_START_TIME): cv.datetime,
+        vol.Optional(ATTR_END_TIME): cv.datetime,
+    }
+)
+
+# State changes read from the recorder and published per payload.
+BACKFILL_PAGE_ROWS = 500
+# Pause between two pages so live traffic and the recorder keep up.
+BACKFILL_INTERVAL = 0.5
+
+
+class HelixerBackfill:
+    """Publish the recorder history of entities as historical DataSet metrics.
+
+    History is read one page of ``BACKFILL_PAGE_ROWS`` state changes at a
+    time on the recorder's database executor, so memory stays bounded
+    whatever the time range. Every page is handed to the pipeline, which
+    publishes it as one DDATA with a historical ``history/state`` DataSet of
+    timestamp and value, declared in the DBIRTH of the device. Unknown and
+    unavailable states are left out. While the pipeline is paused the
+    backfill waits. One backfill runs at a time.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        pipeline: HelixerPipeline,
+        entity_filter: HelixerEntityFilter,
+    ) -> None:
+        self._hass = hass
+        self._pipeline = pipeline
+        self._entity_filter = entity_filter
+        self._task: asyncio.Task | None = None
+
+        self.entities = 0
+        self.rows = 0
+        self.payloads = 0
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        """Return the backfill counters."""
+        return {
+            "running": self._task is not None,
+            "entities": self.entities,
+            "rows": self.rows,
+            "payloads": self.payloads,
+        }
+
+    @callback
+    def async_start(
+        self, entity_ids: list[str], start: datetime, end: datetime
+    ) -> None:
+        """Start a backfill in the background."""
+        if self._task is not None:
+            raise ServiceValidationError("A Helixer backfill is already running")
+        self._task = self._hass.async_create_background_task(
+            self._async_backfill(entity_ids, start, end), "helixer backfill"
+        )
+
+    @callback
+    def async_stop(self) -> None:
+        """Cancel a running backfill."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _async_backfill(
+        self, entity_ids: list[str], start: datetime, end: datetime
+    ) -> None:
+        # pylint: disable-next=import-outside-toplevel
+        from homeassistant.components.recorder import get_instance
+
+        recorder = get_instance(self._hass)
+        LOGGER.info(
+            "Backfilling %s entities from %s to %s", len(entity_ids), start, end
+        )
+        try:
+            for entity_id in entity_ids:
+                if not self._entity_filter(entity_id):
+                    LOGGER.warning("Not backfilling %s, it is not published", entity_id)
+                    continue
+                self.entities += 1
+                page_start = start
+                while True:
+                    states = await recorder.async_add_executor_job(
+                        self._read_page, entity_id, page_start, end
+                    )
+                    if states:
+                        rows = await self._hass.async_add_executor_job(
+                            self._rows, states
+                        )
+                        if rows:
+                            await self._async_enqueue(entity_id, rows)
+                    if len(states) < BACKFILL_PAGE_ROWS:
+                        break
+                    # Pages are ascending, the next one starts after this one.
+                    page_start = states[-1].last_updated
+                    await asyncio.sleep(BACKFILL_INTERVAL)
+        finally:
+            self._task = None
+        LOGGER.info("Finished backfilling %s entities", len(entity_ids))
+
+    def _read_page(self, entity_id: str, start: datetime, end: datetime) -> list[State]:
+        """Return the next page of state changes, runs on the recorder executor."""
+        # pylint: disable-next=import-outside-toplevel
+        from homeassistant.components.recorder import history
+
+        return history.state_changes_during_period(
+            self._hass,
+            start,
+            end,
+            entity_id,
+            no_attributes=True,
+            limit=BACKFILL_PAGE_ROWS,
+            include_start_time_state=False,
+        ).get(entity_id, [])
+
+    async def _async_enqueue(self, entity_id: str, rows: list[tuple[int, Any]]) -> None:
+        """Hand a page to the pipeline, waiting while it is paused or full."""
+        while self._pipeline.paused or not self._pipeline.enqueue_history(
+            entity_id, rows
+        ):
+            await asyncio.sleep(BACKFILL_INTERVAL)
+        self.rows += len(rows)
+        self.payloads += 1
+
+    def _rows(self, states: list[State]) -> list[tuple[int, Any]]:
+        """Return the ``(timestamp, value)`` rows of the known states."""
+        rows = []
+        for state in states:
+            value = parse_state(state.state)
+            if value is not None:
+                rows.append((int(state.last_updated.timestamp() * 1000), value))
+        return rows
+
+
+@callback
+def async_setup_services(hass: HomeAssistant) -> None:
+    """Register the backfill service, which runs on every config entry."""
+
+    @callback
+    def _async_backfill(call: ServiceCall) -> None:
+        start = dt_util.as_utc(call.data[ATTR_START_TIME])
+        end = dt_util.as_utc(call.data.get(ATTR_END_TIME) or dt_util.utcnow())
+        if start >= end:
+            raise ServiceValidationError("The start time must be before the end time")
+        for data in hass.data.get(DOMAIN, {}).values():
+            data["backfill"].async_start(call.data[ATTR_ENTITY_ID], start, end)
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_BACKFILL, _async_backfill, schema=BACKFILL_SCHEMA
+    )
@@ -0,0 +1,362 @@
+"""Benchmark the listener -> protobuf -> MQTT path of the Helixer integration.
+
+Synthetic state changes are fed through the real listener, pipeline and
+publisher into an in-process sink that stands in for the MQTT client, so the
+benchmark runs offline with only Home Assistant installed.
+
+    python benchmarks/bench_listener.py --entities 2000 --events 100000
+    python benchmarks/bench_listener.py --mode publisher --dict-attrs 2 --json
+
+``--mode pipeline`` (the default) drives state changes through the event bus
+and measures the loop-side cost of every event as well as the time until it
+was published. ``--mode publisher`` calls the publisher synchronously and
+isolates the diffing, encoding and serialization cost. ``--verify`` parses
+every payload and serializes it again with the generated classes, counting
+the payloads that differ, to compare ``--serializer streaming`` against
+protobuf on the traffic of a run.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+import importlib.util
+import json
+from pathlib import Path
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any
+
+from homeassistant.core import HomeAssistant, State
+from homeassistant.helpers import (
+    area_registry as ar,
+    device_registry as dr,
+    entity_registry as er,
+)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_integration():
+    """Import the repository root as the ``helixer`` package."""
+    spec = importlib.util.spec_from_file_location(
+        "helixer", ROOT / "__init__.py", submodule_search_locations=[str(ROOT)]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["helixer"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class SinkClient:
+    """Stand-in for HelixerClient that serializes and counts instead of sending."""
+
+    def __init__(self, verify: bool = False) -> None:
+        self._verify = verify
+        self.mismatches = 0
+        self.payloads = 0
+        self.bytes = 0
+        self.metrics = 0
+        self.published_at: dict[str, deque[float]] = defaultdict(deque)
+        self.latencies: list[float] = []
+
+    def add_connect_callback(self, connect_callback) -> None:
+        """Nothing ever connects."""
+
+    def start_replay(self, devices) -> None:
+        """Nothing is buffered."""
+
+    def publish(self, topic: str, payload) -> None:
+        data = payload.SerializeToString()
+        now = time.perf_counter()
+        self.payloads += 1
+        self.bytes += len(data)
+        self.metrics += len(payload.metrics)
+        if self._verify:
+            sparkplugb_pb2 = importlib.import_module("helixer.sparkplugb_pb2")
+            if sparkplugb_pb2.Payload.FromString(data).SerializeToString() != data:
+                self.mismatches += 1
+
+        device_id = topic.split("/", 4)[-1]
+        queued = self.published_at.get(device_id)
+        while queued:
+            self.latencies.append(now - queued.popleft())
+
+
+class StateGenerator:
+    """Produce a reproducible stream of state changes."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self._random = random.Random(args.seed)
+        self._args = args
+        self.entity_ids = [f"sensor.bench_{i}" for i in range(args.entities)]
+        self.states: dict[str, State] = {
+            entity_id: State(entity_id, "0", self._attributes({}))
+            for entity_id in self.entity_ids
+        }
+
+    def _attributes(self, previous: dict[str, Any]) -> dict[str, Any]:
+        args = self._args
+        rnd = self._random
+        attributes: dict[str, Any] = {"device_class": "power", "unit": "W"}
+
+        def changed(name: str, value: Any) -> Any:
+            if name in previous and rnd.random() >= args.attr_change:
+                return previous[name]
+            return value
+
+        for i in range(args.attrs):
+            attributes[f"number_{i}"] = changed(
+                f"number_{i}", round(rnd.uniform(0, 1000), 3)
+            )
+        for i in range(args.string_attrs):
+            attributes[f"string_{i}"] = changed(
+                f"string_{i}", rnd.choice(("idle", "on", "off", "heating"))
+            )
+        for i in range(args.dict_attrs):
+            attributes[f"dict_{i}"] = changed(
+                f"dict_{i}",
+                {f"key_{k}": rnd.randint(0, 100) for k in range(args.dict_len)},
+            )
+        for i in range(args.list_attrs):
+            attributes[f"list_{i}"] = changed(
+                f"list_{i}", [rnd.randint(0, 255) for _ in range(args.list_len)]
+            )
+        return attributes
+
+    def next(self) -> tuple[str, State, State]:
+        """Return entity_id, old and new state of the next change."""
+        entity_id = self._random.choice(self.entity_ids)
+        old = self.states[entity_id]
+        new = State(
+            entity_id,
+            str(round(self._random.uniform(0, 5000), 2)),
+            self._attributes(dict(old.attributes)),
+            last_updated=datetime.now(timezone.utc),
+        )
+        self.states[entity_id] = new
+        return entity_id, old, new
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def make_hass() -> HomeAssistant:
+    hass = HomeAssistant(tempfile.mkdtemp(prefix="helixer-bench-"))
+    await ar.async_load(hass)
+    await dr.async_load(hass)
+    await er.async_load(hass)
+    return hass
+
+
+def build_publisher(hass: HomeAssistant, client: SinkClient, args):
+    deadband = importlib.import_module("helixer.deadband")
+    publisher = importlib.import_module("helixer.publisher")
+    registry = importlib.import_module("helixer.registry")
+    wire = importlib.import_module("helixer.wire")
+
+    return publisher.HelixerBatchPublisher(
+        client,
+        registry.HelixerMetricRegistry(hass),
+        deadband.HelixerDeadband(json.loads(args.deadband)),
+        "helixer",
+        min_interval=args.flush_min / 1000,
+        max_interval=args.flush_max / 1000,
+        max_metrics=args.max_metrics,
+        writer=wire.PayloadWriter() if args.serializer == "streaming" else None,
+    )
+
+
+async def run_pipeline(hass: HomeAssistant, args) -> dict[str, Any]:
+    entity_filter = importlib.import_module("helixer.entity_filter")
+    listener_module = importlib.import_module("helixer.listener")
+    pipeline_module = importlib.import_module("helixer.pipeline")
+    stats_module = importlib.import_module("helixer.stats")
+
+    client = SinkClient(args.verify)
+    generator = StateGenerator(args)
+    for entity_id, state in generator.states.items():
+        hass.states.async_set(entity_id, state.state, state.attributes)
+
+    publisher = build_publisher(hass, client, args)
+    pipeline = pipeline_module.HelixerPipeline(
+        publisher, args.queue_size, args.drop_policy
+    )
+    listener = listener_module.HelixerListener(
+        pipeline,
+        entity_filter.HelixerEntityFilter(hass, {}),
+        stats_module.HelixerStats(),
+    )
+    pipeline.start()
+    listener.ha_started(hass)
+
+    loop_latencies: list[float] = []
+    # Throttled runs emit a batch every 10 ms.
+    batch = max(int(args.rate / 100), 1) if args.rate else args.events
+
+    start = time.perf_counter()
+    sent = 0
+    while sent < args.events:
+        for _ in range(min(batch, args.events - sent)):
+            entity_id, _, new = generator.next()
+            queued = client.published_at[entity_id.replace(".", "/")]
+            before = time.perf_counter()
+            queued.append(before)
+            hass.states.async_set(entity_id, new.state, new.attributes)
+            loop_latencies.append(time.perf_counter() - before)
+            sent += 1
+        await asyncio.sleep(0.01 if args.rate else 0)
+
+    listener.stop()
+    await hass.async_add_executor_job(pipeline.join)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed": elapsed,
+        "client": client,
+        "pipeline": pipeline.stats,
+        "publisher": publisher.stats,
+        "loop_latencies": loop_latencies,
+    }
+
+
+async def run_publisher(hass: HomeAssistant, args) -> dict[str, Any]:
+    client = SinkClient(args.verify)
+    generator = StateGenerator(args)
+    publisher = build_publisher(hass, client, args)
+    changes = [generator.next() for _ in range(args.events)]
+
+    latencies: list[float] = []
+    start = time.perf_counter()
+    flush_at = start + publisher.interval
+    for entity_id, old, new in changes:
+        before = time.perf_counter()
+        client.published_at[entity_id.replace(".", "/")].append(before)
+        if publisher.add_state(entity_id, old, new) or before >= flush_at:
+            publisher.flush()
+            flush_at = time.perf_counter() + publisher.interval
+        latencies.append(time.perf_counter() - before)
+    publisher.flush()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed": elapsed,
+        "client": client,
+        "publisher": publisher.stats,
+        "loop_latencies": latencies,
+    }
+
+
+def report(
+    result: dict[str, Any], args, allocations: dict[str, int] | None
+) -> None:
+    client: SinkClient = result.pop("client")
+    elapsed = result["elapsed"]
+    loop_latencies = result.pop("loop_latencies")
+
+    summary = {
+        "mode": args.mode,
+        "entities": args.entities,
+        "events": args.events,
+        "elapsed_s": round(elapsed, 3),
+        "events_per_s": round(args.events / elapsed, 1),
+        "payloads_per_s": round(client.payloads / elapsed, 1),
+        "bytes_per_s": round(client.bytes / elapsed, 1),
+        "metrics_per_payload": round(client.metrics / max(client.payloads, 1), 2),
+        "event_p50_us": round(percentile(loop_latencies, 0.5) * 1e6, 1),
+        "event_p99_us": round(percentile(loop_latencies, 0.99) * 1e6, 1),
+        "publish_p50_ms": round(percentile(client.latencies, 0.5) * 1e3, 2),
+        "publish_p99_ms": round(percentile(client.latencies, 0.99) * 1e3, 2),
+        **{f"publisher_{key}": value for key, value in result["publisher"].items()},
+    }
+    if args.verify:
+        summary["verify_mismatches"] = client.mismatches
+    if "pipeline" in result:
+        summary.update(
+            {f"pipeline_{key}": value for key, value in result["pipeline"].items()}
+        )
+    if allocations is not None:
+        summary.update(allocations)
+
+    if args.json:
+        print(json.dumps(summary))
+        return
+    width = max(len(key) for key in summary)
+    for key, value in summary.items():
+        print(f"{key:<{width}}  {value}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    load_integration()
+    hass = await make_hass()
+
+    if args.trace_alloc:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+
+    runner = run_pipeline if args.mode == "pipeline" else run_publisher
+    result = await runner(hass, args)
+
+    allocations = None
+    if args.trace_alloc:
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+        tracemalloc.stop()
+        allocations = {
+            "alloc_current_kb": current // 1024,
+            "alloc_peak_kb": peak // 1024,
+            "alloc_live_blocks": blocks,
+        }
+
+    report(result, args, allocations)
+    await hass.async_stop(force=True)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--mode", choices=("pipeline", "publisher"), default="pipeline"
+    )
+    parser.add_argument("--entities", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument(
+        "--rate", type=float, default=0, help="events per second, 0 is unthrottled"
+    )
+    parser.add_argument("--attrs", type=int, default=4, help="numeric attributes")
+    parser.add_argument("--string-attrs", type=int, default=2)
+    parser.add_argument("--dict-attrs", type=int, default=0)
+    parser.add_argument("--dict-len", type=int, default=4)
+    parser.add_argument("--list-attrs", type=int, default=0)
+    parser.add_argument("--list-len", type=int, default=3)
+    parser.add_argument(
+        "--attr-change", type=float, default=0.3, help="chance an attribute changes"
+    )
+    parser.add_argument("--flush-min", type=float, default=50, help="ms")
+    parser.add_argument("--flush-max", type=float, default=500, help="ms")
+    parser.add_argument("--max-metrics", type=int, default=1000)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument(
+        "--drop-policy", choices=("drop_oldest", "drop_newest"), default="drop_oldest"
+    )
+    parser.add_argument("--deadband", default="{}", help="deadband rules as JSON")
+    parser.add_argument(
+        "--serializer", choices=("streaming", "protobuf"), default="streaming"
+    )
+    parser.add_argument("--verify", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--trace-alloc", action="store_true")
+    parser.add_argument("--json", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,294 @@
+"""Store-and-forward buffer for Helixer."""
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Callable, Iterator
+import os
+import struct
+import threading
+
+from . import sparkplugb_pb2
+from .const import LOGGER
+
+# Births and deaths are regenerated on reconnect, only data is worth keeping.
+BUFFERED_MESSAGE_TYPES = ("DDATA", "NDATA")
+
+RECORD_HEADER = struct.Struct(">HI")
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SIZE = 4 * 1024 * 1024
+
+
+def is_bufferable(topic: str) -> bool:
+    """Return True if messages on this topic should be kept while offline."""
+    parts = topic.split("/", 3)
+    return len(parts) > 2 and parts[2] in BUFFERED_MESSAGE_TYPES
+
+
+def mark_historical(data: bytes) -> sparkplugb_pb2.Payload:
+    """Parse a buffered payload and flag every metric as historical."""
+    payload = sparkplugb_pb2.Payload()
+    payload.ParseFromString(data)
+    for metric in payload.metrics:
+        metric.is_historical = True
+    return payload
+
+
+class HelixerOfflineBuffer:
+    """Bounded in-memory ring of serialized payloads that spills to disk.
+
+    When the memory ring is full the oldest half is appended to segment files
+    in ``path``. Segments are always older than the ring, so replaying the
+    segments before the ring keeps the original order. When the segments
+    exceed ``max_disk`` bytes the oldest segments are dropped, the one being
+    written included, so nothing is kept on disk with a ``max_disk`` of 0.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_memory: int,
+        max_disk: int,
+        replay_rate: float,
+    ) -> None:
+        self._path = path
+        self._max_memory = max_memory
+        self._max_disk = max_disk
+        self._replay_rate = replay_rate
+
+        self._lock = threading.Lock()
+        self._ring: deque[tuple[str, bytes]] = deque()
+        self._ring_bytes = 0
+        self._segments: list[str] = []
+        self._next_segment = 0
+        self._segment_file = None
+        self._segment_bytes = 0
+        self._disk_bytes = 0
+
+        self._replay_thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+        self.buffered = 0
+        self.replayed = 0
+        self.dropped = 0
+
+        os.makedirs(self._path, exist_ok=True)
+        for name in sorted(os.listdir(self._path)):
+            if not name.startswith(SEGMENT_PREFIX):
+                continue
+            segment = os.path.join(self._path, name)
+            if name.endswith(".tmp"):
+                # Left behind by a rewrite that was interrupted, the segment
+                # itself is still complete.
+                os.remove(segment)
+                continue
+            self._segments.append(segment)
+            self._disk_bytes += os.path.getsize(segment)
+            self._next_segment = int(name[len(SEGMENT_PREFIX) :]) + 1
+
+        if self._segments:
+            LOGGER.info(
+                "Found %s bytes of buffered data in %s", self._disk_bytes, self._path
+            )
+
+    def __len__(self) -> int:
+        return len(self._ring) + len(self._segments)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Return the buffer counters."""
+        return {
+            "buffered": self.buffered,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+            "memory_bytes": self._ring_bytes,
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def append(self, topic: str, data: bytes) -> None:
+        """Store a message that could not be delivered."""
+        with self._lock:
+            self._ring.append((topic, data))
+            self._ring_bytes += len(data)
+            self.buffered += 1
+
+            if self._ring_bytes > self._max_memory:
+                self._spill(len(self._ring) // 2 or 1)
+
+    def close(self) -> None:
+        """Stop replaying and persist everything still held in memory."""
+        self._stop.set()
+        if self._replay_thread is not None:
+            self._replay_thread.join()
+            self._replay_thread = None
+
+        with self._lock:
+            if self._ring:
+                self._spill(len(self._ring))
+            self._close_segment()
+
+    def start_replay(
+        self, publish: Callable[[str, sparkplugb_pb2.Payload], bool | None]
+    ) -> None:
+        """Replay the buffered messages in a background thread.
+
+        ``publish`` is handed the payloads with their metrics flagged as
+        historical, and must return False when the message could not be sent, in
+        which case the message is kept and the replay stops until the next
+        call. It returns None for a message it discards.
+        """
+        if not len(self) or (
+            self._replay_thread is not None and self._replay_thread.is_alive()
+        ):
+            return
+
+        self._stop.clear()
+        self._replay_thread = threading.Thread(
+            target=self._replay, args=(publish,), name="helixer-replay", daemon=True
+        )
+        self._replay_thread.start()
+
+    def _replay(
+        self, publish: Callable[[str, sparkplugb_pb2.Payload], bool | None]
+    ) -> None:
+        interval = 1 / self._replay_rate
+        LOGGER.info("Replaying buffered messages at %s/s", self._replay_rate)
+
+        while not self._stop.is_set():
+            with self._lock:
+                if self._segments:
+                    self._close_segment()
+                    segment = self._segments[0]
+                else:
+                    segment = None
+                    if not self._ring:
+                        break
+                    topic, data = self._ring.popleft()
+                    self._ring_bytes -= len(data)
+
+            if segment is not None:
+                if not self._replay_segment(segment, publish, interval):
+                    return
+                continue
+
+            sent = publish(topic, mark_historical(data))
+            if sent is False:
+                with self._lock:
+                    self._ring.appendleft((topic, data))
+                    self._ring_bytes += len(data)
+                return
+            self._count(sent, interval)
+
+        LOGGER.info("Finished replaying buffered messages")
+
+    def _count(self, sent: bool | None, interval: float) -> None:
+        """Count a replayed or discarded message, pacing the replay."""
+        if sent is None:
+            self.dropped += 1
+            return
+        self.replayed += 1
+        self._stop.wait(interval)
+
+    def _replay_segment(
+        self,
+        segment: str,
+        publish: Callable[[str, sparkplugb_pb2.Payload], bool | None],
+        interval: float,
+    ) -> bool:
+        try:
+            with open(segment, "rb") as file:
+                records = list(_read_records(file))
+        except FileNotFoundError:
+            # Dropped to make room since it was picked.
+            return True
+
+        for index, (topic, data) in enumerate(records):
+            sent = (
+                False
+                if self._stop.is_set()
+                else publish(topic, mark_historical(data))
+            )
+            if sent is False:
+                # Keep what is left of the segment for the next replay.
+                with self._lock:
+                    if segment in self._segments:
+                        self._rewrite_segment(segment, records[index:])
+                return False
+            self._count(sent, interval)
+
+        with self._lock:
+            # The segment may have been dropped meanwhile to make room.
+            if segment in self._segments:
+                self._remove_segment(segment)
+        return True
+
+    def _spill(self, count: int) -> None:
+        """Move the oldest ``count`` messages of the ring to disk."""
+        for _ in range(count):
+            topic, data = self._ring.popleft()
+            self._ring_bytes -= len(data)
+
+            if self._segment_file is None or self._segment_bytes >= SEGMENT_SIZE:
+                self._open_segment()
+
+            encoded_topic = topic.encode()
+            record = RECORD_HEADER.pack(len(encoded_topic), len(data))
+            self._segment_file.write(record + encoded_topic + data)
+            size = RECORD_HEADER.size + len(encoded_topic) + len(data)
+            self._segment_bytes += size
+            self._disk_bytes += size
+
+        self._segment_file.flush()
+
+        while self._disk_bytes > self._max_disk and self._segments:
+            segment = self._segments[0]
+            with open(segment, "rb") as file:
+                self.dropped += sum(1 for _ in _read_records(file))
+            LOGGER.warning("Offline buffer full, dropping %s", segment)
+            self._remove_segment(segment)
+
+    def _open_segment(self) -> None:
+        self._close_segment()
+        # Names are never reused, the replay may still hold a dropped one.
+        segment = os.path.join(
+            self._path, f"{SEGMENT_PREFIX}{self._next_segment:010d}"
+        )
+        self._next_segment += 1
+        self._segments.append(segment)
+        self._segment_file = open(segment, "ab")  # pylint: disable=consider-using-with
+        self._segment_bytes = 0
+
+    def _close_segment(self) -> None:
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._segment_file = None
+
+    def _remove_segment(self, segment: str) -> None:
+        if self._segments and self._segments[-1] == segment:
+            self._close_segment()
+        self._segments.remove(segment)
+        self._disk_bytes -= os.path.getsize(segment)
+        os.remove(segment)
+
+    def _rewrite_segment(self, segment: str, records: list[tuple[str, bytes]]) -> None:
+        tmp = f"{segment}.tmp"
+        with open(tmp, "wb") as file:
+            for topic, data in records:
+                encoded_topic = topic.encode()
+                file.write(RECORD_HEADER.pack(len(encoded_topic), len(data)))
+                file.write(encoded_topic + data)
+        self._disk_bytes += os.path.getsize(tmp) - os.path.getsize(segment)
+        os.replace(tmp, segment)
+
+
+def _read_records(file) -> Iterator[tuple[str, bytes]]:
+    """Yield the records of a segment, ignoring a truncated trailing record."""
+    while True:
+        header = file.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        topic_length, data_length = RECORD_HEADER.unpack(header)
+        topic = file.read(topic_length)
+        data = file.read(data_length)
+        if len(topic) < topic_length or len(data) < data_length:
+            return
+        yield topic.decode(), data
@@ -0,0 +1,64 @@
+"""Compact cache of the last published metric values for Helixer."""
+from __future__ import annotations
+
+from array import array
+from collections.abc import Iterator
+from typing import Any
+
+_MISSING = object()
+
+
+class HelixerPublishedCache:
+    """Last value and timestamp the host received for every metric.
+
+    Aliases are small integers handed out in sequence, so values live in a
+    list and timestamps in an array, both indexed by alias; every device only
+    keeps an array of its aliases. Memory grows by about 20 bytes per metric
+    plus the values themselves. Only successful publishes update the cache.
+    """
+
+    __slots__ = ("_values", "_timestamps", "_devices", "_size")
+
+    def __init__(self) -> None:
+        self._values: list[Any] = []
+        self._timestamps = array("q")
+        self._devices: dict[str, array] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def devices(self) -> int:
+        """Return the number of devices with a published value."""
+        return len(self._devices)
+
+    def matches(self, alias: int, value: Any) -> bool:
+        """Return True if the host already has this value of a metric."""
+        if alias >= len(self._values):
+            return False
+        cached = self._values[alias]
+        return type(cached) is type(value) and cached == value
+
+    def update(self, device_id: str, alias: int, value: Any, timestamp: int) -> None:
+        """Record a value the host received."""
+        values = self._values
+        if alias >= len(values):
+            missing = alias + 1 - len(values)
+            values.extend([_MISSING] * missing)
+            self._timestamps.extend(array("q", bytes(8 * missing)))
+        if values[alias] is _MISSING:
+            aliases = self._devices.get(device_id)
+            if aliases is None:
+                aliases = self._devices[device_id] = array("I")
+            aliases.append(alias)
+            self._size += 1
+        values[alias] = value
+        self._timestamps[alias] = timestamp
+
+    def device(self, device_id: str) -> Iterator[tuple[int, Any, int]]:
+        """Yield the alias, value and timestamp of every metric of a device."""
+        values = self._values
+        timestamps = self._timestamps
+        for alias in self._devices.get(device_id, ()):
+            yield alias, values[alias], timestamps[alias]
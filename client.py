@@ -1,7 +1,32 @@
+import asyncio
+from collections.abc import Callable, Collection
+import functools
+import os
 import paho.mqtt.client as mqtt
 import socket
+from . import sparkplugb_pb2
+from .buffer import HelixerOfflineBuffer, is_bufferable
 from .const import LOGGER
+from .session import HelixerSession
+from .stats import HelixerStats
 import tempfile
+import threading
+import time
+
+# Seconds to wait for the broker to accept the connection.
+CONNECT_TIMEOUT = 10
+# Reconnect delays double from the minimum up to the maximum, in seconds.
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 120
+# Messages handed to paho and not sent yet before publishing waits, and for
+# how many seconds at most.
+MAX_OUTSTANDING_MESSAGES = 1000
+OUTSTANDING_WAIT_TIMEOUT = 5
+# Seconds a clean disconnect waits for the NDEATH to be acknowledged.
+DEATH_TIMEOUT = 2
+
+# CONNACK codes of rejected credentials, MQTT 3.1.1 and 5.
+AUTH_FAILURES = (4, 5, 134, 135)
 
 
 class HelixerClientError(Exception):
@@ -17,7 +42,13 @@ class HelixerClientAuthenticationError(HelixerClientError):
 
 
 class HelixerClient:
-    """Helixer API Client."""
+    """Helixer API Client.
+
+    Connecting and disconnecting block and are meant for an executor thread;
+    ``async_connect_mqtt`` and ``async_disconnect_mqtt`` wrap them for the
+    event loop. The TLS handshake runs in the paho network thread, which also
+    reconnects with exponential backoff after the connection drops.
+    """
 
     def __init__(
         self,
@@ -28,6 +59,10 @@ class HelixerClient:
         key: str = None,
         cert: str = None,
         ca: str = None,
+        offline_buffer: HelixerOfflineBuffer | None = None,
+        stats: HelixerStats | None = None,
+        compressor: Callable[[str, bytes], bytes] | None = None,
+        session: HelixerSession | None = None,
     ) -> None:
         self._username = username
         self._password = password
@@ -36,38 +71,181 @@ class HelixerClient:
         self._key = key
         self._cert = cert
         self._ca = ca
+        self._buffer = offline_buffer
+        self.stats = stats or HelixerStats()
+        self._compressor = compressor
+        self._session = session
+        # Keeps seq in the order messages are handed to paho.
+        self._send_lock = threading.Lock()
+        # Publishes handed to paho and not written out (QoS 0) or not
+        # acknowledged (QoS 1) yet, as reported by on_publish.
+        self._outstanding = 0
+        self._outstanding_changed = threading.Condition()
         self._mqtt_client = mqtt.Client(
             protocol=mqtt.MQTTv5, transport="tcp", reconnect_on_failure=True
         )
 
-        self.store_certs()
+        self._connect_callbacks: list[Callable[[], None]] = []
+        self._subscriptions: dict[str, Callable[[str, bytes], None]] = {}
+        self._prefix_subscriptions: dict[str, Callable[[str, bytes], None]] = {}
+        self._connected = threading.Event()
+        self._connect_result = None
+        self._tls_configured = False
+        self._started = False
 
-        self._mqtt_client.on_connect = on_connect
-        self._mqtt_client.on_disconnect = on_disconnect
+        self._mqtt_client.on_connect = self._on_connect
+        self._mqtt_client.on_disconnect = self._on_disconnect
+        self._mqtt_client.on_message = self._on_message
+        self._mqtt_client.on_publish = self._on_publish
 
         self._mqtt_client.username_pw_set(f"{self._username}", f"{self._password}")
-        self._mqtt_client.tls_set(
-            ca_certs=self._ca_tmp.name,
-            certfile=self._cert_tmp.name,
-            keyfile=self._key_tmp.name,
-        )
+        self._mqtt_client.reconnect_delay_set(RECONNECT_MIN_DELAY, RECONNECT_MAX_DELAY)
+        self._set_will()
+
+    def _configure_tls(self) -> None:
+        """Load the certificates, which paho only accepts as files."""
+        paths = []
+        try:
+            for pem in (self._ca, self._cert, self._key):
+                with tempfile.NamedTemporaryFile(delete=False) as file:
+                    paths.append(file.name)
+                    file.write(str.encode(pem))
+            # The SSL context reads the files right away, they can go after.
+            self._mqtt_client.tls_set(
+                ca_certs=paths[0], certfile=paths[1], keyfile=paths[2]
+            )
+        finally:
+            for path in paths:
+                os.remove(path)
+        self._tls_configured = True
+
+    def _set_will(self) -> None:
+        """Let the broker publish the NDEATH of the session if we vanish.
+
+        Sparkplug requires the will to be registered with QoS 1.
+        """
+        if self._session is not None:
+            self._mqtt_client.will_set(
+                self._session.death_topic,
+                self._session.death_payload(int(time.time() * 1000)),
+                qos=1,
+            )
+
+    def add_connect_callback(self, connect_callback: Callable[[], None]) -> None:
+        """Register a callback run from the network thread after every connect."""
+        self._connect_callbacks.append(connect_callback)
+
+    def subscribe(
+        self, topic: str, message_callback: Callable[[str, bytes], None]
+    ) -> None:
+        """Subscribe to a topic on every connect.
+
+        The callback runs in the network thread with the topic and the raw
+        payload. Topics ending in ``/#`` match every topic below them.
+        """
+        if topic.endswith("/#"):
+            self._prefix_subscriptions[topic[:-1]] = message_callback
+        else:
+            self._subscriptions[topic] = message_callback
+        if self._mqtt_client.is_connected():
+            self._mqtt_client.subscribe(topic)
+
+    @property
+    def is_connected(self) -> bool:
+        """Return True while connected to the broker."""
+        return self._mqtt_client.is_connected()
+
+    @property
+    def outbound_queue_depth(self) -> int:
+        """Return the number of messages paho has not finished sending."""
+        return self._outstanding
+
+    def _wait_for_room(self) -> None:
+        """Wait while paho has too many messages to send, as flow control.
+
+        Publishing carries on after the timeout, the queue then grows.
+        """
+        with self._outstanding_changed:
+            if self._outstanding < MAX_OUTSTANDING_MESSAGES:
+                return
+            self.stats.publish_waits += 1
+            self._outstanding_changed.wait_for(
+                lambda: self._outstanding < MAX_OUTSTANDING_MESSAGES,
+                OUTSTANDING_WAIT_TIMEOUT,
+            )
+
+    def _paho_publish(self, topic: str, payload: bytes, qos: int = 0):
+        """Hand a message to paho, counting it until on_publish reports it."""
+        with self._outstanding_changed:
+            self._outstanding += 1
+        try:
+            info = self._mqtt_client.publish(topic=topic, payload=payload, qos=qos)
+        except Exception:
+            self._published()
+            raise
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self._published()
+        return info
 
-    def store_certs(self):
-        self._key_tmp = tempfile.NamedTemporaryFile(delete=False)
-        self._cert_tmp = tempfile.NamedTemporaryFile(delete=False)
-        self._ca_tmp = tempfile.NamedTemporaryFile(delete=False)
+    def _on_publish(self, client, userdata, mid):
+        self._published()
 
-        self._key_tmp.write(str.encode(self._key))
-        self._key_tmp.seek(0)
+    def _published(self) -> None:
+        with self._outstanding_changed:
+            if self._outstanding:
+                self._outstanding -= 1
+                self._outstanding_changed.notify()
 
-        self._cert_tmp.write(str.encode(self._cert))
-        self._cert_tmp.seek(0)
+    def _reset_outstanding(self) -> None:
+        # paho drops unsent packets on reconnect without calling on_publish.
+        with self._outstanding_changed:
+            self._outstanding = 0
+            self._outstanding_changed.notify_all()
 
-        self._ca_tmp.write(str.encode(self._ca))
-        self._ca_tmp.seek(0)
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        on_connect(client, userdata, flags, reason_code, properties)
+        self._reset_outstanding()
+        self._connect_result = reason_code
+        self._connected.set()
+        if reason_code != 0:
+            return
+        if self.stats.connects:
+            self.stats.reconnects += 1
+        self.stats.connects += 1
+        for topic in self._subscriptions:
+            self._mqtt_client.subscribe(topic)
+        for prefix in self._prefix_subscriptions:
+            self._mqtt_client.subscribe(f"{prefix}#")
+        for connect_callback in self._connect_callbacks:
+            connect_callback()
+
+    def _on_disconnect(self, client, userdata, flags, reason_code):
+        on_disconnect(client, userdata, flags, reason_code)
+        self.stats.disconnects += 1
+        self._reset_outstanding()
+        if self._session is not None:
+            # The next connection is a new session, announced by a new will.
+            with self._send_lock:
+                self._session.new_session()
+                self._set_will()
+
+    def _on_message(self, client, userdata, message):
+        topic = message.topic
+        message_callback = self._subscriptions.get(topic)
+        if message_callback is None:
+            for prefix, callback in self._prefix_subscriptions.items():
+                if topic.startswith(prefix):
+                    message_callback = callback
+                    break
+            else:
+                return
+        try:
+            message_callback(topic, message.payload)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("Error handling message on topic %s", message.topic)
 
-    def connect_mqtt(self):
-        """Connect to the MQTT broker."""
+    def connect_mqtt(self, timeout: float = CONNECT_TIMEOUT) -> None:
+        """Connect to the MQTT broker, blocking until it accepts or refuses."""
         LOGGER.debug(
             "Connecting to MQTT broker %s:%s",
             self._mqtt_broker,
@@ -75,59 +253,177 @@ class HelixerClient:
         )
 
         try:
+            if not self._tls_configured:
+                self._configure_tls()
             LOGGER.debug("Authenticating to MQTT broker as %s ", self._username)
-            self._mqtt_client.connect(self._mqtt_broker, self._mqtt_port)
+            self._connected.clear()
+            self._mqtt_client.connect_async(self._mqtt_broker, self._mqtt_port)
+            LOGGER.debug("Starting MQTT loop")
+            self._mqtt_client.loop_start()
+            self._started = True
+        except Exception as exception:
+            LOGGER.warning(exception)
+            raise HelixerClientError("Could not connect to MQTT broker") from exception
 
-        except socket.error as exception:
+        if not self._connected.wait(timeout):
+            self._stop_loop()
             LOGGER.error(
-                "Could not connect to MQTT broker %s:%s reason: %s",
+                "Could not connect to MQTT broker %s:%s within %s seconds",
                 self._mqtt_broker,
                 self._mqtt_port,
-                exception,
+                timeout,
             )
+            raise HelixerClientConnectionError("Could not connect to MQTT broker")
+        if self._connect_result != 0:
+            self._stop_loop()
+            if self._connect_result in AUTH_FAILURES:
+                raise HelixerClientAuthenticationError(
+                    f"MQTT broker refused the credentials: {self._connect_result}"
+                )
             raise HelixerClientConnectionError(
-                "Could not connect to MQTT broker"
-            ) from exception
-        except Exception as exception:
-            LOGGER.warning(exception)
-            raise HelixerClientError("Could not connect to MQTT broker") from exception
+                f"MQTT broker refused the connection: {self._connect_result}"
+            )
 
-        LOGGER.debug("Starting MQTT loop")
-        self._mqtt_client.loop_start()
+    async def async_connect_mqtt(self, timeout: float = CONNECT_TIMEOUT) -> None:
+        """Connect to the MQTT broker without blocking the event loop."""
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.connect_mqtt, timeout
+        )
 
-        LOGGER.debug(self._mqtt_client.is_connected())
+    def _stop_loop(self) -> None:
+        self._mqtt_client.disconnect()
+        if self._started:
+            self._mqtt_client.loop_stop()
+            self._started = False
 
     def disconnect_mqtt(self):
-        """Disconnect from the MQTT broker."""
+        """Disconnect from the MQTT broker, calling it again does nothing."""
         LOGGER.debug(
             "Disconnecting from MQTT broker %s:%s", self._mqtt_broker, self._mqtt_port
         )
-        if self._mqtt_client:
-            self._mqtt_client.loop_stop()
-            self._mqtt_client.disconnect()
+        if self._started:
+            if self._session is not None and self._mqtt_client.is_connected():
+                # The broker drops the will on a clean disconnect.
+                info = self._paho_publish(
+                    self._session.death_topic,
+                    self._session.death_payload(int(time.time() * 1000)),
+                    qos=1,
+                )
+                if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                    info.wait_for_publish(DEATH_TIMEOUT)
+            self._stop_loop()
+        if self._buffer is not None:
+            self._buffer.close()
+
+    async def async_disconnect_mqtt(self) -> None:
+        """Disconnect from the MQTT broker without blocking the event loop."""
+        await asyncio.get_running_loop().run_in_executor(None, self.disconnect_mqtt)
 
     def publish(self, topic: str, payload):
-        """Publish a message to a topic."""
-        LOGGER.debug("Publishing %s to topic %s", payload, topic)
+        """Publish a message to a topic.
 
-        try:
-            self._mqtt_client.publish(topic=topic, payload=payload.SerializeToString())
-        except socket.error as exception:
-            LOGGER.error("Could not publish to topic %s reason: %s", topic, exception)
-            raise HelixerClientConnectionError(
-                "Could not publish to topic"
-            ) from exception
-        except Exception as exception:  # pylint: disable=broad-except
-            LOGGER.warning(exception)
-            raise HelixerClientError("Could not publish to topic") from exception
-
-    def __del__(self):
-        """Destructor to clean up resources."""
-        LOGGER.debug("HelixerClient Destructor called")
-        self.disconnect_mqtt()
-        self._key_tmp.close()
-        self._cert_tmp.close()
-        self._ca_tmp.close()
+        Data messages that cannot be delivered while the broker is unreachable
+        are kept in the offline buffer and replayed after reconnecting. With a
+        session, every message gets the next seq and data waits for the NBIRTH
+        of the connection. While paho has too many messages left to send, the
+        caller waits for it to catch up.
+        """
+        stats = self.stats
+        started = time.perf_counter() if stats.sample_publish() else None
+        buffered = self._buffer is not None and is_bufferable(topic)
+        session = self._session
+
+        if self._mqtt_client.is_connected():
+            self._wait_for_room()
+        with self._send_lock:
+            sendable = self._mqtt_client.is_connected()
+            birth = False
+            if session is not None and sendable:
+                birth = topic.split("/", 3)[2] == "NBIRTH"
+                if birth:
+                    session.add_bd_seq(payload)
+                    payload.seq = session.next_seq(birth=True)
+                elif session.birth_pending:
+                    sendable = False
+                else:
+                    payload.seq = session.next_seq(birth=False)
+
+            data = payload.SerializeToString()
+            LOGGER.debug("Publishing %s bytes to topic %s", len(data), topic)
+            stats.payloads_published += 1
+            stats.payload_bytes.observe(len(data))
+            stats.metrics_per_payload.observe(len(payload.metrics))
+
+            if not sendable:
+                if buffered:
+                    # Buffer uncompressed so the replay can flag metrics historical.
+                    self._buffer.append(topic, data)
+                    return
+                if session is not None:
+                    LOGGER.debug("Dropping message to %s before the NBIRTH", topic)
+                    return
+
+            wire = data if self._compressor is None else self._compressor(topic, data)
+            stats.bytes_published += len(wire)
+
+            try:
+                info = self._paho_publish(topic, wire)
+            except socket.error as exception:
+                LOGGER.error(
+                    "Could not publish to topic %s reason: %s", topic, exception
+                )
+                stats.publish_errors += 1
+                if buffered:
+                    self._buffer.append(topic, data)
+                    return
+                raise HelixerClientConnectionError(
+                    "Could not publish to topic"
+                ) from exception
+            except Exception as exception:  # pylint: disable=broad-except
+                LOGGER.warning(exception)
+                stats.publish_errors += 1
+                raise HelixerClientError("Could not publish to topic") from exception
+
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            stats.publish_errors += 1
+            if buffered:
+                self._buffer.append(topic, data)
+        if started is not None:
+            stats.publish_latency.observe(time.perf_counter() - started)
+
+    def start_replay(self, devices: Collection[str]) -> None:
+        """Replay the offline buffer once the births of a rebirth are out.
+
+        Device messages are only replayed for the ``devices`` born again, the
+        host cannot resolve the aliases of the others, which are discarded.
+        """
+        if self._buffer is not None:
+            self._buffer.start_replay(
+                functools.partial(self._publish_replayed, devices)
+            )
+
+    def _publish_replayed(
+        self, devices: Collection[str], topic: str, payload: sparkplugb_pb2.Payload
+    ) -> bool | None:
+        # spBv1.0/<group>/DDATA/<edge node>/<device>
+        parts = topic.split("/", 4)
+        if len(parts) == 5 and parts[4] not in devices:
+            LOGGER.debug("Discarding buffered message to unborn device %s", topic)
+            return None
+        self._wait_for_room()
+        with self._send_lock:
+            session = self._session
+            if not self._mqtt_client.is_connected() or (
+                session is not None and session.birth_pending
+            ):
+                return False
+            if session is not None:
+                payload.seq = session.next_seq(birth=False)
+            data = payload.SerializeToString()
+            if self._compressor is not None:
+                data = self._compressor(topic, data)
+            info = self._paho_publish(topic, data)
+        return info.rc == mqtt.MQTT_ERR_SUCCESS
 
 
 def on_connect(client, userdata, flags, reason_code, properties):
@@ -0,0 +1,277 @@
+"""Sparkplug command handling for Helixer."""
+from __future__ import annotations
+
+from collections.abc import Callable
+import threading
+from typing import Any, NamedTuple
+import zlib
+
+from google.protobuf.message import DecodeError
+from homeassistant.const import (
+    ATTR_ENTITY_ID,
+    SERVICE_CLOSE_COVER,
+    SERVICE_LOCK,
+    SERVICE_OPEN_COVER,
+    SERVICE_SELECT_OPTION,
+    SERVICE_SET_COVER_POSITION,
+    SERVICE_TURN_OFF,
+    SERVICE_TURN_ON,
+    SERVICE_UNLOCK,
+    SERVICE_VOLUME_SET,
+    STATE_ON,
+    STATE_OPEN,
+    STATE_UNLOCKED,
+)
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+
+from . import sparkplugb_pb2
+from .compression import unwrap
+from .const import LOGGER
+from .encoder import decode, parse_state
+from .entity_filter import HelixerEntityFilter
+from .registry import HelixerMetricRegistry
+
+# Commands received within this many seconds are merged, the last one wins.
+COALESCE_DELAY = 0.1
+
+
+class CommandService(NamedTuple):
+    """Service a metric write is translated to.
+
+    Without a ``field`` the metric is a switch, calling ``service`` for a
+    truthy value and ``off_service`` otherwise.
+    """
+
+    service: str
+    field: str | None = None
+    off_service: str | None = None
+    # State the entity is in when a switch metric is already truthy.
+    on_state: str = STATE_ON
+
+
+TURN_ON_OFF = CommandService(SERVICE_TURN_ON, off_service=SERVICE_TURN_OFF)
+SET_VALUE = CommandService("set_value", "value")
+SELECT_OPTION = CommandService(SERVICE_SELECT_OPTION, "option")
+
+COMMANDS: dict[tuple[str, str], CommandService] = {
+    ("automation", "state"): TURN_ON_OFF,
+    ("fan", "state"): TURN_ON_OFF,
+    ("humidifier", "state"): TURN_ON_OFF,
+    ("input_boolean", "state"): TURN_ON_OFF,
+    ("light", "state"): TURN_ON_OFF,
+    ("siren", "state"): TURN_ON_OFF,
+    ("switch", "state"): TURN_ON_OFF,
+    ("cover", "state"): CommandService(
+        SERVICE_OPEN_COVER, off_service=SERVICE_CLOSE_COVER, on_state=STATE_OPEN
+    ),
+    ("lock", "state"): CommandService(
+        SERVICE_UNLOCK, off_service=SERVICE_LOCK, on_state=STATE_UNLOCKED
+    ),
+    ("input_number", "state"): SET_VALUE,
+    ("input_text", "state"): SET_VALUE,
+    ("number", "state"): SET_VALUE,
+    ("text", "state"): SET_VALUE,
+    ("input_select", "state"): SELECT_OPTION,
+    ("select", "state"): SELECT_OPTION,
+    ("climate", "state"): CommandService("set_hvac_mode", "hvac_mode"),
+    ("climate", "attributes/temperature"): CommandService(
+        "set_temperature", "temperature"
+    ),
+    ("climate", "attributes/fan_mode"): CommandService("set_fan_mode", "fan_mode"),
+    ("climate", "attributes/preset_mode"): CommandService(
+        "set_preset_mode", "preset_mode"
+    ),
+    ("cover", "attributes/current_position"): CommandService(
+        SERVICE_SET_COVER_POSITION, "position"
+    ),
+    ("fan", "attributes/percentage"): CommandService("set_percentage", "percentage"),
+    ("humidifier", "attributes/humidity"): CommandService("set_humidity", "humidity"),
+    ("light", "attributes/brightness"): CommandService(SERVICE_TURN_ON, "brightness"),
+    ("media_player", "attributes/volume_level"): CommandService(
+        SERVICE_VOLUME_SET, "volume_level"
+    ),
+    ("water_heater", "attributes/temperature"): CommandService(
+        "set_temperature", "temperature"
+    ),
+}
+
+
+def _is_on(value: Any) -> bool:
+    if type(value) is str:
+        return value.lower() in ("on", "true", "1", STATE_OPEN, STATE_UNLOCKED)
+    return bool(value)
+
+
+class HelixerCommandHandler:
+    """Translate DCMD metric writes into Home Assistant service calls.
+
+    Payloads are decoded in the MQTT network thread; the device topic is
+    resolved through an index built from the published entities. Writes are
+    merged per entity and metric for ``COALESCE_DELAY`` seconds and a write
+    that matches the current state is dropped.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        registry: HelixerMetricRegistry,
+        entity_filter: HelixerEntityFilter,
+        topic: Callable[[str, str], str],
+    ) -> None:
+        self._hass = hass
+        self._registry = registry
+        self._entity_filter = entity_filter
+        self._topic = topic
+
+        # DCMD topic -> (entity_id, device_id)
+        self._index: dict[str, tuple[str, str]] = {}
+        self._lock = threading.Lock()
+        self._pending: dict[tuple[str, str], Any] = {}
+        self._scheduled = False
+        self._cancel: CALLBACK_TYPE | None = None
+
+        self.received = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.skipped = 0
+        self.calls = 0
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        """Return the command counters."""
+        return {
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "skipped": self.skipped,
+            "service_calls": self.calls,
+            "indexed_topics": len(self._index),
+        }
+
+    @callback
+    def async_build_index(self) -> None:
+        """Index the command topics of every published entity."""
+        self._index = {
+            self._topic("DCMD", state.entity_id.replace(".", "/")): (
+                state.entity_id,
+                state.entity_id.replace(".", "/"),
+            )
+            for state in self._hass.states.async_all()
+            if self._entity_filter(state.entity_id)
+        }
+
+    def handle_message(self, topic: str, data: bytes) -> None:
+        """Decode a DCMD payload and queue its writes, runs in the network thread."""
+        self.received += 1
+        target = self._index.get(topic)
+        if target is None:
+            # Entities created since the index was built; whether they are
+            # published is checked before calling a service.
+            device_id = topic.split("/", 4)[4]
+            if self._topic("DCMD", device_id) != topic:
+                # Addressed to a node the device is not published under.
+                self.rejected += 1
+                return
+            target = (device_id.replace("/", ".", 1), device_id)
+
+        payload = sparkplugb_pb2.Payload()
+        try:
+            payload.ParseFromString(data)
+            payload = unwrap(payload)
+        except (DecodeError, OSError, zlib.error) as exception:
+            LOGGER.warning("Ignoring invalid DCMD payload on %s: %s", topic, exception)
+            self.rejected += 1
+            return
+
+        entity_id, device_id = target
+        writes = {}
+        metrics = []
+        for metric in payload.metrics:
+            if metric.WhichOneof("value") == "template_value":
+                # Writes to the members of a template instance.
+                metrics.extend(metric.template_value.metrics)
+            else:
+                metrics.append(metric)
+        for metric in metrics:
+            name = metric.name or self._registry.name(device_id, metric.alias)
+            if name is None:
+                self.rejected += 1
+                continue
+            writes[(entity_id, name)] = decode(metric)
+        if not writes:
+            return
+
+        with self._lock:
+            before = len(self._pending)
+            self._pending.update(writes)
+            self.coalesced += len(writes) - (len(self._pending) - before)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._hass.loop.call_soon_threadsafe(self._async_schedule)
+
+    @callback
+    def _async_schedule(self) -> None:
+        self._cancel = self._hass.loop.call_later(
+            COALESCE_DELAY, self._async_dispatch
+        ).cancel
+
+    @callback
+    def _async_dispatch(self) -> None:
+        self._cancel = None
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._scheduled = False
+
+        for (entity_id, name), value in pending.items():
+            self._async_call(entity_id, name, value)
+
+    @callback
+    def _async_call(self, entity_id: str, name: str, value: Any) -> None:
+        domain = entity_id.partition(".")[0]
+        command = COMMANDS.get((domain, name))
+        state = self._hass.states.get(entity_id)
+        if (
+            command is None
+            or state is None
+            or value is None
+            or not self._entity_filter(entity_id)
+        ):
+            LOGGER.debug("Rejecting write of %s to %s", name, entity_id)
+            self.rejected += 1
+            return
+
+        if command.field is None:
+            on = _is_on(value)
+            if (state.state == command.on_state) == on:
+                self.skipped += 1
+                return
+            service = command.service if on else command.off_service
+            data = {ATTR_ENTITY_ID: entity_id}
+        else:
+            current = (
+                parse_state(state.state)
+                if name == "state"
+                else state.attributes.get(name.partition("/")[2])
+            )
+            if current == value:
+                self.skipped += 1
+                return
+            service = command.service
+            data = {ATTR_ENTITY_ID: entity_id, command.field: value}
+
+        self.calls += 1
+        self._hass.async_create_task(
+            self._hass.services.async_call(domain, service, data)
+        )
+
+    @callback
+    def async_stop(self) -> None:
+        """Drop pending writes."""
+        if self._cancel is not None:
+            self._cancel()
+            self._cancel = None
+        with self._lock:
+            self._pending.clear()
+            self._scheduled = False
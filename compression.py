@@ -0,0 +1,115 @@
+"""Sparkplug payload compression for Helixer."""
+from __future__ import annotations
+
+import gzip
+import time
+from typing import Any
+import zlib
+
+from . import sparkplugb_pb2
+from .const import COMPRESSION_DEFLATE, COMPRESSION_GZIP
+
+COMPRESSED_UUID = "SPBV1.0_COMPRESSED"
+ALGORITHM_METRIC = "algorithm"
+
+
+def compress(algorithm: str, data: bytes) -> bytes:
+    if algorithm == COMPRESSION_GZIP:
+        return gzip.compress(data, mtime=0)
+    return zlib.compress(data)
+
+
+def decompress(algorithm: str, data: bytes) -> bytes:
+    if algorithm.upper() == COMPRESSION_GZIP:
+        return gzip.decompress(data)
+    return zlib.decompress(data)
+
+
+def unwrap(payload: sparkplugb_pb2.Payload) -> sparkplugb_pb2.Payload:
+    """Return the inner payload of a compressed payload, or the payload itself."""
+    if payload.uuid != COMPRESSED_UUID:
+        return payload
+
+    # Sparkplug defaults to DEFLATE when no algorithm metric is present.
+    algorithm = COMPRESSION_DEFLATE
+    for metric in payload.metrics:
+        if metric.name == ALGORITHM_METRIC:
+            algorithm = metric.string_value
+
+    inner = sparkplugb_pb2.Payload()
+    inner.ParseFromString(decompress(algorithm, payload.body))
+    return inner
+
+
+class HelixerCompressor:
+    """Wrap serialized payloads in Sparkplug compressed payloads.
+
+    Payloads smaller than ``threshold`` bytes, or that do not shrink, are
+    sent as they are. Compression ratio and time are tracked per topic.
+    """
+
+    def __init__(self, algorithm: str, threshold: int) -> None:
+        self._algorithm = algorithm
+        self._threshold = threshold
+        # topic -> [payloads, bytes in, bytes out, seconds spent]
+        self._topics: dict[str, list] = {}
+
+        self.skipped = 0
+
+    def __call__(self, topic: str, data: bytes) -> bytes:
+        """Return what should be sent on the wire for a serialized payload."""
+        if len(data) < self._threshold:
+            self.skipped += 1
+            return data
+
+        started = time.perf_counter()
+        payload = sparkplugb_pb2.Payload()
+        payload.uuid = COMPRESSED_UUID
+        payload.body = compress(self._algorithm, data)
+        metric = payload.metrics.add()
+        metric.name = ALGORITHM_METRIC
+        metric.datatype = sparkplugb_pb2.String
+        metric.string_value = self._algorithm
+        wrapped = payload.SerializeToString()
+        elapsed = time.perf_counter() - started
+
+        stats = self._topics.get(topic)
+        if stats is None:
+            stats = self._topics[topic] = [0, 0, 0, 0.0]
+        stats[0] += 1
+        stats[1] += len(data)
+        stats[3] += elapsed
+
+        if len(wrapped) >= len(data):
+            self.skipped += 1
+            stats[2] += len(data)
+            return data
+        stats[2] += len(wrapped)
+        return wrapped
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        """Return the overall and per-topic compression statistics."""
+        topics = {
+            topic: {
+                "payloads": payloads,
+                "ratio": round(bytes_out / bytes_in, 3) if bytes_in else None,
+                "cpu_ms": round(seconds * 1000, 3),
+            }
+            for topic, (payloads, bytes_in, bytes_out, seconds) in list(
+                self._topics.items()
+            )
+        }
+        bytes_in = sum(stats[1] for stats in list(self._topics.values()))
+        bytes_out = sum(stats[2] for stats in list(self._topics.values()))
+        return {
+            "algorithm": self._algorithm,
+            "skipped": self.skipped,
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "ratio": round(bytes_out / bytes_in, 3) if bytes_in else None,
+            "cpu_ms": round(
+                sum(stats[3] for stats in list(self._topics.values())) * 1000, 3
+            ),
+            "topics": topics,
+        }
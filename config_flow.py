@@ -4,6 +4,7 @@ from __future__ import annotations
 import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
+from homeassistant.core import callback
 from homeassistant.helpers import selector
 from homeassistant.helpers.aiohttp_client import async_create_clientsession
 from homeassistant.components.file_upload import process_uploaded_file
@@ -12,7 +13,63 @@ from .client import (
     HelixerClientAuthenticationError,
     HelixerClientConnectionError,
 )
-from .const import DOMAIN, LOGGER
+from .const import (
+    COMPRESSION_DEFLATE,
+    COMPRESSION_GZIP,
+    COMPRESSION_NONE,
+    CONF_BUFFER_DISK,
+    CONF_BUFFER_MEMORY,
+    CONF_COMMANDS,
+    CONF_COMPRESSION,
+    CONF_COMPRESSION_THRESHOLD,
+    CONF_CONNECTIONS,
+    CONF_DEADBAND_RULES,
+    CONF_DROP_POLICY,
+    CONF_EXCLUDE_AREAS,
+    CONF_EXCLUDE_DEVICES,
+    CONF_EXCLUDE_DOMAINS,
+    CONF_EXCLUDE_ENTITY_GLOBS,
+    CONF_EXCLUDE_LABELS,
+    CONF_FLATTEN_DEPTH,
+    CONF_FLATTEN_MAX_METRICS,
+    CONF_FLATTEN_MAX_SIZE,
+    CONF_FLUSH_INTERVAL_MAX,
+    CONF_FLUSH_INTERVAL_MIN,
+    CONF_INCLUDE_AREAS,
+    CONF_INCLUDE_DEVICES,
+    CONF_INCLUDE_DOMAINS,
+    CONF_INCLUDE_ENTITY_GLOBS,
+    CONF_INCLUDE_LABELS,
+    CONF_MAX_METRICS,
+    CONF_PRIMARY_HOST_ID,
+    CONF_QUEUE_SIZE,
+    CONF_REPLAY_RATE,
+    CONF_SERIALIZER,
+    CONF_TEMPLATES,
+    DEFAULT_BUFFER_DISK,
+    DEFAULT_BUFFER_MEMORY,
+    DEFAULT_COMMANDS,
+    DEFAULT_COMPRESSION,
+    DEFAULT_COMPRESSION_THRESHOLD,
+    DEFAULT_CONNECTIONS,
+    DEFAULT_DROP_POLICY,
+    DEFAULT_FLATTEN_DEPTH,
+    DEFAULT_FLATTEN_MAX_METRICS,
+    DEFAULT_FLATTEN_MAX_SIZE,
+    DEFAULT_FLUSH_INTERVAL_MAX,
+    DEFAULT_FLUSH_INTERVAL_MIN,
+    DEFAULT_MAX_METRICS,
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_REPLAY_RATE,
+    DEFAULT_SERIALIZER,
+    DEFAULT_TEMPLATES,
+    DOMAIN,
+    DROP_NEWEST,
+    DROP_OLDEST,
+    LOGGER,
+    SERIALIZER_PROTOBUF,
+    SERIALIZER_STREAMING,
+)
 
 
 class HelixerFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
@@ -20,6 +77,14 @@ class HelixerFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
 
     VERSION = 1
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(
+        config_entry: config_entries.ConfigEntry,
+    ) -> config_entries.OptionsFlow:
+        """Get the options flow for this handler."""
+        return HelixerOptionsFlowHandler(config_entry)
+
     async def async_step_user(
         self,
         user_input: dict | None = None,
@@ -118,5 +183,281 @@ class HelixerFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             cert=user_input["certificate"],
             ca=user_input["ca"],
         )
-        client.connect_mqtt()
-        del client
+        try:
+            await client.async_connect_mqtt()
+        finally:
+            await client.async_disconnect_mqtt()
+
+
+class HelixerOptionsFlowHandler(config_entries.OptionsFlow):
+    """Options flow for Helixer."""
+
+    def __init__(self, config_entry: config_entries.ConfigEntry) -> None:
+        """Initialize options flow."""
+        self._entry = config_entry
+        self._options = dict(config_entry.options)
+
+    async def async_step_init(
+        self,
+        user_input: dict | None = None,
+    ) -> config_entries.FlowResult:
+        """Manage the publisher options."""
+        if user_input is not None:
+            # A cleared optional field is left out of the input.
+            self._options.pop(CONF_PRIMARY_HOST_ID, None)
+            self._options.update(user_input)
+            return await self.async_step_filter()
+
+        options = self._entry.options
+
+        return self.async_show_form(
+            step_id="init",
+            data_schema=vol.Schema(
+                {
+                    vol.Required(
+                        CONF_FLUSH_INTERVAL_MIN,
+                        default=options.get(
+                            CONF_FLUSH_INTERVAL_MIN, DEFAULT_FLUSH_INTERVAL_MIN
+                        ),
+                    ): selector.NumberSelector(
+                        selector.NumberSelectorConfig(
+                            min=10,
+                            max=5000,
+                            unit_of_measurement="ms",
+                            mode=selector.NumberSelectorMode.BOX,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_FLUSH_INTERVAL_MAX,
+                        default=options.get(
+                            CONF_FLUSH_INTERVAL_MAX, DEFAULT_FLUSH_INTERVAL_MAX
+                        ),
+                    ): selector.NumberSelector(
+                        selector.NumberSelectorConfig(
+                            min=10,
+                            max=5000,
+                            unit_of_measurement="ms",
+                            mode=selector.NumberSelectorMode.BOX,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_MAX_METRICS,
+                        default=options.get(CONF_MAX_METRICS, DEFAULT_MAX_METRICS),
+                    ): selector.NumberSelector(
+                        selector.NumberSelectorConfig(
+                            min=1,
+                            max=100000,
+                            mode=selector.NumberSelectorMode.BOX,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_QUEUE_SIZE,
+                        default=options.get(CONF_QUEUE_SIZE, DEFAULT_QUEUE_SIZE),
+                    ): selector.NumberSelector(
+                        selector.NumberSelectorConfig(
+                            min=100,
+                            max=1000000,
+                            mode=selector.NumberSelectorMode.BOX,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_DROP_POLICY,
+                        default=options.get(CONF_DROP_POLICY, DEFAULT_DROP_POLICY),
+                    ): selector.SelectSelector(
+                        selector.SelectSelectorConfig(
+                            options=[DROP_OLDEST, DROP_NEWEST],
+                            translation_key=CONF_DROP_POLICY,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_BUFFER_MEMORY,
+                        default=options.get(CONF_BUFFER_MEMORY, DEFAULT_BUFFER_MEMORY),
+                    ): selector.NumberSelector(
+                        selector.NumberSelectorConfig(
+                            min=1,
+                            max=1024,
+                            unit_of_measurement="MB",
+                            mode=selector.NumberSelectorMode.BOX,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_BUFFER_DISK,
+                        default=options.get(CONF_BUFFER_DISK, DEFAULT_BUFFER_DISK),
+                    ): selector.NumberSelector(
+                        selector.NumberSelectorConfig(
+                            min=0,
+                            max=10240,
+                            unit_of_measurement="MB",
+                            mode=selector.NumberSelectorMode.BOX,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_REPLAY_RATE,
+                        default=options.get(CONF_REPLAY_RATE, DEFAULT_REPLAY_RATE),
+                    ): selector.NumberSelector(
+                        selector.NumberSelectorConfig(
+                            min=1,
+                            max=10000,
+                            unit_of_measurement="messages/s",
+                            mode=selector.NumberSelectorMode.BOX,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_COMPRESSION,
+                        default=options.get(CONF_COMPRESSION, DEFAULT_COMPRESSION),
+                    ): selector.SelectSelector(
+                        selector.SelectSelectorConfig(
+                            options=[
+                                COMPRESSION_NONE,
+                                COMPRESSION_DEFLATE,
+                                COMPRESSION_GZIP,
+                            ],
+                            translation_key=CONF_COMPRESSION,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_COMPRESSION_THRESHOLD,
+                        default=options.get(
+                            CONF_COMPRESSION_THRESHOLD, DEFAULT_COMPRESSION_THRESHOLD
+                        ),
+                    ): selector.NumberSelector(
+                        selector.NumberSelectorConfig(
+                            min=0,
+                            max=1048576,
+                            unit_of_measurement="B",
+                            mode=selector.NumberSelectorMode.BOX,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_CONNECTIONS,
+                        default=options.get(CONF_CONNECTIONS, DEFAULT_CONNECTIONS),
+                    ): selector.NumberSelector(
+                        selector.NumberSelectorConfig(
+                            min=1,
+                            max=16,
+                            mode=selector.NumberSelectorMode.BOX,
+                        )
+                    ),
+                    vol.Optional(
+                        CONF_PRIMARY_HOST_ID,
+                        description={
+                            "suggested_value": options.get(CONF_PRIMARY_HOST_ID)
+                        },
+                    ): selector.TextSelector(
+                        selector.TextSelectorConfig(
+                            type=selector.TextSelectorType.TEXT
+                        ),
+                    ),
+                    vol.Required(
+                        CONF_COMMANDS,
+                        default=options.get(CONF_COMMANDS, DEFAULT_COMMANDS),
+                    ): selector.BooleanSelector(),
+                    vol.Required(
+                        CONF_TEMPLATES,
+                        default=options.get(CONF_TEMPLATES, DEFAULT_TEMPLATES),
+                    ): selector.BooleanSelector(),
+                    vol.Required(
+                        CONF_FLATTEN_DEPTH,
+                        default=options.get(CONF_FLATTEN_DEPTH, DEFAULT_FLATTEN_DEPTH),
+                    ): selector.NumberSelector(
+                        selector.NumberSelectorConfig(
+                            min=1,
+                            max=10,
+                            mode=selector.NumberSelectorMode.BOX,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_FLATTEN_MAX_METRICS,
+                        default=options.get(
+                            CONF_FLATTEN_MAX_METRICS, DEFAULT_FLATTEN_MAX_METRICS
+                        ),
+                    ): selector.NumberSelector(
+                        selector.NumberSelectorConfig(
+                            min=1,
+                            max=10000,
+                            mode=selector.NumberSelectorMode.BOX,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_FLATTEN_MAX_SIZE,
+                        default=options.get(
+                            CONF_FLATTEN_MAX_SIZE, DEFAULT_FLATTEN_MAX_SIZE
+                        ),
+                    ): selector.NumberSelector(
+                        selector.NumberSelectorConfig(
+                            min=8,
+                            max=1048576,
+                            unit_of_measurement="B",
+                            mode=selector.NumberSelectorMode.BOX,
+                        )
+                    ),
+                    vol.Required(
+                        CONF_SERIALIZER,
+                        default=options.get(CONF_SERIALIZER, DEFAULT_SERIALIZER),
+                    ): selector.SelectSelector(
+                        selector.SelectSelectorConfig(
+                            options=[SERIALIZER_STREAMING, SERIALIZER_PROTOBUF],
+                            translation_key=CONF_SERIALIZER,
+                        )
+                    ),
+                    vol.Optional(
+                        CONF_DEADBAND_RULES,
+                        default=options.get(CONF_DEADBAND_RULES, {}),
+                    ): selector.ObjectSelector(),
+                }
+            ),
+        )
+
+    async def async_step_filter(
+        self,
+        user_input: dict | None = None,
+    ) -> config_entries.FlowResult:
+        """Manage which entities are published."""
+        if user_input is not None:
+            self._options.update(user_input)
+            return self.async_create_entry(title="", data=self._options)
+
+        text_list = selector.TextSelector(
+            selector.TextSelectorConfig(
+                type=selector.TextSelectorType.TEXT, multiple=True
+            ),
+        )
+        areas = selector.AreaSelector(selector.AreaSelectorConfig(multiple=True))
+        devices = selector.DeviceSelector(
+            selector.DeviceSelectorConfig(multiple=True)
+        )
+
+        schema = {}
+        for domains, entity_globs, area_ids, device_ids, labels in (
+            (
+                CONF_INCLUDE_DOMAINS,
+                CONF_INCLUDE_ENTITY_GLOBS,
+                CONF_INCLUDE_AREAS,
+                CONF_INCLUDE_DEVICES,
+                CONF_INCLUDE_LABELS,
+            ),
+            (
+                CONF_EXCLUDE_DOMAINS,
+                CONF_EXCLUDE_ENTITY_GLOBS,
+                CONF_EXCLUDE_AREAS,
+                CONF_EXCLUDE_DEVICES,
+                CONF_EXCLUDE_LABELS,
+            ),
+        ):
+            schema[
+                vol.Optional(domains, default=self._options.get(domains, []))
+            ] = text_list
+            schema[
+                vol.Optional(entity_globs, default=self._options.get(entity_globs, []))
+            ] = text_list
+            schema[
+                vol.Optional(area_ids, default=self._options.get(area_ids, []))
+            ] = areas
+            schema[
+                vol.Optional(device_ids, default=self._options.get(device_ids, []))
+            ] = devices
+            schema[
+                vol.Optional(labels, default=self._options.get(labels, []))
+            ] = text_list
+
+        return self.async_show_form(step_id="filter", data_schema=vol.Schema(schema))
@@ -7,3 +7,78 @@ LOGGER: Logger = getLogger(__package__)
 NAME = "Helixer"
 DOMAIN = "helixer"
 VERSION = "0.0.1"
+
+# Sparkplug group every edge node publishes under.
+GROUP_ID = "homeassistant"
+
+CONF_FLUSH_INTERVAL_MIN = "flush_interval_min"
+CONF_FLUSH_INTERVAL_MAX = "flush_interval_max"
+CONF_MAX_METRICS = "max_metrics"
+
+DEFAULT_FLUSH_INTERVAL_MIN = 50
+DEFAULT_FLUSH_INTERVAL_MAX = 500
+DEFAULT_MAX_METRICS = 1000
+
+CONF_BUFFER_MEMORY = "buffer_memory"
+CONF_BUFFER_DISK = "buffer_disk"
+CONF_REPLAY_RATE = "replay_rate"
+
+DEFAULT_BUFFER_MEMORY = 4
+DEFAULT_BUFFER_DISK = 64
+DEFAULT_REPLAY_RATE = 50
+
+CONF_INCLUDE_DOMAINS = "include_domains"
+CONF_INCLUDE_ENTITY_GLOBS = "include_entity_globs"
+CONF_INCLUDE_AREAS = "include_areas"
+CONF_INCLUDE_DEVICES = "include_devices"
+CONF_INCLUDE_LABELS = "include_labels"
+CONF_EXCLUDE_DOMAINS = "exclude_domains"
+CONF_EXCLUDE_ENTITY_GLOBS = "exclude_entity_globs"
+CONF_EXCLUDE_AREAS = "exclude_areas"
+CONF_EXCLUDE_DEVICES = "exclude_devices"
+CONF_EXCLUDE_LABELS = "exclude_labels"
+
+CONF_DEADBAND_RULES = "deadband_rules"
+
+CONF_QUEUE_SIZE = "queue_size"
+CONF_DROP_POLICY = "drop_policy"
+
+DEFAULT_QUEUE_SIZE = 10000
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+DEFAULT_DROP_POLICY = DROP_OLDEST
+
+ATTRIBUTION = "Data provided by the Helixer integration"
+
+CONF_COMPRESSION = "compression"
+CONF_COMPRESSION_THRESHOLD = "compression_threshold"
+
+COMPRESSION_NONE = "none"
+COMPRESSION_DEFLATE = "DEFLATE"
+COMPRESSION_GZIP = "GZIP"
+DEFAULT_COMPRESSION = COMPRESSION_NONE
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+
+CONF_COMMANDS = "commands"
+DEFAULT_COMMANDS = False
+
+CONF_PRIMARY_HOST_ID = "primary_host_id"
+
+CONF_CONNECTIONS = "connections"
+DEFAULT_CONNECTIONS = 1
+
+CONF_TEMPLATES = "templates"
+DEFAULT_TEMPLATES = False
+
+CONF_FLATTEN_DEPTH = "flatten_depth"
+CONF_FLATTEN_MAX_METRICS = "flatten_max_metrics"
+CONF_FLATTEN_MAX_SIZE = "flatten_max_size"
+DEFAULT_FLATTEN_DEPTH = 3
+DEFAULT_FLATTEN_MAX_METRICS = 100
+DEFAULT_FLATTEN_MAX_SIZE = 1024
+
+CONF_SERIALIZER = "serializer"
+
+SERIALIZER_PROTOBUF = "protobuf"
+SERIALIZER_STREAMING = "streaming"
+DEFAULT_SERIALIZER = SERIALIZER_STREAMING
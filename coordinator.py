@@ -0,0 +1,97 @@
+"""DataUpdateCoordinator for Helixer."""
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import Any
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+
+from .backfill import HelixerBackfill
+from .buffer import HelixerOfflineBuffer
+from .client import HelixerClient
+from .commands import HelixerCommandHandler
+from .compression import HelixerCompressor
+from .const import DOMAIN, LOGGER
+from .host import HelixerPrimaryHost
+from .pipeline import HelixerPipeline
+from .publisher import HelixerBatchPublisher
+from .sharding import HelixerShardedClient, HelixerShardMap
+
+
+class HelixerDataUpdateCoordinator(DataUpdateCoordinator[dict[str, Any]]):
+    """Periodically collect the runtime statistics of the publishing path."""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        client: HelixerClient | HelixerShardedClient,
+        pipeline: HelixerPipeline,
+        publisher: HelixerBatchPublisher,
+        offline_buffers: list[HelixerOfflineBuffer],
+        compressor: HelixerCompressor | None = None,
+        command_handler: HelixerCommandHandler | None = None,
+        primary_host: HelixerPrimaryHost | None = None,
+        shard_map: HelixerShardMap | None = None,
+        backfill: HelixerBackfill | None = None,
+    ) -> None:
+        """Initialize."""
+        super().__init__(
+            hass=hass,
+            logger=LOGGER,
+            name=DOMAIN,
+            update_interval=timedelta(seconds=30),
+        )
+        self._client = client
+        self._pipeline = pipeline
+        self._publisher = publisher
+        self._offline_buffers = offline_buffers
+        self._compressor = compressor
+        self._command_handler = command_handler
+        self._primary_host = primary_host
+        self._shard_map = shard_map
+        self._backfill = backfill
+
+    def snapshot(self) -> dict[str, Any]:
+        """Return the current statistics."""
+        return {
+            **self._client.stats.as_dict(),
+            "outbound_queue_depth": self._client.outbound_queue_depth,
+            "pipeline": self._pipeline.stats,
+            "publisher": self._publisher.stats,
+            "offline_buffer": self._buffer_stats(),
+            "compression": (
+                self._compressor.stats if self._compressor is not None else None
+            ),
+            "commands": (
+                self._command_handler.stats
+                if self._command_handler is not None
+                else None
+            ),
+            "primary_host": (
+                self._primary_host.stats if self._primary_host is not None else None
+            ),
+            "shards": (
+                {
+                    "devices": self._shard_map.stats,
+                    "connected": self._client.connections,
+                }
+                if self._shard_map is not None
+                else None
+            ),
+            "backfill": (
+                self._backfill.stats if self._backfill is not None else None
+            ),
+        }
+
+    def _buffer_stats(self) -> dict[str, int]:
+        """Return the counters of all offline buffers added up."""
+        totals: dict[str, int] = {}
+        for offline_buffer in self._offline_buffers:
+            for key, value in offline_buffer.stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    async def _async_update_data(self) -> dict[str, Any]:
+        """Update data."""
+        return self.snapshot()
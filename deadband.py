@@ -0,0 +1,139 @@
+"""Report-by-exception deadbands for Helixer."""
+from __future__ import annotations
+
+from collections.abc import Mapping
+from typing import Any, NamedTuple
+
+from .const import LOGGER
+
+
+class DeadbandRule(NamedTuple):
+    """Deadband and rate limits applied to the numeric metrics of a device."""
+
+    absolute: float = 0
+    percent: float = 0
+    min_interval: float = 0
+    max_silence: float = 0
+
+    def within(self, previous: float, value: float) -> bool:
+        """Return True if the change is too small to be reported."""
+        return abs(value - previous) <= max(
+            self.absolute, abs(previous) * self.percent / 100
+        )
+
+
+def _is_number(value: Any) -> bool:
+    return type(value) is int or type(value) is float
+
+
+class HelixerDeadband:
+    """Decide which metric changes are reported, Sparkplug report-by-exception.
+
+    Rules are keyed by ``domain`` or ``domain.device_class``, the latter
+    taking precedence. A numeric metric is held back while its change from
+    the last published value is within the deadband or while it was published
+    less than ``min_interval`` seconds ago, unless it has been silent for
+    ``max_silence`` seconds. Only devices with a rule are tracked.
+    """
+
+    def __init__(self, rules: Mapping[str, Mapping[str, Any]]) -> None:
+        self._rules: dict[str, DeadbandRule] = {}
+        for key, rule in rules.items():
+            try:
+                self._rules[key] = DeadbandRule(
+                    **{field: float(value) for field, value in rule.items()}
+                )
+            except (TypeError, ValueError) as exception:
+                LOGGER.warning("Ignoring invalid deadband rule %s: %s", key, exception)
+
+        # device -> metric -> [last published value, monotonic publish time]
+        self._published: dict[str, dict[str, list]] = {}
+        # device -> metric -> latest value that was held back
+        self._held: dict[str, dict[str, tuple[Any, int]]] = {}
+        self._device_rules: dict[str, DeadbandRule] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self._rules)
+
+    def rule_for(self, domain: str, device_class: str | None) -> DeadbandRule | None:
+        """Return the rule of a domain and device class, if any."""
+        if device_class is not None and (
+            rule := self._rules.get(f"{domain}.{device_class}")
+        ):
+            return rule
+        return self._rules.get(domain)
+
+    def set_rule(self, device_id: str, rule: DeadbandRule | None) -> None:
+        """Attach a rule to a device, or detach it."""
+        if rule is None:
+            if self._device_rules.pop(device_id, None) is not None:
+                self._published.pop(device_id, None)
+                self._held.pop(device_id, None)
+        else:
+            self._device_rules[device_id] = rule
+
+    def filter(
+        self, device_id: str, metrics: dict[str, tuple[Any, int]], now: float
+    ) -> dict[str, tuple[Any, int]]:
+        """Return the metrics that should be published now, hold the others."""
+        if (rule := self._device_rules.get(device_id)) is None:
+            return metrics
+
+        published = self._published.setdefault(device_id, {})
+        held = self._held.setdefault(device_id, {})
+        send = {}
+
+        for name, (value, timestamp) in metrics.items():
+            last = published.get(name)
+            if last is None or not _is_number(value) or not _is_number(last[0]):
+                send[name] = (value, timestamp)
+                continue
+
+            age = now - last[1]
+            if age < rule.min_interval or (
+                rule.within(last[0], value)
+                and (not rule.max_silence or age < rule.max_silence)
+            ):
+                held[name] = (value, timestamp)
+            else:
+                send[name] = (value, timestamp)
+
+        return send
+
+    def published(
+        self, device_id: str, metrics: dict[str, tuple[Any, int]], now: float
+    ) -> None:
+        """Record what was actually sent for a device."""
+        if device_id not in self._device_rules:
+            return
+
+        published = self._published.setdefault(device_id, {})
+        held = self._held.get(device_id, {})
+        for name, (value, _) in metrics.items():
+            published[name] = [value, now]
+            held.pop(name, None)
+
+    def due(self, now: float, timestamp: int) -> dict[str, dict[str, tuple[Any, int]]]:
+        """Return held values whose rate limit expired and silent heartbeats."""
+        due: dict[str, dict[str, tuple[Any, int]]] = {}
+
+        for device_id, rule in self._device_rules.items():
+            published = self._published.get(device_id)
+            if not published:
+                continue
+            held = self._held.get(device_id, {})
+
+            for name, (last_value, published_at) in published.items():
+                age = now - published_at
+                if rule.max_silence and age >= rule.max_silence:
+                    due.setdefault(device_id, {})[name] = held.get(
+                        name, (last_value, timestamp)
+                    )
+                elif (
+                    name in held
+                    and age >= rule.min_interval
+                    and not rule.within(last_value, held[name][0])
+                ):
+                    due.setdefault(device_id, {})[name] = held[name]
+
+        return due
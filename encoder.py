@@ -0,0 +1,430 @@
+"""Compiled Sparkplug metric encoders for Helixer."""
+from __future__ import annotations
+
+from collections.abc import Callable
+import math
+import re
+import struct
+from typing import Any, NamedTuple
+
+from homeassistant.const import STATE_UNAVAILABLE, STATE_UNKNOWN
+from homeassistant.core import State
+
+from . import sparkplugb_pb2
+from .const import (
+    DEFAULT_FLATTEN_DEPTH,
+    DEFAULT_FLATTEN_MAX_METRICS,
+    DEFAULT_FLATTEN_MAX_SIZE,
+    LOGGER,
+)
+
+UINT64_MASK = 0xFFFFFFFFFFFFFFFF
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+SIGNED_32 = frozenset(
+    (sparkplugb_pb2.Int8, sparkplugb_pb2.Int16, sparkplugb_pb2.Int32)
+)
+
+# States without a value, published as null metrics.
+NULL_STATES = frozenset((STATE_UNAVAILABLE, STATE_UNKNOWN))
+# Numeric states, float() alone also takes "1_000", " 5 " and "NaN".
+NUMERAL = re.compile(r"[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?")
+
+_MISSING = object()
+
+
+class MetricCodec(NamedTuple):
+    """Sparkplug datatype of a metric and the functions writing its value.
+
+    ``set_value`` writes to a generated Metric, ``serialize`` returns the
+    value field as the streaming writer puts it on the wire.
+    """
+
+    datatype: int
+    set_value: Callable[[Any, Any], None]
+    serialize: Callable[[Any], bytes]
+
+
+def _set_boolean(metric, value: bool) -> None:
+    metric.boolean_value = value
+
+
+def _set_long(metric, value: int) -> None:
+    # Signed integers travel as two's complement in the unsigned field.
+    metric.long_value = value & UINT64_MASK
+
+
+def _set_double(metric, value: float) -> None:
+    metric.double_value = value
+
+
+def _set_string(metric, value: str) -> None:
+    metric.string_value = value
+
+
+def _set_text(metric, value: Any) -> None:
+    metric.string_value = str(value)
+
+
+def varint(value: int) -> bytes:
+    """Return the protobuf varint of an unsigned integer."""
+    if value < 0x80:
+        return bytes((value,))
+    if value < 0x4000:
+        return bytes(((value & 0x7F) | 0x80, value >> 7))
+    if 0x800000000 <= value < 0x40000000000:
+        # Millisecond timestamps, six bytes until the year 2109.
+        return bytes(
+            (
+                (value & 0x7F) | 0x80,
+                (value >> 7 & 0x7F) | 0x80,
+                (value >> 14 & 0x7F) | 0x80,
+                (value >> 21 & 0x7F) | 0x80,
+                (value >> 28 & 0x7F) | 0x80,
+                value >> 35,
+            )
+        )
+    data = bytearray()
+    while value > 0x7F:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+# Serialized value fields of a Metric, tag included, for the streaming writer.
+_BOOLEAN_TRUE = b"\x70\x01"
+_BOOLEAN_FALSE = b"\x70\x00"
+_pack_double = struct.Struct("<Bd").pack
+# Tag and length of strings shorter than 128 bytes.
+_STRING_TAGS = tuple(bytes((0x7A, size)) for size in range(0x80))
+
+
+def _serialize_boolean(value: bool) -> bytes:
+    return _BOOLEAN_TRUE if value else _BOOLEAN_FALSE
+
+
+def _serialize_long(value: int) -> bytes:
+    return b"\x58" + varint(value & UINT64_MASK)
+
+
+def _serialize_double(value: float) -> bytes:
+    return _pack_double(0x69, value)
+
+
+def _serialize_string(value: str) -> bytes:
+    data = value.encode()
+    size = len(data)
+    if size < 0x80:
+        return _STRING_TAGS[size] + data
+    return b"\x7a" + varint(size) + data
+
+
+def _serialize_text(value: Any) -> bytes:
+    return _serialize_string(str(value))
+
+
+# Sparkplug arrays travel packed little-endian in bytes_value.
+def _pack_int64_array(value: tuple[int, ...]) -> bytes:
+    return struct.pack(f"<{len(value)}q", *value)
+
+
+def _pack_double_array(value: tuple[float, ...]) -> bytes:
+    return struct.pack(f"<{len(value)}d", *value)
+
+
+def _pack_boolean_array(value: tuple[bool, ...]) -> bytes:
+    # The element count, then the values packed as bits, first one highest.
+    packed = bytearray((len(value) + 7) // 8)
+    for index, item in enumerate(value):
+        if item:
+            packed[index >> 3] |= 0x80 >> (index & 7)
+    return struct.pack("<I", len(value)) + bytes(packed)
+
+
+def _pack_string_array(value: tuple[str, ...]) -> bytes:
+    return b"".join(item.encode() + b"\0" for item in value)
+
+
+def _bytes_codec(datatype: int, pack: Callable[[tuple], bytes]) -> MetricCodec:
+    def set_value(metric, value: tuple) -> None:
+        metric.bytes_value = pack(value)
+
+    def serialize(value: tuple) -> bytes:
+        data = pack(value)
+        return b"\x82\x01" + varint(len(data)) + data
+
+    return MetricCodec(datatype, set_value, serialize)
+
+
+BOOLEAN = MetricCodec(sparkplugb_pb2.Boolean, _set_boolean, _serialize_boolean)
+INT64 = MetricCodec(sparkplugb_pb2.Int64, _set_long, _serialize_long)
+DOUBLE = MetricCodec(sparkplugb_pb2.Double, _set_double, _serialize_double)
+STRING = MetricCodec(sparkplugb_pb2.String, _set_string, _serialize_string)
+TEXT = MetricCodec(sparkplugb_pb2.String, _set_text, _serialize_text)
+INT64_ARRAY = _bytes_codec(sparkplugb_pb2.Int64Array, _pack_int64_array)
+DOUBLE_ARRAY = _bytes_codec(sparkplugb_pb2.DoubleArray, _pack_double_array)
+BOOLEAN_ARRAY = _bytes_codec(sparkplugb_pb2.BooleanArray, _pack_boolean_array)
+STRING_ARRAY = _bytes_codec(sparkplugb_pb2.StringArray, _pack_string_array)
+
+ARRAY_CODECS = frozenset((INT64_ARRAY, DOUBLE_ARRAY, BOOLEAN_ARRAY, STRING_ARRAY))
+
+CODECS: dict[type, MetricCodec] = {
+    bool: BOOLEAN,
+    int: INT64,
+    float: DOUBLE,
+    str: STRING,
+}
+
+# Codecs a stored datatype is read back as, TEXT is never declared on its own.
+DATATYPE_CODECS: dict[int, MetricCodec] = {
+    codec.datatype: codec
+    for codec in (BOOLEAN, INT64, DOUBLE, STRING, *ARRAY_CODECS)
+}
+
+
+class FlattenLimits(NamedTuple):
+    """How far dict and list attributes are flattened into metrics."""
+
+    # Nesting levels flattened, deeper values are sent as text.
+    depth: int = DEFAULT_FLATTEN_DEPTH
+    # Metrics one attribute may produce before it is skipped.
+    max_metrics: int = DEFAULT_FLATTEN_MAX_METRICS
+    # Bytes a string or an array is truncated to, roughly.
+    max_size: int = DEFAULT_FLATTEN_MAX_SIZE
+
+
+def as_array(items: list | tuple, max_size: int) -> tuple | None:
+    """Return a list of uniform scalars as an array value, None if it is not.
+
+    Arrays longer than ``max_size`` bytes at 8 bytes an element are truncated.
+    """
+    if not items:
+        return ()
+    kinds = {type(item) for item in items}
+    if kinds <= {int, float}:
+        if int in kinds and not INT64_MIN <= min(items) <= max(items) <= INT64_MAX:
+            return None
+    elif not (kinds == {bool} or kinds == {str}):
+        return None
+    return tuple(items[: max(max_size // 8, 1)])
+
+
+def _array_codec(value: tuple, declared: MetricCodec | None) -> MetricCodec:
+    if not value:
+        return declared if declared in ARRAY_CODECS else STRING_ARRAY
+    kind = type(value[0])
+    if kind is bool:
+        return BOOLEAN_ARRAY
+    if kind is str:
+        return STRING_ARRAY
+    if declared is DOUBLE_ARRAY or any(type(item) is float for item in value):
+        return DOUBLE_ARRAY
+    return INT64_ARRAY
+
+
+def codec_for(value: Any, declared: MetricCodec | None = None) -> MetricCodec:
+    """Return the codec of a value given the codec the metric was declared with.
+
+    Null values keep the declared codec and integers are widened to doubles
+    once a metric was declared as Double, so metrics do not flip datatypes.
+    Integers outside the Int64 range are sent as a Double, or as text when
+    even a Double cannot hold them.
+    """
+    if value is None:
+        return declared or STRING
+    if type(value) is tuple:
+        return _array_codec(value, declared)
+    codec = CODECS.get(type(value), TEXT)
+    if codec is INT64:
+        if not INT64_MIN <= value <= INT64_MAX:
+            try:
+                float(value)
+            except OverflowError:
+                return TEXT
+            return DOUBLE
+        if declared is DOUBLE:
+            return DOUBLE
+    return codec
+
+
+def encode(metric, codec: MetricCodec, value: Any, timestamp: int) -> None:
+    """Write a value and its timestamp to a metric."""
+    if value is None:
+        metric.is_null = True
+    else:
+        codec.set_value(metric, value)
+    metric.timestamp = timestamp
+
+
+def decode(metric) -> Any:
+    """Return the value of a received metric, None if it is null."""
+    if metric.is_null:
+        return None
+    field = metric.WhichOneof("value")
+    if field is None:
+        return None
+    value = getattr(metric, field)
+    if field == "long_value" and metric.datatype == sparkplugb_pb2.Int64:
+        if value > 0x7FFFFFFFFFFFFFFF:
+            value -= 1 << 64
+    elif field == "int_value" and metric.datatype in SIGNED_32:
+        if value > 0x7FFFFFFF:
+            value -= 1 << 32
+    return value
+
+
+HISTORY_METRIC = "history/state"
+DATASET_COLUMNS = ("timestamp", "value")
+
+
+def add_dataset(metric, rows: list[tuple[int, Any]]) -> None:
+    """Write ``(timestamp, value)`` rows to a metric as a DataSet.
+
+    The value column is Boolean or Double when every value is, and String
+    otherwise.
+    """
+    kinds = {type(value) for _, value in rows}
+    if kinds <= {bool}:
+        datatype, field = sparkplugb_pb2.Boolean, "boolean_value"
+    elif kinds <= {int, float}:
+        datatype, field = sparkplugb_pb2.Double, "double_value"
+    else:
+        datatype, field = sparkplugb_pb2.String, "string_value"
+        rows = [(timestamp, str(value)) for timestamp, value in rows]
+
+    metric.datatype = sparkplugb_pb2.DataSet
+    dataset = metric.dataset_value
+    dataset.num_of_columns = len(DATASET_COLUMNS)
+    dataset.columns.extend(DATASET_COLUMNS)
+    dataset.types.extend((sparkplugb_pb2.DateTime, datatype))
+    for timestamp, value in rows:
+        elements = dataset.rows.add().elements
+        elements.add().long_value = timestamp
+        setattr(elements.add(), field, value)
+
+
+def parse_state(state: str) -> bool | float | str | None:
+    """Return the typed value of a state string.
+
+    Every numeric state is a float, so a sensor going from ``20`` to
+    ``20.5`` does not change its datatype. Only plain decimal numerals are
+    numbers, other spellings float() accepts stay strings.
+    """
+    if state in NULL_STATES:
+        return None
+    lowered = state.lower()
+    if lowered == "true" or lowered == "false":
+        return lowered == "true"
+    if NUMERAL.fullmatch(state) is None:
+        return state
+    number = float(state)
+    return number if math.isfinite(number) else state
+
+
+class EntityEncoder:
+    """Metric names of one entity, resolved once per attribute.
+
+    Names are built the first time an attribute or a key of a flattened
+    attribute is seen and looked up afterwards.
+    """
+
+    __slots__ = ("device_id", "_limits", "_names", "_nested")
+
+    def __init__(self, entity_id: str, limits: FlattenLimits = FlattenLimits()) -> None:
+        self.device_id = entity_id.replace(".", "/")
+        self._limits = limits
+        self._names: dict[str, str] = {}
+        # parent metric name -> key -> metric name
+        self._nested: dict[str, dict[Any, str]] = {}
+
+    def _name(self, attribute: str) -> str:
+        name = self._names[attribute] = f"attributes/{attribute}"
+        return name
+
+    def _nested_name(self, parent: str, key: Any) -> str:
+        names = self._nested.get(parent)
+        if names is None:
+            names = self._nested[parent] = {}
+        name = names.get(key)
+        if name is None:
+            name = names[key] = f"{parent}.{key}"
+        return name
+
+    def _flatten(
+        self,
+        name: str,
+        value: Any,
+        depth: int,
+        metrics: dict[str, tuple[Any, int]],
+        timestamp: int,
+    ) -> bool:
+        """Add the metrics of a value, return False once there are too many.
+
+        Lists of uniform scalars become one array metric, other dicts and
+        lists one metric per key or element up to the depth limit.
+        """
+        limits = self._limits
+        value_type = type(value)
+        if value_type is dict or value_type is list or value_type is tuple:
+            array = None if value_type is dict else as_array(value, limits.max_size)
+            if array is not None:
+                value = array
+            elif depth > limits.depth:
+                value = str(value)
+            else:
+                items = value.items() if value_type is dict else enumerate(value)
+                for key, item in items:
+                    nested = self._nested_name(name, key)
+                    if not self._flatten(nested, item, depth + 1, metrics, timestamp):
+                        return False
+                return True
+        if type(value) is str and len(value) > limits.max_size:
+            value = value[: limits.max_size]
+        metrics[name] = (value, timestamp)
+        return len(metrics) <= limits.max_metrics
+
+    def diff(
+        self, old: State | None, new: State, timestamp: int
+    ) -> dict[str, tuple[Any, int]]:
+        """Return the metrics that changed between two states.
+
+        Without an old state, the state and every attribute are returned.
+        Dicts and lists are flattened within the limits of the encoder, an
+        attribute producing too many metrics is left out.
+        """
+        metrics: dict[str, tuple[Any, int]] = {}
+
+        if old is None or new.state != old.state:
+            metrics["state"] = (parse_state(new.state), timestamp)
+
+        new_attributes = new.attributes
+        old_attributes = None if old is None else old.attributes
+        if old_attributes is new_attributes:
+            return metrics
+
+        names = self._names
+        max_size = self._limits.max_size
+        for attribute, value in new_attributes.items():
+            if old_attributes and value == old_attributes.get(attribute, _MISSING):
+                continue
+
+            value_type = type(value)
+            name = names.get(attribute) or self._name(attribute)
+            if value_type is dict or value_type is list or value_type is tuple:
+                flattened: dict[str, tuple[Any, int]] = {}
+                if self._flatten(name, value, 1, flattened, timestamp):
+                    metrics.update(flattened)
+                else:
+                    LOGGER.debug(
+                        "Skipping %s of %s, it has too many items",
+                        attribute,
+                        new.entity_id,
+                    )
+            elif value_type is str and len(value) > max_size:
+                metrics[name] = (value[:max_size], timestamp)
+            else:
+                metrics[name] = (value, timestamp)
+
+        return metrics
@@ -1,6 +1,7 @@
 """HelixerEntity class."""
 from __future__ import annotations
 
+from homeassistant.helpers.device_registry import DeviceEntryType
 from homeassistant.helpers.entity import DeviceInfo
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
@@ -8,18 +9,20 @@ from .const import ATTRIBUTION, DOMAIN, NAME, VERSION
 from .coordinator import HelixerDataUpdateCoordinator
 
 
-class HelixerEntity(CoordinatorEntity):
+class HelixerEntity(CoordinatorEntity[HelixerDataUpdateCoordinator]):
     """HelixerEntity class."""
 
     _attr_attribution = ATTRIBUTION
+    _attr_has_entity_name = True
 
-    def __init__(self, coordinator: HelixerDataUpdateCoordinator) -> None:
+    def __init__(self, coordinator: HelixerDataUpdateCoordinator, key: str) -> None:
         """Initialize."""
         super().__init__(coordinator)
-        self._attr_unique_id = coordinator.config_entry.entry_id
+        self._attr_unique_id = f"{coordinator.config_entry.entry_id}_{key}"
         self._attr_device_info = DeviceInfo(
-            identifiers={(DOMAIN, self.unique_id)},
+            identifiers={(DOMAIN, coordinator.config_entry.entry_id)},
             name=NAME,
             model=VERSION,
             manufacturer=NAME,
+            entry_type=DeviceEntryType.SERVICE,
         )
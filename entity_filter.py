@@ -0,0 +1,156 @@
+"""Entity inclusion/exclusion index for Helixer."""
+from __future__ import annotations
+
+from collections.abc import Mapping
+import fnmatch
+import re
+from typing import Any
+
+from homeassistant.core import CALLBACK_TYPE, Event, HomeAssistant, callback
+from homeassistant.helpers import device_registry as dr, entity_registry as er
+
+from .const import (
+    CONF_EXCLUDE_AREAS,
+    CONF_EXCLUDE_DEVICES,
+    CONF_EXCLUDE_DOMAINS,
+    CONF_EXCLUDE_ENTITY_GLOBS,
+    CONF_EXCLUDE_LABELS,
+    CONF_INCLUDE_AREAS,
+    CONF_INCLUDE_DEVICES,
+    CONF_INCLUDE_DOMAINS,
+    CONF_INCLUDE_ENTITY_GLOBS,
+    CONF_INCLUDE_LABELS,
+)
+
+
+class _Rules:
+    """One set of include or exclude rules, compiled for fast matching."""
+
+    def __init__(
+        self,
+        domains: list[str],
+        entity_globs: list[str],
+        areas: list[str],
+        devices: list[str],
+        labels: list[str],
+    ) -> None:
+        self.domains = frozenset(domains)
+        self.glob = (
+            re.compile("|".join(fnmatch.translate(glob) for glob in entity_globs))
+            if entity_globs
+            else None
+        )
+        self.areas = frozenset(areas)
+        self.devices = frozenset(devices)
+        self.labels = frozenset(labels)
+
+    def __bool__(self) -> bool:
+        return bool(
+            self.domains or self.glob or self.areas or self.devices or self.labels
+        )
+
+    def match(
+        self,
+        entity_id: str,
+        domain: str,
+        area_id: str | None,
+        device_id: str | None,
+        labels: set[str],
+    ) -> bool:
+        return (
+            domain in self.domains
+            or (self.glob is not None and self.glob.match(entity_id) is not None)
+            or area_id in self.areas
+            or device_id in self.devices
+            or not self.labels.isdisjoint(labels)
+        )
+
+
+class HelixerEntityFilter:
+    """Decide which entities are published upstream.
+
+    Decisions are cached per entity_id so the event filter is a single dict
+    lookup; the cache is invalidated when the entity or device registry
+    changes. Exclude rules win over include rules, and without include rules
+    every entity that is not excluded is published.
+    """
+
+    def __init__(self, hass: HomeAssistant, options: Mapping[str, Any]) -> None:
+        self._hass = hass
+        self._include = _Rules(
+            options.get(CONF_INCLUDE_DOMAINS, []),
+            options.get(CONF_INCLUDE_ENTITY_GLOBS, []),
+            options.get(CONF_INCLUDE_AREAS, []),
+            options.get(CONF_INCLUDE_DEVICES, []),
+            options.get(CONF_INCLUDE_LABELS, []),
+        )
+        self._exclude = _Rules(
+            options.get(CONF_EXCLUDE_DOMAINS, []),
+            options.get(CONF_EXCLUDE_ENTITY_GLOBS, []),
+            options.get(CONF_EXCLUDE_AREAS, []),
+            options.get(CONF_EXCLUDE_DEVICES, []),
+            options.get(CONF_EXCLUDE_LABELS, []),
+        )
+        self._index: dict[str, bool] = {}
+
+    @callback
+    def async_setup(self) -> CALLBACK_TYPE:
+        """Invalidate the index on registry changes, return the unsubscriber."""
+
+        @callback
+        def _entity_registry_updated(evt: Event) -> None:
+            self._index.pop(evt.data["entity_id"], None)
+            if "old_entity_id" in evt.data:
+                self._index.pop(evt.data["old_entity_id"], None)
+
+        @callback
+        def _device_registry_updated(evt: Event) -> None:
+            self._index.clear()
+
+        unsubscribers = [
+            self._hass.bus.async_listen(
+                er.EVENT_ENTITY_REGISTRY_UPDATED, _entity_registry_updated
+            ),
+            self._hass.bus.async_listen(
+                dr.EVENT_DEVICE_REGISTRY_UPDATED, _device_registry_updated
+            ),
+        ]
+
+        @callback
+        def _unsubscribe() -> None:
+            while unsubscribers:
+                unsubscribers.pop()()
+
+        return _unsubscribe
+
+    @callback
+    def __call__(self, entity_id: str) -> bool:
+        """Return True if the entity should be published."""
+        included = self._index.get(entity_id)
+        if included is None:
+            included = self._index[entity_id] = self._evaluate(entity_id)
+        return included
+
+    def _evaluate(self, entity_id: str) -> bool:
+        if not self._include and not self._exclude:
+            return True
+
+        domain = entity_id.partition(".")[0]
+        area_id = device_id = None
+        labels: set[str] = set()
+
+        if entry := er.async_get(self._hass).async_get(entity_id):
+            device_id = entry.device_id
+            area_id = entry.area_id
+            labels.update(getattr(entry, "labels", ()))
+
+        if device_id is not None and (
+            device := dr.async_get(self._hass).async_get(device_id)
+        ):
+            area_id = area_id or device.area_id
+            labels.update(getattr(device, "labels", ()))
+
+        args = (entity_id, domain, area_id, device_id, labels)
+        if self._exclude and self._exclude.match(*args):
+            return False
+        return not self._include or self._include.match(*args)
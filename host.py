@@ -0,0 +1,81 @@
+"""Sparkplug primary host application tracking for Helixer."""
+from __future__ import annotations
+
+from collections.abc import Callable
+import json
+from typing import Any
+
+from .const import LOGGER
+
+
+def parse_host_state(data: bytes) -> tuple[bool | None, int | None]:
+    """Return whether a STATE payload reports the host online, and its timestamp.
+
+    Sparkplug 3.0 hosts publish ``{"online": true, "timestamp": ...}``, older
+    ones the plain strings ``ONLINE`` and ``OFFLINE``.
+    """
+    text = data.decode("utf-8", "replace").strip()
+    if text.upper() in ("ONLINE", "OFFLINE"):
+        return text.upper() == "ONLINE", None
+    try:
+        state = json.loads(text)
+    except ValueError:
+        return None, None
+    if not isinstance(state, dict) or type(state.get("online")) is not bool:
+        return None, None
+    timestamp = state.get("timestamp")
+    return state["online"], timestamp if type(timestamp) is int else None
+
+
+class HelixerPrimaryHost:
+    """Follow the retained STATE message of the primary host application.
+
+    The callbacks run in the MQTT network thread whenever the host goes
+    online or offline. STATE messages older than the last one are ignored.
+    Until the first message arrives the host is considered offline.
+    """
+
+    def __init__(
+        self,
+        host_id: str,
+        on_online: Callable[[], None],
+        on_offline: Callable[[], None],
+    ) -> None:
+        self.topic = f"spBv1.0/STATE/{host_id}"
+        self._on_online = on_online
+        self._on_offline = on_offline
+        self._timestamp: int | None = None
+
+        self.online = False
+        self.transitions = 0
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        """Return the host state."""
+        return {
+            "online": self.online,
+            "timestamp": self._timestamp,
+            "transitions": self.transitions,
+        }
+
+    def handle_message(self, topic: str, data: bytes) -> None:
+        """Handle a STATE message, runs in the network thread."""
+        online, timestamp = parse_host_state(data)
+        if online is None:
+            LOGGER.warning("Ignoring invalid STATE payload on %s", topic)
+            return
+        if timestamp is not None:
+            if self._timestamp is not None and timestamp < self._timestamp:
+                LOGGER.debug("Ignoring stale STATE message on %s", topic)
+                return
+            self._timestamp = timestamp
+
+        if online == self.online:
+            return
+        self.online = online
+        self.transitions += 1
+        LOGGER.info("Primary host is %s", "online" if online else "offline")
+        if online:
+            self._on_online()
+        else:
+            self._on_offline()
@@ -1,132 +1,109 @@
-from . import sparkplugb_pb2
-from .client import HelixerClient
+import time
+
 from homeassistant.const import EVENT_HOMEASSISTANT_STOP, EVENT_STATE_CHANGED
-from homeassistant.core import Event, HomeAssistant, State, callback
+from homeassistant.core import CALLBACK_TYPE, Event, HomeAssistant, State, callback
 from .const import LOGGER
+from .entity_filter import HelixerEntityFilter
+from .pipeline import HelixerPipeline
+from .stats import HelixerStats
 
 
 class HelixerListener:
     def __init__(
         self,
-        client: HelixerClient,
-        base_topic: str,
+        pipeline: HelixerPipeline,
+        entity_filter: HelixerEntityFilter,
+        stats: HelixerStats,
     ) -> None:
-        self._client = client
-        self._base_topic = base_topic
-
-    async def _state_publisher(self, evt: Event) -> None:
-        entity_id: str = evt.data["entity_id"]
-        new: State = evt.data["new_state"]
-
-        new_state = new.state
-        old_state = (
-            evt.data["new_state"].state
-            if evt.data["old_state"] is None
-            else evt.data["old_state"].state
-        )
+        self._pipeline = pipeline
+        self._entity_filter = entity_filter
+        self._stats = stats
+        self._unsubscribers: list[CALLBACK_TYPE] = []
+        self._unsub_stop: CALLBACK_TYPE | None = None
+        self._hass: HomeAssistant | None = None
 
-        new_attributes = new.attributes
-        old_attributes = (
-            evt.data["new_state"].attributes
-            if evt.data["old_state"] is None
-            else evt.data["old_state"].attributes
+    @callback
+    def _state_publisher(self, evt: Event) -> None:
+        # Only hand over a snapshot, the pipeline worker builds the payloads.
+        if not self._stats.sample_event():
+            self._pipeline.enqueue(
+                evt.data["entity_id"], evt.data["old_state"], evt.data["new_state"]
+            )
+            return
+
+        started = time.perf_counter()
+        self._pipeline.enqueue(
+            evt.data["entity_id"], evt.data["old_state"], evt.data["new_state"]
         )
+        self._stats.state_publisher_time.observe(time.perf_counter() - started)
+
+    @callback
+    def async_rebirth(self) -> None:
+        """Publish births again, followed by a snapshot of the included states.
+
+        Before Home Assistant has started only the NBIRTH is sent, the
+        snapshot follows once the listener starts.
+        """
+        states = self._snapshot() if self._hass is not None else []
+        LOGGER.debug("Rebirth with a snapshot of %s states", len(states))
+        self._pipeline.request_rebirth(states)
 
-        timestamp = int(new.last_updated.timestamp())
-
-        payload = sparkplugb_pb2.Payload()
-        payload.timestamp = timestamp
-
-        if new_state != old_state:
-            metric = payload.metrics.add()
-            metric.name = "state"
-            self.cast_value(metric, new_state, timestamp)
-
-        attributes_to_send = {}
-
-        if not old_attributes:
-            attributes_to_send = new_attributes
-        else:
-            for attribute in new_attributes:
-                if (
-                    attribute not in old_attributes
-                    or new_attributes[attribute] != old_attributes[attribute]
-                ):
-                    attributes_to_send[attribute] = new_attributes[attribute]
-
-        for attribute in attributes_to_send:
-            metric = payload.metrics.add()
-
-            if type(attributes_to_send[attribute]) is dict:
-                for sub_attribute in attributes_to_send[attribute]:
-                    metric = payload.metrics.add()
-                    metric.name = f"attributes/{attribute}.{sub_attribute}"
-                    self.add_metric_value(
-                        metric, attributes_to_send[attribute][sub_attribute], timestamp
-                    )
-
-            elif type(attributes_to_send[attribute]) is list:
-                for i, item in enumerate(attributes_to_send[attribute]):
-                    metric = payload.metrics.add()
-                    metric.name = f"attributes/{attribute}.{i}"
-                    self.add_metric_value(metric, item, timestamp)
-            else:
-                metric = payload.metrics.add()
-                metric.name = f"attributes/{attribute}"
-                self.add_metric_value(metric, attributes_to_send[attribute], timestamp)
-
-        if payload.metrics.__len__() > 0:
-            topic = f"spBv1.0/homeassistant/DDATA/{self._base_topic}/{entity_id.replace('.', '/')}"
-            self._client.publish(topic, payload)
-
-    def add_metric_value(self, metric, value, timestamp):
-        if type(value) is bool:
-            metric.boolean_value = value
-        elif type(value) is int:
-            metric.int_value = value
-        elif type(value) is float:
-            metric.float_value = value
-        elif type(value) is str:
-            metric.string_value = value
-        else:
-            LOGGER.warning(f"Unsupported type {type(value)} for value {value}")
-            metric.string_value = str(value)
-
-        metric.timestamp = int(timestamp * 1000)
-
-    def cast_value(self, metric, value: str, timestamp) -> str | int | float | bool:
-        LOGGER.debug(f"Cast value {value} to {type(value)}")
-
-        if value.lower() in ["true", "false"]:
-            metric.bool_value = bool(value)
-        elif value.isdigit():
-            metric.int_value = int(value)
-        elif value.replace(".", "", 1).isdigit():
-            metric.float_value = float(value)
-        else:
-            metric.string_value = str(value)
-
-        metric.timestamp = int(timestamp * 1000)
+    @callback
+    def async_resume(self) -> None:
+        """Resume the pipeline with a snapshot, so every device is born again."""
+        self._pipeline.resume(self._snapshot() if self._hass is not None else None)
+
+    def _snapshot(self) -> list[State]:
+        return [
+            state
+            for state in self._hass.states.async_all()
+            if self._entity_filter(state.entity_id)
+        ]
 
     @callback
     def ha_started(self, ha: HomeAssistant) -> None:
         LOGGER.info("Starting Helixer listener")
+        self._hass = ha
 
         @callback
         def _event_filter(evt: Event) -> bool:
             entity_id: str = evt.data["entity_id"]
             new_state: State | None = evt.data["new_state"]
-            if new_state is None:
+            self._stats.events_received += 1
+            if new_state is None or not self._entity_filter(entity_id):
+                self._stats.events_filtered += 1
                 return False
             return True
 
-        callback_handler = ha.bus.async_listen(
-            EVENT_STATE_CHANGED, self._state_publisher, _event_filter
+        self._unsubscribers.append(self._entity_filter.async_setup())
+        self._unsubscribers.append(
+            ha.bus.async_listen(
+                EVENT_STATE_CHANGED,
+                self._state_publisher,
+                _event_filter,
+                run_immediately=True,
+            )
         )
 
+        self.async_rebirth()
+
         @callback
-        def _ha_stopping(self) -> None:
+        def _ha_stopping(evt: Event) -> None:
             LOGGER.info("Stopping Helixer listener")
-            callback_handler()
+            self._unsub_stop = None
+            self.stop()
 
-        ha.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _ha_stopping)
+        self._unsub_stop = ha.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP, _ha_stopping
+        )
+
+    @callback
+    def stop(self) -> None:
+        """Stop listening and let the pipeline flush whatever is still pending."""
+        if self._unsub_stop is not None:
+            self._unsub_stop()
+            self._unsub_stop = None
+        while self._unsubscribers:
+            self._unsubscribers.pop()()
+        self._hass = None
+        self._pipeline.stop()
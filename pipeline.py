@@ -0,0 +1,286 @@
+"""Worker pipeline for Helixer."""
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Iterable
+import queue
+import threading
+import time
+from typing import Any
+
+from homeassistant.core import State
+
+from .const import DROP_OLDEST, LOGGER
+from .publisher import HelixerBatchPublisher
+
+# How often held back values and heartbeats are checked.
+DEADBAND_CHECK_INTERVAL = 1
+# The state snapshot after a rebirth is sent this many entities at a time,
+# with a pause in between so live changes and the broker can keep up.
+SNAPSHOT_CHUNK_SIZE = 50
+SNAPSHOT_CHUNK_INTERVAL = 0.1
+# How long stopping waits for the worker to flush and exit.
+STOP_TIMEOUT = 10
+
+_REBIRTH = object()
+_STOP = object()
+# First item of the (_HISTORY, entity_id, rows) history pages.
+_HISTORY = object()
+
+
+class HelixerPipeline:
+    """Hand state changes from the event loop to a publishing worker thread.
+
+    The event loop only puts ``(entity_id, old_state, new_state)`` snapshots
+    on a bounded queue. The worker thread diffs them, builds and serializes
+    the payloads and publishes them, and also drives the flush window of the
+    publisher. When the queue is full the oldest or the newest snapshot is
+    dropped, depending on the drop policy; stop and rebirth requests are
+    always queued.
+
+    After a rebirth the worker walks the states handed to ``request_rebirth``
+    in chunks, interleaved with live changes, so every device gets its DBIRTH
+    without one large burst. Entities that changed since the rebirth are
+    skipped, the live change already carried a newer state than the snapshot.
+    Once the snapshot is out, the offline buffer of the client is replayed.
+
+    While paused, for instance when no primary host is online, nothing is
+    diffed or published and state changes are discarded. Resuming is a full
+    rebirth: its snapshot is made of the states handed to ``resume``, or else
+    of a snapshot requested while paused.
+    """
+
+    def __init__(
+        self,
+        publisher: HelixerBatchPublisher,
+        max_queue: int,
+        drop_policy: str,
+        paused: bool = False,
+    ) -> None:
+        self._publisher = publisher
+        self._queue: queue.Queue = queue.Queue(max_queue)
+        self._drop_oldest = drop_policy == DROP_OLDEST
+        self._rebirth_lock = threading.Lock()
+        self._rebirth_requested = False
+        self._rebirth_states: list[State] = []
+        self._paused = paused
+        self._thread: threading.Thread | None = None
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.errors = 0
+        self._snapshot_pending = 0
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        """Return the pipeline counters."""
+        return {
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "queue_depth": self._queue.qsize(),
+            "snapshot_pending": self._snapshot_pending,
+            "paused": self._paused,
+        }
+
+    @property
+    def paused(self) -> bool:
+        """Return True while nothing is published."""
+        return self._paused
+
+    def start(self) -> None:
+        """Start the worker thread."""
+        self._thread = threading.Thread(
+            target=self._run, name="helixer-pipeline", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Ask the worker to flush what is pending and exit."""
+        self._put(_STOP)
+
+    def join(self, timeout: float | None = STOP_TIMEOUT) -> None:
+        """Wait for the worker thread to exit."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                LOGGER.warning(
+                    "Helixer pipeline did not stop within %s seconds", timeout
+                )
+            self._thread = None
+
+    def enqueue(self, entity_id: str, old: State | None, new: State) -> None:
+        """Queue a state change, called from the event loop."""
+        if self._put((entity_id, old, new)):
+            self.enqueued += 1
+
+    def enqueue_history(self, entity_id: str, rows: list[tuple[int, Any]]) -> bool:
+        """Queue a page of ``(timestamp, value)`` recorder history of an entity.
+
+        Pages are never dropped, False means the queue is full and the page
+        has to be offered again later.
+        """
+        try:
+            self._queue.put_nowait((_HISTORY, entity_id, rows))
+        except queue.Full:
+            return False
+        return True
+
+    def request_rebirth(self, states: Iterable[State] = ()) -> None:
+        """Ask the worker to publish births again followed by a state snapshot.
+
+        A snapshot that is still running is replaced by the new one.
+        """
+        with self._rebirth_lock:
+            self._rebirth_requested = True
+            self._rebirth_states = list(states)
+        self._put(_REBIRTH)
+
+    def pause(self) -> None:
+        """Stop publishing and only remember which entities changed."""
+        self._paused = True
+
+    def resume(self, states: Iterable[State] | None = None) -> None:
+        """Publish births again followed by a snapshot of ``states``.
+
+        Without states, the snapshot requested while paused is used.
+        """
+        with self._rebirth_lock:
+            self._paused = False
+            self._rebirth_requested = True
+            if states is not None:
+                self._rebirth_states = list(states)
+        self._put(_REBIRTH)
+
+    def _put(self, item: Any) -> bool:
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+
+        control = item is _STOP or item is _REBIRTH
+        self.dropped += 1
+        if not control and not self._drop_oldest:
+            return False
+
+        # Make room by dropping the oldest snapshot. Control messages and
+        # history are never dropped, control messages are queued beyond the
+        # limit if nothing else is.
+        with self._queue.mutex:
+            pending = self._queue.queue
+            for index, queued in enumerate(pending):
+                if type(queued) is tuple and queued[0] is not _HISTORY:
+                    del pending[index]
+                    break
+            else:
+                if not control:
+                    return False
+                self.dropped -= 1
+                self._queue.unfinished_tasks += 1
+            pending.append(item)
+            self._queue.not_empty.notify()
+        return True
+
+    def _run(self) -> None:
+        publisher = self._publisher
+        snapshot: deque[State] = deque()
+        # Entities published live while the snapshot is running.
+        live: set[str] = set()
+        # Whether the offline buffer is replayed once the snapshot is out.
+        replay = False
+        # History pages queued before the pause, published on resume.
+        held: list[tuple[Any, str, list]] = []
+        flush_at: float | None = None
+        snapshot_at: float | None = None
+        release_at = (
+            time.monotonic() + DEADBAND_CHECK_INTERVAL
+            if publisher.uses_deadband
+            else None
+        )
+
+        while True:
+            deadlines = [
+                at
+                for at in (flush_at, snapshot_at, release_at)
+                if at is not None and not self._paused
+            ]
+            timeout = (
+                max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+            )
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            try:
+                if item is _STOP:
+                    if not self._paused:
+                        publisher.flush()
+                    return
+
+                if self._paused:
+                    # State changes are dropped, the snapshot on resume
+                    # carries the latest states. History waits for it.
+                    if type(item) is tuple and item[0] is _HISTORY:
+                        held.append(item)
+                    continue
+
+                if self._rebirth_requested:
+                    with self._rebirth_lock:
+                        self._rebirth_requested = False
+                        states = self._rebirth_states
+                        self._rebirth_states = []
+                    snapshot = deque(states)
+                    live = set()
+                    publisher.rebirth(snapshot)
+                    snapshot_at = time.monotonic() if snapshot else None
+                    # Without a snapshot no device is born yet, the replay
+                    # waits for the snapshot that follows.
+                    replay = bool(snapshot)
+                    for _, entity_id, rows in held:
+                        publisher.publish_history(entity_id, rows)
+                    held = []
+
+                if item is None or item is _REBIRTH:
+                    pass
+                elif item[0] is _HISTORY:
+                    publisher.publish_history(item[1], item[2])
+                else:
+                    if snapshot:
+                        live.add(item[0])
+                    if publisher.add_state(*item):
+                        publisher.flush()
+                        flush_at = None
+
+                now = time.monotonic()
+                if snapshot_at is not None and now >= snapshot_at:
+                    sent = 0
+                    while snapshot and sent < SNAPSHOT_CHUNK_SIZE:
+                        state = snapshot.popleft()
+                        if state.entity_id not in live:
+                            publisher.add_state(state.entity_id, None, state)
+                            sent += 1
+                    publisher.flush()
+                    flush_at = None
+                    if not snapshot:
+                        live = set()
+                        if replay:
+                            replay = False
+                            publisher.replay_buffered()
+                    snapshot_at = now + SNAPSHOT_CHUNK_INTERVAL if snapshot else None
+                self._snapshot_pending = len(snapshot)
+
+                if flush_at is not None and now >= flush_at:
+                    publisher.flush()
+                    flush_at = None
+                if release_at is not None and now >= release_at:
+                    publisher.release_held()
+                    release_at = now + DEADBAND_CHECK_INTERVAL
+                # New changes, and metrics a failed flush queued again, go
+                # out with the next flush window.
+                if flush_at is None and publisher.has_pending:
+                    flush_at = now + publisher.interval
+            except Exception:  # pylint: disable=broad-except
+                self.errors += 1
+                LOGGER.exception("Error in Helixer pipeline")
@@ -0,0 +1,579 @@
+"""Coalescing publisher for Helixer."""
+from __future__ import annotations
+
+from collections.abc import Iterable
+import time
+from typing import Any
+import zlib
+
+from google.protobuf.message import DecodeError
+from homeassistant.const import ATTR_DEVICE_CLASS
+from homeassistant.core import State
+
+from . import sparkplugb_pb2
+from .client import HelixerClient
+from .cache import HelixerPublishedCache
+from .compression import unwrap
+from .const import GROUP_ID, LOGGER
+from .deadband import HelixerDeadband
+from .encoder import (
+    BOOLEAN,
+    DATATYPE_CODECS,
+    HISTORY_METRIC,
+    EntityEncoder,
+    FlattenLimits,
+    MetricCodec,
+    add_dataset,
+    codec_for,
+    encode,
+)
+from .registry import HelixerMetricRegistry
+from .sharding import HelixerShardedClient, HelixerShardMap
+from .templates import INSTANCE_METRIC, HelixerTemplates
+from .wire import PayloadWriter, protobuf_backend
+
+# Events seen in one window above/below which the window is stretched/shrunk.
+ADAPTIVE_GROW_EVENTS = 200
+ADAPTIVE_SHRINK_EVENTS = 20
+ADAPTIVE_FACTOR = 1.5
+
+NODE_CONTROL_REBIRTH = "Node Control/Rebirth"
+
+
+class HelixerBatchPublisher:
+    """Merge metric changes into one DDATA payload per device per flush window.
+
+    The publisher is not thread-safe; it is driven by the pipeline worker
+    thread, which also decides when a flush window has expired. With a
+    ``writer``, DDATA and DBIRTH payloads other than template instances are
+    serialized by it instead of the generated protobuf classes.
+    """
+
+    def __init__(
+        self,
+        client: HelixerClient | HelixerShardedClient,
+        registry: HelixerMetricRegistry,
+        deadband: HelixerDeadband,
+        base_topic: str,
+        min_interval: float,
+        max_interval: float,
+        max_metrics: int,
+        shard_map: HelixerShardMap | None = None,
+        templates: HelixerTemplates | None = None,
+        flatten: FlattenLimits = FlattenLimits(),
+        writer: PayloadWriter | None = None,
+    ) -> None:
+        self._client = client
+        self._registry = registry
+        self._deadband = deadband
+        self._base_topic = base_topic
+        self._shard_map = shard_map
+        self._templates = templates
+        self._flatten = flatten
+        self._writer = writer
+        self._min_interval = min_interval
+        self._max_interval = max(min_interval, max_interval)
+        self._interval = min_interval
+        self._max_metrics = max_metrics
+
+        self._pending: dict[str, dict[str, tuple[Any, int]]] = {}
+        self._pending_metrics = 0
+        self._window_events = 0
+
+        # What the host has, to build complete births and skip repeated values.
+        self._published = HelixerPublishedCache()
+        self._born: set[str] = set()
+
+        self._encoders: dict[str, EntityEncoder] = {}
+        # Codec every metric was last declared with, per device.
+        self._codecs: dict[str, dict[str, MetricCodec]] = {}
+        # Template of every device born as a template instance.
+        self._instances: dict[str, str] = {}
+        # Devices whose births declare the history DataSet.
+        self._history: set[str] = set()
+
+        self.events_in = 0
+        self.payloads_out = 0
+        self.metrics_out = 0
+        self.births_out = 0
+
+    @property
+    def interval(self) -> float:
+        """Return the current flush window in seconds."""
+        return self._interval
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        """Return the publisher counters."""
+        return {
+            "events_in": self.events_in,
+            "payloads_out": self.payloads_out,
+            "births_out": self.births_out,
+            "metrics_out": self.metrics_out,
+            "pending_devices": len(self._pending),
+            "pending_metrics": self._pending_metrics,
+            "flush_interval": self._interval,
+            "published_devices": self._published.devices,
+            "published_metrics": len(self._published),
+            "templates": (
+                self._templates.stats if self._templates is not None else None
+            ),
+            "serializer": "protobuf" if self._writer is None else "streaming",
+            "protobuf_backend": protobuf_backend(),
+        }
+
+    @property
+    def has_pending(self) -> bool:
+        """Return True if there is something to flush."""
+        return bool(self._pending)
+
+    @property
+    def uses_deadband(self) -> bool:
+        """Return True if held back values have to be released periodically."""
+        return bool(self._deadband)
+
+    def add_state(self, entity_id: str, old: State | None, new: State) -> bool:
+        """Queue the changes between two states, return True to flush now.
+
+        Without an old state, or while the device is not born, the state and
+        every attribute are queued, so its DBIRTH declares all its metrics.
+        """
+        encoder = self._encoders.get(entity_id)
+        if encoder is None:
+            encoder = self._encoders[entity_id] = EntityEncoder(
+                entity_id, self._flatten
+            )
+        if old is not None and encoder.device_id not in self._born:
+            old = None
+
+        metrics = encoder.diff(old, new, int(new.last_updated.timestamp() * 1000))
+        if not metrics:
+            return False
+        return self.add(
+            encoder.device_id, metrics, new.attributes.get(ATTR_DEVICE_CLASS)
+        )
+
+    def add(
+        self,
+        device_id: str,
+        metrics: dict[str, tuple[Any, int]],
+        device_class: str | None = None,
+    ) -> bool:
+        """Queue metric changes of a device, keeping only the latest per name.
+
+        Return True once the pending metric cap is reached.
+        """
+        self.events_in += 1
+        self._window_events += 1
+
+        if self._deadband:
+            self._deadband.set_rule(
+                device_id,
+                self._deadband.rule_for(device_id.partition("/")[0], device_class),
+            )
+
+        pending = self._pending.setdefault(device_id, {})
+        before = len(pending)
+        pending.update(metrics)
+        self._pending_metrics += len(pending) - before
+
+        return self._pending_metrics >= self._max_metrics
+
+    def release_held(self) -> None:
+        """Flush held back values whose rate limit expired and due heartbeats."""
+        due = self._deadband.due(time.monotonic(), int(time.time() * 1000))
+        if not due:
+            return
+        for device_id, metrics in due.items():
+            self._requeue(device_id, metrics)
+        # Heartbeats repeat the published value on purpose.
+        self.flush(due)
+
+    def _requeue(self, device_id: str, metrics: dict[str, tuple[Any, int]]) -> None:
+        """Queue metrics again, newer pending values win."""
+        pending = self._pending.setdefault(device_id, {})
+        for name, value in metrics.items():
+            if pending.setdefault(name, value) is value:
+                self._pending_metrics += 1
+
+    def flush(self, repeat: dict[str, dict[str, Any]] | None = None) -> None:
+        """Publish one DDATA payload for every device with pending changes.
+
+        Values the host already has are left out, unless listed in ``repeat``.
+        Metrics that could not be published are queued again.
+        """
+        pending = self._pending
+        self._pending = {}
+        self._pending_metrics = 0
+        self._adapt_interval()
+        now = time.monotonic()
+        published = self._published
+
+        for device_id, metrics in pending.items():
+            metrics = self._deadband.filter(device_id, metrics, now)
+
+            rebirth = device_id not in self._born
+            codecs = self._codecs.setdefault(device_id, {})
+            # New codecs are only recorded once the birth declaring them is
+            # out, a failed birth is attempted again by the next flush.
+            changed: dict[str, MetricCodec] = {}
+            for name, (value, _) in metrics.items():
+                declared = current = codecs.get(name)
+                if current is None:
+                    # Not in the birth of the device yet, a history only
+                    # birth for instance.
+                    rebirth = True
+                    declared = self._stored_codec(device_id, name)
+                codec = codec_for(value, declared)
+                if declared is None:
+                    # The birth needs an alias for the new metric.
+                    self._registry.register(device_id, name, codec.datatype)
+                elif codec.datatype != declared.datatype:
+                    rebirth = True
+                if codec is not current:
+                    changed[name] = codec
+
+            if rebirth and not self._publish_birth(
+                device_id, metrics, {**codecs, **changed}, now
+            ):
+                self._requeue(device_id, metrics)
+                continue
+            for name, codec in changed.items():
+                self._registry.register(device_id, name, codec.datatype)
+            codecs.update(changed)
+            if rebirth:
+                continue
+
+            alias = self._registry.alias
+            matches = published.matches
+            repeated = repeat.get(device_id, ()) if repeat else ()
+            send = []
+            for name, item in metrics.items():
+                metric_alias = alias(device_id, name)
+                if name in repeated or not matches(metric_alias, item[0]):
+                    send.append((metric_alias, name, item))
+            if not send:
+                continue
+
+            payload = self._data_payload(device_id, send, codecs)
+            if not self._publish(self.topic("DDATA", device_id), payload):
+                self._requeue(device_id, metrics)
+                continue
+            for metric_alias, _, (value, timestamp) in send:
+                published.update(device_id, metric_alias, value, timestamp)
+            if self._deadband:
+                self._deadband.published(
+                    device_id, {name: item for _, name, item in send}, now
+                )
+            self.payloads_out += 1
+            self.metrics_out += len(send)
+
+    def _data_payload(
+        self,
+        device_id: str,
+        send: list[tuple[int, str, tuple[Any, int]]],
+        codecs: dict[str, MetricCodec],
+    ) -> sparkplugb_pb2.Payload | PayloadWriter:
+        """Return the DDATA payload of ``(alias, name, (value, timestamp))``."""
+        template = self._instances.get(device_id)
+        if template is None and self._writer is not None:
+            writer = self._writer.start(int(time.time() * 1000))
+            writer.add_metrics(send, codecs)
+            return writer
+
+        payload = self._new_payload()
+        add_metric = payload.metrics.add
+        if template is not None:
+            # Members of a template instance travel by name inside it.
+            instance = add_metric()
+            instance.alias = self._registry.alias(device_id, INSTANCE_METRIC)
+            instance.timestamp = payload.timestamp
+            add_metric = instance.template_value.metrics.add
+        for metric_alias, name, (value, timestamp) in send:
+            metric = add_metric()
+            if template is not None:
+                metric.name = name
+            else:
+                metric.alias = metric_alias
+            if value is None:
+                metric.is_null = True
+            else:
+                codecs[name].set_value(metric, value)
+            metric.timestamp = timestamp
+        return payload
+
+    def rebirth(self, states: Iterable[State] = ()) -> None:
+        """Publish the NBIRTHs and declare every device again on its next flush.
+
+        The DBIRTHs are not sent here; they follow from the state snapshot
+        the pipeline feeds in chunks after a rebirth, or from the next change
+        of a device. With several edge nodes, all of them are reborn together.
+        With templates, the shapes of the snapshot ``states`` decide the
+        definitions published in the NBIRTHs.
+        """
+        self._born.clear()
+
+        if self._templates is not None:
+            for state in states:
+                self._learn_shape(state)
+            self._templates.update()
+        self._registry.register(
+            None, NODE_CONTROL_REBIRTH, sparkplugb_pb2.Boolean
+        )
+        # The client adds the bdSeq and seq of its session to the NBIRTH, so
+        # every edge node gets a payload of its own.
+        for node_id in self.node_ids:
+            if self._publish(self.topic("NBIRTH", node_id=node_id), self._node_birth()):
+                self.births_out += 1
+
+    def replay_buffered(self) -> None:
+        """Replay what the client buffered offline for the devices born again.
+
+        The pipeline calls this once the snapshot after a rebirth is out, so
+        the host knows the aliases of the replayed messages.
+        """
+        self._client.start_replay(frozenset(self._born))
+
+    def _node_birth(self) -> sparkplugb_pb2.Payload:
+        """Return an NBIRTH payload without bdSeq and seq."""
+        payload = self._new_payload()
+        if self._templates is not None:
+            self._templates.add_definitions(payload)
+        metric = payload.metrics.add()
+        metric.name = NODE_CONTROL_REBIRTH
+        metric.alias = self._registry.alias(None, NODE_CONTROL_REBIRTH)
+        metric.datatype = sparkplugb_pb2.Boolean
+        encode(metric, BOOLEAN, False, payload.timestamp)
+        return payload
+
+    def is_rebirth_command(self, data: bytes) -> bool:
+        """Return True if an NCMD payload requests a rebirth."""
+        payload = sparkplugb_pb2.Payload()
+        try:
+            payload.ParseFromString(data)
+            payload = unwrap(payload)
+        except (DecodeError, OSError, zlib.error) as exception:
+            LOGGER.warning("Ignoring invalid NCMD payload: %s", exception)
+            return False
+
+        try:
+            alias = self._registry.alias(None, NODE_CONTROL_REBIRTH)
+        except KeyError:
+            alias = None
+
+        return any(
+            (
+                metric.name == NODE_CONTROL_REBIRTH
+                or (alias is not None and metric.alias == alias)
+            )
+            and metric.boolean_value
+            for metric in payload.metrics
+        )
+
+    def publish_history(self, entity_id: str, rows: list[tuple[int, Any]]) -> bool:
+        """Publish recorder history of an entity as a historical DataSet.
+
+        The ``history/state`` metric is sent by alias. The device is born
+        again first when its birth does not declare the metric yet.
+        """
+        device_id = entity_id.replace(".", "/")
+        declare = self._registry.register(
+            device_id, HISTORY_METRIC, sparkplugb_pb2.DataSet
+        )
+        if declare or device_id not in self._history or device_id not in self._born:
+            self._history.add(device_id)
+            codecs = self._codecs.setdefault(device_id, {})
+            if not self._publish_birth(device_id, {}, codecs, time.monotonic()):
+                # Born again with the next page.
+                self._history.discard(device_id)
+                return False
+
+        payload = self._new_payload()
+        metric = payload.metrics.add()
+        metric.alias = self._registry.alias(device_id, HISTORY_METRIC)
+        metric.timestamp = rows[-1][0]
+        metric.is_historical = True
+        add_dataset(metric, rows)
+        if not self._publish(self.topic("DDATA", device_id), payload):
+            return False
+        self.payloads_out += 1
+        self.metrics_out += 1
+        return True
+
+    def _publish_birth(
+        self,
+        device_id: str,
+        metrics: dict[str, tuple[Any, int]],
+        codecs: dict[str, MetricCodec],
+        now: float,
+    ) -> bool:
+        """Publish a DBIRTH declaring name, alias and datatype of every metric.
+
+        The birth carries the published values updated with ``metrics``. A
+        device matching a template is declared as one instance metric.
+        """
+        name_of = self._registry.name
+        values = {
+            name_of(device_id, alias): (value, timestamp)
+            for alias, value, timestamp in self._published.device(device_id)
+        }
+        values.update(metrics)
+
+        template = (
+            self._templates.template_for(device_id, codecs)
+            if self._templates is not None
+            else None
+        )
+        payload = self._birth_payload(device_id, template, values, codecs)
+        if not self._publish(self.topic("DBIRTH", device_id), payload):
+            return False
+        alias = self._registry.alias
+        for name, (value, timestamp) in metrics.items():
+            self._published.update(device_id, alias(device_id, name), value, timestamp)
+        self._deadband.published(device_id, values, now)
+        if template is None:
+            self._instances.pop(device_id, None)
+        else:
+            self._instances[device_id] = template
+        self._born.add(device_id)
+        self.births_out += 1
+        self.metrics_out += len(values)
+        return True
+
+    def _birth_payload(
+        self,
+        device_id: str,
+        template: str | None,
+        values: dict[str, tuple[Any, int]],
+        codecs: dict[str, MetricCodec],
+    ) -> sparkplugb_pb2.Payload | PayloadWriter:
+        """Return the DBIRTH payload of a device, or of a template instance."""
+        if (
+            template is None
+            and self._writer is not None
+            and device_id not in self._history
+        ):
+            writer = self._writer.start(int(time.time() * 1000))
+            alias = self._registry.alias
+            writer.add_metrics(
+                [(alias(device_id, name), name, item) for name, item in values.items()],
+                codecs,
+                declare=True,
+            )
+            return writer
+
+        payload = self._new_payload()
+        add_metric = payload.metrics.add
+        shared_timestamp = None
+        if template is not None:
+            # Members carry their timestamp only when it differs from the
+            # instance, which has the latest one.
+            shared_timestamp = max(timestamp for _, timestamp in values.values())
+            self._registry.register(device_id, INSTANCE_METRIC, sparkplugb_pb2.Template)
+            instance = add_metric()
+            instance.name = INSTANCE_METRIC
+            instance.alias = self._registry.alias(device_id, INSTANCE_METRIC)
+            instance.datatype = sparkplugb_pb2.Template
+            instance.timestamp = shared_timestamp
+            instance.template_value.template_ref = template
+            add_metric = instance.template_value.metrics.add
+
+        for name, (value, timestamp) in values.items():
+            metric = add_metric()
+            metric.name = name
+            if template is None:
+                metric.alias = self._registry.alias(device_id, name)
+            metric.datatype = codecs[name].datatype
+            encode(metric, codecs[name], value, timestamp)
+            if timestamp == shared_timestamp:
+                metric.ClearField("timestamp")
+
+        if device_id in self._history:
+            # Only declared, its rows are historical and follow in DDATA.
+            metric = payload.metrics.add()
+            metric.name = HISTORY_METRIC
+            metric.alias = self._registry.alias(device_id, HISTORY_METRIC)
+            metric.datatype = sparkplugb_pb2.DataSet
+            metric.timestamp = payload.timestamp
+            metric.is_null = True
+        return payload
+
+    def _learn_shape(self, state: State) -> None:
+        """Record the metrics and datatypes the state gives its device."""
+        encoder = self._encoders.get(state.entity_id)
+        if encoder is None:
+            encoder = self._encoders[state.entity_id] = EntityEncoder(
+                state.entity_id, self._flatten
+            )
+        device_id = encoder.device_id
+
+        declared = self._codecs.get(device_id, {})
+        codecs = dict(declared)
+        for name, (value, _) in encoder.diff(None, state, 0).items():
+            codec = declared.get(name)
+            if codec is None:
+                codec = self._stored_codec(device_id, name)
+            codecs[name] = codec_for(value, codec)
+        self._templates.learn(
+            device_id, state.attributes.get(ATTR_DEVICE_CLASS), codecs
+        )
+
+    def _stored_codec(self, device_id: str, name: str) -> MetricCodec | None:
+        """Return the codec a metric was declared with in a previous run."""
+        try:
+            return DATATYPE_CODECS.get(self._registry.datatype(device_id, name))
+        except KeyError:
+            return None
+
+    def _new_payload(self) -> sparkplugb_pb2.Payload:
+        payload = sparkplugb_pb2.Payload()
+        payload.timestamp = int(time.time() * 1000)
+        return payload
+
+    def _publish(
+        self, topic: str, payload: sparkplugb_pb2.Payload | PayloadWriter
+    ) -> bool:
+        try:
+            self._client.publish(topic, payload)
+        except Exception as exception:  # pylint: disable=broad-except
+            LOGGER.warning(exception)
+            return False
+        return True
+
+    def _adapt_interval(self) -> None:
+        """Stretch the window under load and shrink it again when traffic is low."""
+        events = self._window_events
+        self._window_events = 0
+
+        if events >= ADAPTIVE_GROW_EVENTS:
+            self._interval = min(self._interval * ADAPTIVE_FACTOR, self._max_interval)
+        elif events <= ADAPTIVE_SHRINK_EVENTS:
+            self._interval = max(self._interval / ADAPTIVE_FACTOR, self._min_interval)
+
+    @property
+    def node_ids(self) -> list[str]:
+        """Return the edge node IDs devices are published under."""
+        if self._shard_map is None:
+            return [self._base_topic]
+        return self._shard_map.node_ids
+
+    def topic(
+        self,
+        message_type: str,
+        device_id: str | None = None,
+        node_id: str | None = None,
+    ) -> str:
+        """Return the Sparkplug topic for a node or device message.
+
+        Without a node ID, a device topic uses the node the device is
+        assigned to and a node topic the first node.
+        """
+        if node_id is None:
+            if device_id is not None and self._shard_map is not None:
+                node_id = self._shard_map.node_for(device_id)
+            else:
+                node_id = self._base_topic
+        topic = f"spBv1.0/{GROUP_ID}/{message_type}/{node_id}"
+        if device_id is not None:
+            topic = f"{topic}/{device_id}"
+        return topic
@@ -0,0 +1,99 @@
+"""Sparkplug metric alias registry for Helixer."""
+from __future__ import annotations
+
+import threading
+from typing import Any
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+
+from .const import DOMAIN
+
+STORAGE_KEY = f"{DOMAIN}.metric_aliases"
+STORAGE_VERSION = 1
+SAVE_DELAY = 10
+
+
+class HelixerMetricRegistry:
+    """Assign stable Sparkplug aliases to the metrics of every device.
+
+    Aliases are unique for the whole edge node, so the node itself is
+    registered under the ``None`` device. Metrics are registered from the
+    pipeline worker thread while saving happens on the event loop.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self._hass = hass
+        self._lock = threading.Lock()
+        self._store: Store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._next_alias = 1
+        self._devices: dict[str | None, dict[str, list[int]]] = {}
+        # alias -> (device_id, name), aliases are unique for the edge node.
+        self._aliases: dict[int, tuple[str | None, str]] = {}
+
+    async def async_load(self) -> None:
+        """Load the aliases assigned in a previous run."""
+        data = await self._store.async_load()
+        if data is None:
+            return
+
+        self._next_alias = data["next_alias"]
+        self._devices = {
+            (None if device_id == "" else device_id): metrics
+            for device_id, metrics in data["devices"].items()
+        }
+        self._aliases = {
+            entry[0]: (device_id, name)
+            for device_id, metrics in self._devices.items()
+            for name, entry in metrics.items()
+        }
+
+    @callback
+    def _data_to_save(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "next_alias": self._next_alias,
+                "devices": {
+                    ("" if device_id is None else device_id): {
+                        name: list(entry) for name, entry in metrics.items()
+                    }
+                    for device_id, metrics in self._devices.items()
+                },
+            }
+
+    @callback
+    def _async_schedule_save(self) -> None:
+        self._store.async_delay_save(self._data_to_save, SAVE_DELAY)
+
+    def alias(self, device_id: str | None, name: str) -> int:
+        """Return the alias of an already registered metric."""
+        return self._devices[device_id][name][0]
+
+    def name(self, device_id: str | None, alias: int) -> str | None:
+        """Return the name of a metric of a device by its alias."""
+        entry = self._aliases.get(alias)
+        if entry is None or entry[0] != device_id:
+            return None
+        return entry[1]
+
+    def datatype(self, device_id: str | None, name: str) -> int:
+        """Return the datatype a metric was last declared with."""
+        return self._devices[device_id][name][1]
+
+    def register(self, device_id: str | None, name: str, datatype: int) -> bool:
+        """Register a metric, return True if it must be (re)declared in a birth."""
+        with self._lock:
+            metrics = self._devices.setdefault(device_id, {})
+            entry = metrics.get(name)
+
+            if entry is None:
+                metrics[name] = [self._next_alias, datatype]
+                self._aliases[self._next_alias] = (device_id, name)
+                self._next_alias += 1
+            elif entry[1] != datatype:
+                entry[1] = datatype
+            else:
+                return False
+
+        self._hass.loop.call_soon_threadsafe(self._async_schedule_save)
+        return True
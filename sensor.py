@@ -0,0 +1,155 @@
+"""Sensor platform for Helixer."""
+from __future__ import annotations
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorEntityDescription,
+    SensorStateClass,
+)
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import EntityCategory, UnitOfInformation, UnitOfTime
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .const import DOMAIN
+from .coordinator import HelixerDataUpdateCoordinator
+from .entity import HelixerEntity
+
+
+def _milliseconds(value: float | None) -> float | None:
+    return None if value is None else round(value * 1000, 3)
+
+
+@dataclass(frozen=True)
+class HelixerSensorEntityDescription(SensorEntityDescription):
+    """Describes a Helixer statistics sensor."""
+
+    value_fn: Callable[[dict[str, Any]], Any] = lambda data: None
+
+
+SENSORS: tuple[HelixerSensorEntityDescription, ...] = (
+    HelixerSensorEntityDescription(
+        key="events_received",
+        translation_key="events_received",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda data: data["events_received"],
+    ),
+    HelixerSensorEntityDescription(
+        key="events_filtered",
+        translation_key="events_filtered",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda data: data["events_filtered"],
+    ),
+    HelixerSensorEntityDescription(
+        key="events_dropped",
+        translation_key="events_dropped",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda data: data["pipeline"]["dropped"],
+    ),
+    HelixerSensorEntityDescription(
+        key="payloads_published",
+        translation_key="payloads_published",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda data: data["payloads_published"],
+    ),
+    HelixerSensorEntityDescription(
+        key="bytes_published",
+        translation_key="bytes_published",
+        device_class=SensorDeviceClass.DATA_SIZE,
+        native_unit_of_measurement=UnitOfInformation.BYTES,
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda data: data["bytes_published"],
+    ),
+    HelixerSensorEntityDescription(
+        key="publish_errors",
+        translation_key="publish_errors",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda data: data["publish_errors"],
+    ),
+    HelixerSensorEntityDescription(
+        key="reconnects",
+        translation_key="reconnects",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda data: data["reconnects"],
+    ),
+    HelixerSensorEntityDescription(
+        key="metrics_per_payload",
+        translation_key="metrics_per_payload",
+        state_class=SensorStateClass.MEASUREMENT,
+        suggested_display_precision=1,
+        value_fn=lambda data: data["metrics_per_payload"]["mean"],
+    ),
+    HelixerSensorEntityDescription(
+        key="publish_latency",
+        translation_key="publish_latency",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda data: _milliseconds(data["publish_latency"]["p99"]),
+    ),
+    HelixerSensorEntityDescription(
+        key="state_publisher_time",
+        translation_key="state_publisher_time",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda data: _milliseconds(data["state_publisher_time"]["p99"]),
+    ),
+    HelixerSensorEntityDescription(
+        key="queue_depth",
+        translation_key="queue_depth",
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda data: data["pipeline"]["queue_depth"],
+    ),
+    HelixerSensorEntityDescription(
+        key="outbound_queue_depth",
+        translation_key="outbound_queue_depth",
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda data: data["outbound_queue_depth"],
+    ),
+    HelixerSensorEntityDescription(
+        key="offline_buffer_size",
+        translation_key="offline_buffer_size",
+        device_class=SensorDeviceClass.DATA_SIZE,
+        native_unit_of_measurement=UnitOfInformation.BYTES,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda data: data["offline_buffer"]["memory_bytes"]
+        + data["offline_buffer"]["disk_bytes"],
+    ),
+)
+
+
+async def async_setup_entry(
+    hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback
+) -> None:
+    """Set up the sensor platform."""
+    coordinator = hass.data[DOMAIN][entry.entry_id]["coordinator"]
+    async_add_entities(
+        HelixerSensor(coordinator, description) for description in SENSORS
+    )
+
+
+class HelixerSensor(HelixerEntity, SensorEntity):
+    """Helixer statistics sensor."""
+
+    entity_description: HelixerSensorEntityDescription
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(
+        self,
+        coordinator: HelixerDataUpdateCoordinator,
+        entity_description: HelixerSensorEntityDescription,
+    ) -> None:
+        """Initialize the sensor class."""
+        super().__init__(coordinator, entity_description.key)
+        self.entity_description = entity_description
+
+    @property
+    def native_value(self) -> Any:
+        """Return the native value of the sensor."""
+        return self.entity_description.value_fn(self.coordinator.data)
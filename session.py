@@ -0,0 +1,103 @@
+"""Sparkplug session state for Helixer."""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+
+from . import sparkplugb_pb2
+from .const import DOMAIN, GROUP_ID
+from .encoder import INT64, encode
+
+STORAGE_KEY = f"{DOMAIN}.sessions"
+STORAGE_VERSION = 1
+SAVE_DELAY = 1
+
+BD_SEQ = "bdSeq"
+
+
+class HelixerSession:
+    """Sequence numbers of one edge node connection.
+
+    ``seq`` runs from 0 to 255 over every message of the node and restarts
+    at 0 with the NBIRTH. ``bd_seq`` identifies the MQTT session: it is
+    carried by the NDEATH will and the NBIRTH, and changes with every new
+    connection. The caller serializes access to ``next_seq``.
+    """
+
+    def __init__(self, node_id: str, bd_seq: int, store: HelixerSessionStore) -> None:
+        self.node_id = node_id
+        self.death_topic = f"spBv1.0/{GROUP_ID}/NDEATH/{node_id}"
+        self.bd_seq = bd_seq
+        self.birth_pending = True
+        self._seq = 0
+        self._store = store
+
+    def next_seq(self, birth: bool) -> int:
+        """Return the seq of the next message, birth is True for an NBIRTH."""
+        if birth:
+            self.birth_pending = False
+            self._seq = 0
+        else:
+            self._seq = (self._seq + 1) % 256
+        return self._seq
+
+    def new_session(self) -> None:
+        """Move to the bdSeq of the next MQTT session."""
+        self.bd_seq = (self.bd_seq + 1) % 256
+        self.birth_pending = True
+        self._store.schedule_save()
+
+    def add_bd_seq(self, payload: sparkplugb_pb2.Payload) -> None:
+        """Add the bdSeq metric to an NBIRTH or NDEATH payload."""
+        metric = payload.metrics.add()
+        metric.name = BD_SEQ
+        metric.datatype = INT64.datatype
+        encode(metric, INT64, self.bd_seq, payload.timestamp)
+
+    def death_payload(self, timestamp: int) -> bytes:
+        """Return the serialized NDEATH of the current session."""
+        payload = sparkplugb_pb2.Payload()
+        payload.timestamp = timestamp
+        self.add_bd_seq(payload)
+        return payload.SerializeToString()
+
+
+class HelixerSessionStore:
+    """Persist the bdSeq of every edge node across restarts.
+
+    Sessions change bdSeq from the MQTT network threads while saving happens
+    on the event loop.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self._hass = hass
+        self._store: Store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._bd_seqs: dict[str, int] = {}
+        self._sessions: dict[str, HelixerSession] = {}
+
+    async def async_load(self) -> None:
+        """Load the bdSeq of the previous run."""
+        self._bd_seqs = await self._store.async_load() or {}
+
+    def session(self, node_id: str) -> HelixerSession:
+        """Return a new session of a node, following the one of the last run."""
+        bd_seq = self._bd_seqs.get(node_id)
+        session = self._sessions[node_id] = HelixerSession(
+            node_id, 0 if bd_seq is None else (bd_seq + 1) % 256, self
+        )
+        self.schedule_save()
+        return session
+
+    def schedule_save(self) -> None:
+        """Save soon, callable from any thread."""
+        self._hass.loop.call_soon_threadsafe(self._async_schedule_save)
+
+    @callback
+    def _async_schedule_save(self) -> None:
+        self._store.async_delay_save(self._data_to_save, SAVE_DELAY)
+
+    @callback
+    def _data_to_save(self) -> dict[str, Any]:
+        return {node_id: session.bd_seq for node_id, session in self._sessions.items()}
@@ -0,0 +1,147 @@
+"""Sharding of Sparkplug devices over several MQTT connections for Helixer."""
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable, Collection
+import hashlib
+from typing import Any
+
+from .client import CONNECT_TIMEOUT, HelixerClient
+from .stats import HelixerStats
+
+
+def shard_node_ids(base_node_id: str, connections: int) -> list[str]:
+    """Return the edge node ID of every connection, the first keeps the base ID."""
+    return [base_node_id] + [
+        f"{base_node_id}-{index}" for index in range(1, connections)
+    ]
+
+
+class HelixerShardMap:
+    """Assign every device to one edge node by rendezvous hashing.
+
+    Adding or removing a node only moves the devices of that node. The
+    assignment is cached, so hashing happens once per device.
+    """
+
+    def __init__(self, node_ids: list[str]) -> None:
+        self.node_ids = node_ids
+        self._seeds = [node_id.encode() for node_id in node_ids]
+        self._nodes: dict[str, str] = {}
+
+    def node_for(self, device_id: str) -> str:
+        """Return the edge node ID a device is published under."""
+        node_id = self._nodes.get(device_id)
+        if node_id is None:
+            key = device_id.encode()
+            weights = [
+                hashlib.blake2b(key, digest_size=8, key=seed).digest()
+                for seed in self._seeds
+            ]
+            node_id = self._nodes[device_id] = self.node_ids[
+                weights.index(max(weights))
+            ]
+        return node_id
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Return the number of devices assigned to every node."""
+        counts = dict.fromkeys(self.node_ids, 0)
+        for node_id in list(self._nodes.values()):
+            counts[node_id] += 1
+        return counts
+
+
+class HelixerShardedClient:
+    """Route messages to one HelixerClient per edge node.
+
+    Every client has its own network thread and TLS connection. Messages are
+    routed by the edge node ID in their topic; topics outside the group, such
+    as the primary host STATE, use the first client. Every client counts in
+    its own HelixerStats, ``stats`` adds them up.
+    """
+
+    def __init__(self, clients: dict[str, HelixerClient]) -> None:
+        self._clients = clients
+        self._first = next(iter(clients.values()))
+
+    @property
+    def stats(self) -> HelixerStats:
+        """Return the statistics of all clients added up."""
+        return HelixerStats.combined(
+            client.stats for client in list(self._clients.values())
+        )
+
+    def _client_for(self, topic: str) -> HelixerClient:
+        # spBv1.0/<group>/<message type>/<edge node>/...
+        parts = topic.split("/", 4)
+        if len(parts) < 4:
+            return self._first
+        return self._clients.get(parts[3], self._first)
+
+    def add_connect_callback(self, connect_callback: Callable[[], None]) -> None:
+        """Register a callback run after every connect of any client."""
+        for client in self._clients.values():
+            client.add_connect_callback(connect_callback)
+
+    def subscribe(
+        self, topic: str, message_callback: Callable[[str, bytes], None]
+    ) -> None:
+        """Subscribe on the client of the edge node in the topic."""
+        self._client_for(topic).subscribe(topic, message_callback)
+
+    def publish(self, topic: str, payload) -> None:
+        """Publish on the client of the edge node in the topic."""
+        self._client_for(topic).publish(topic, payload)
+
+    def start_replay(self, devices: Collection[str]) -> None:
+        """Replay the offline buffer of every client."""
+        for client in self._clients.values():
+            client.start_replay(devices)
+
+    @property
+    def outbound_queue_depth(self) -> int:
+        """Return the messages not sent yet, over all clients."""
+        return sum(client.outbound_queue_depth for client in self._clients.values())
+
+    @property
+    def connections(self) -> dict[str, Any]:
+        """Return whether the client of every edge node is connected."""
+        return {
+            node_id: client.is_connected for node_id, client in self._clients.items()
+        }
+
+    def connect_mqtt(self, timeout: float = CONNECT_TIMEOUT) -> None:
+        """Connect every client, disconnecting the others if one fails."""
+        connected = []
+        try:
+            for client in self._clients.values():
+                client.connect_mqtt(timeout)
+                connected.append(client)
+        except Exception:
+            for client in connected:
+                client.disconnect_mqtt()
+            raise
+
+    async def async_connect_mqtt(self, timeout: float = CONNECT_TIMEOUT) -> None:
+        """Connect every client at once, disconnecting all if one fails."""
+        clients = list(self._clients.values())
+        results = await asyncio.gather(
+            *(client.async_connect_mqtt(timeout) for client in clients),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            await self.async_disconnect_mqtt()
+            raise errors[0]
+
+    def disconnect_mqtt(self) -> None:
+        """Disconnect every client."""
+        for client in self._clients.values():
+            client.disconnect_mqtt()
+
+    async def async_disconnect_mqtt(self) -> None:
+        """Disconnect every client without blocking the event loop."""
+        await asyncio.gather(
+            *(client.async_disconnect_mqtt() for client in self._clients.values())
+        )
@@ -0,0 +1,160 @@
+"""Runtime statistics for Helixer."""
+from __future__ import annotations
+
+from bisect import bisect_left
+from collections.abc import Iterable
+from typing import Any
+
+# Only one in this many calls is timed.
+SAMPLE_EVERY = 16
+
+LATENCY_BUCKETS = (
+    0.00001,
+    0.00005,
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1,
+)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+    """Fixed bucket histogram, cheap enough to update on the hot path."""
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def add(self, other: Histogram) -> None:
+        """Add the observations of a histogram with the same buckets."""
+        self.counts = [count + added for count, added in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+
+    @property
+    def mean(self) -> float | None:
+        return self.total / self.count if self.count else None
+
+    def percentile(self, fraction: float) -> float | None:
+        """Return the upper bound of the bucket holding the given percentile."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self._bounds[min(index, len(self._bounds) - 1)]
+        return self._bounds[-1]
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "buckets": dict(zip((*self._bounds, "inf"), self.counts)),
+        }
+
+
+class HelixerStats:
+    """Counters and histograms of the publishing path.
+
+    Every counter has a single writer thread, so plain integer updates are
+    used instead of locks: the event loop counts events, the pipeline worker
+    publishes and the network thread connects. Each client therefore has an
+    instance of its own, ``combined`` adds them up for reporting.
+    ``publish_waits`` is also written by the replay thread, under the flow
+    control lock of the client. Timings are sampled, see ``SAMPLE_EVERY``.
+    """
+
+    def __init__(self) -> None:
+        self.events_received = 0
+        self.events_filtered = 0
+        self.payloads_published = 0
+        self.bytes_published = 0
+        self.publish_errors = 0
+        self.publish_waits = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.disconnects = 0
+
+        self.state_publisher_time = Histogram(LATENCY_BUCKETS)
+        self.publish_latency = Histogram(LATENCY_BUCKETS)
+        self.metrics_per_payload = Histogram(SIZE_BUCKETS)
+        self.payload_bytes = Histogram(
+            (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+        )
+
+        self._event_ticks = 0
+        self._publish_ticks = 0
+
+    @classmethod
+    def combined(cls, parts: Iterable[HelixerStats]) -> HelixerStats:
+        """Return the counters and histograms of several instances added up."""
+        total = cls()
+        for part in parts:
+            for name in _COUNTERS:
+                setattr(total, name, getattr(total, name) + getattr(part, name))
+            for name in _HISTOGRAMS:
+                getattr(total, name).add(getattr(part, name))
+        return total
+
+    def sample_event(self) -> bool:
+        """Return True if this event should be timed."""
+        self._event_ticks += 1
+        return self._event_ticks % SAMPLE_EVERY == 0
+
+    def sample_publish(self) -> bool:
+        """Return True if this publish should be timed."""
+        self._publish_ticks += 1
+        return self._publish_ticks % SAMPLE_EVERY == 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "events_received": self.events_received,
+            "events_filtered": self.events_filtered,
+            "payloads_published": self.payloads_published,
+            "bytes_published": self.bytes_published,
+            "publish_errors": self.publish_errors,
+            "publish_waits": self.publish_waits,
+            "connects": self.connects,
+            "disconnects": self.disconnects,
+            "reconnects": self.reconnects,
+            "state_publisher_time": self.state_publisher_time.as_dict(),
+            "publish_latency": self.publish_latency.as_dict(),
+            "metrics_per_payload": self.metrics_per_payload.as_dict(),
+            "payload_bytes": self.payload_bytes.as_dict(),
+        }
+
+
+_COUNTERS = (
+    "events_received",
+    "events_filtered",
+    "payloads_published",
+    "bytes_published",
+    "publish_errors",
+    "publish_waits",
+    "connects",
+    "reconnects",
+    "disconnects",
+)
+_HISTOGRAMS = (
+    "state_publisher_time",
+    "publish_latency",
+    "metrics_per_payload",
+    "payload_bytes",
+)
@@ -0,0 +1,111 @@
+"""Sparkplug template definitions for Helixer."""
+from __future__ import annotations
+
+from collections import Counter
+import hashlib
+from typing import Any
+
+from . import sparkplugb_pb2
+from .encoder import MetricCodec
+
+# Devices that have to share a shape before it becomes a template.
+TEMPLATE_MIN_INSTANCES = 2
+# Name of the template instance metric in the DBIRTH of a device.
+INSTANCE_METRIC = "entity"
+
+# (domain, device class, ((metric name, datatype), ...))
+Shape = tuple[str, Any, tuple[tuple[str, int], ...]]
+
+
+def _shape(device_id: str, device_class: Any, codecs: dict[str, MetricCodec]) -> Shape:
+    return (
+        device_id.partition("/")[0],
+        device_class,
+        tuple(sorted((name, codec.datatype) for name, codec in codecs.items())),
+    )
+
+
+def _template_name(shape: Shape) -> str:
+    domain, device_class, members = shape
+    digest = hashlib.blake2b(repr(members).encode(), digest_size=4).hexdigest()
+    if device_class is None:
+        return f"{domain}.{digest}"
+    return f"{domain}.{device_class}.{digest}"
+
+
+class HelixerTemplates:
+    """Share one Sparkplug Template definition between devices of one shape.
+
+    A shape is the domain, the device class and the name and datatype of
+    every metric of a device. Shapes shared by ``min_instances`` devices at a
+    rebirth become definitions in the NBIRTH, and their devices are born as
+    a single template instance metric. A device whose shape changed since
+    the rebirth is born with plain metrics until the next one.
+    """
+
+    def __init__(self, min_instances: int = TEMPLATE_MIN_INSTANCES) -> None:
+        self._min_instances = min_instances
+        self._shapes: dict[str, Shape] = {}
+        # Shape -> template name
+        self._definitions: dict[Shape, str] = {}
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Return the number of definitions and of devices sharing them."""
+        definitions = self._definitions
+        return {
+            "definitions": len(definitions),
+            # The worker thread adds shapes meanwhile, iterate over a copy.
+            "devices": sum(
+                shape in definitions for shape in list(self._shapes.values())
+            ),
+        }
+
+    def learn(
+        self, device_id: str, device_class: Any, codecs: dict[str, MetricCodec]
+    ) -> None:
+        """Record the shape of a device, used by the next ``update``."""
+        self._shapes[device_id] = _shape(device_id, device_class, codecs)
+
+    def update(self) -> None:
+        """Turn the shapes shared by enough devices into definitions."""
+        counts = Counter(self._shapes.values())
+        self._definitions = {
+            shape: _template_name(shape)
+            for shape, count in counts.items()
+            if count >= self._min_instances
+        }
+
+    def template_for(
+        self, device_id: str, codecs: dict[str, MetricCodec]
+    ) -> str | None:
+        """Return the template a device is an instance of, None if there is none.
+
+        The metrics of the device have to match the definition exactly.
+        """
+        shape = self._shapes.get(device_id)
+        if shape is None:
+            return None
+        name = self._definitions.get(shape)
+        members = shape[2]
+        if name is None or len(members) != len(codecs):
+            return None
+        for member, datatype in members:
+            codec = codecs.get(member)
+            if codec is None or codec.datatype != datatype:
+                return None
+        return name
+
+    def add_definitions(self, payload: sparkplugb_pb2.Payload) -> None:
+        """Add every definition to an NBIRTH payload."""
+        for (_, _, members), name in self._definitions.items():
+            metric = payload.metrics.add()
+            metric.name = name
+            metric.datatype = sparkplugb_pb2.Template
+            template = metric.template_value
+            template.is_definition = True
+            for member, datatype in members:
+                definition = template.metrics.add()
+                definition.name = member
+                definition.datatype = datatype
+                definition.is_null = True
@@ -0,0 +1,38 @@
+"""Load the repository root as the ``helixer`` package for the tests."""
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Iterator
+import importlib.util
+from pathlib import Path
+import sys
+
+from homeassistant.core import HomeAssistant
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+if "helixer" not in sys.modules:
+    _spec = importlib.util.spec_from_file_location(
+        "helixer", ROOT / "__init__.py", submodule_search_locations=[str(ROOT)]
+    )
+    _module = importlib.util.module_from_spec(_spec)
+    sys.modules["helixer"] = _module
+    _spec.loader.exec_module(_module)
+
+
+@pytest.fixture
+def hass(tmp_path: Path) -> Iterator[HomeAssistant]:
+    """Return a Home Assistant instance whose loop is not running.
+
+    Enough for the parts that only schedule work on the loop, such as the
+    metric registry saving its aliases.
+    """
+    loop = asyncio.new_event_loop()
+
+    async def _create() -> HomeAssistant:
+        return HomeAssistant(str(tmp_path))
+
+    instance = loop.run_until_complete(_create())
+    yield instance
+    loop.close()
@@ -0,0 +1,130 @@
+"""Tests of the store-and-forward buffer."""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import time
+
+import pytest
+
+from helixer import buffer as buffer_module, sparkplugb_pb2
+from helixer.buffer import HelixerOfflineBuffer
+
+TOPIC = "spBv1.0/homeassistant/DDATA/helixer/sensor/s0"
+
+
+def _data(value: int) -> bytes:
+    payload = sparkplugb_pb2.Payload()
+    metric = payload.metrics.add()
+    metric.alias = 1
+    metric.long_value = value
+    return payload.SerializeToString()
+
+
+def _buffer(path: Path, max_memory: int = 64, max_disk: int = 1 << 20):
+    return HelixerOfflineBuffer(str(path), max_memory, max_disk, replay_rate=10000)
+
+
+class Collector:
+    """Publish callback keeping the replayed values, failing after ``limit``."""
+
+    def __init__(self, limit: int | None = None) -> None:
+        self.values: list[int] = []
+        self.limit = limit
+
+    def __call__(self, topic: str, payload: sparkplugb_pb2.Payload) -> bool:
+        if len(self.values) == self.limit:
+            return False
+        assert topic == TOPIC
+        assert payload.metrics[0].is_historical
+        self.values.append(payload.metrics[0].long_value)
+        return True
+
+
+def _replay(buffer: HelixerOfflineBuffer, publish: Collector) -> None:
+    buffer.start_replay(publish)
+    deadline = time.monotonic() + 5
+    while buffer._replay_thread.is_alive():  # pylint: disable=protected-access
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_spilled_messages_are_replayed_in_order(tmp_path: Path) -> None:
+    """Messages on disk and in memory are replayed oldest first, as history."""
+    buffer = _buffer(tmp_path)
+    for value in range(20):
+        buffer.append(TOPIC, _data(value))
+    assert buffer.stats["disk_bytes"] > 0
+
+    publish = Collector()
+    _replay(buffer, publish)
+
+    assert publish.values == list(range(20))
+    assert buffer.replayed == 20
+    assert not len(buffer)
+    assert buffer.stats["disk_bytes"] == 0
+
+
+def test_failed_replay_keeps_the_rest(tmp_path: Path) -> None:
+    """A message that could not be sent is replayed again with what follows."""
+    buffer = _buffer(tmp_path)
+    for value in range(20):
+        buffer.append(TOPIC, _data(value))
+    buffer.close()
+
+    # Reopened like after a restart, close persisted everything.
+    buffer = _buffer(tmp_path)
+    publish = Collector(limit=5)
+    _replay(buffer, publish)
+    assert publish.values == list(range(5))
+
+    publish.limit = None
+    _replay(buffer, publish)
+    assert publish.values == list(range(20))
+    assert not len(buffer)
+
+
+def test_disk_cap_drops_oldest_segments(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """The segments never take more than ``max_disk`` bytes."""
+    monkeypatch.setattr(buffer_module, "SEGMENT_SIZE", 100)
+    buffer = _buffer(tmp_path, max_memory=0, max_disk=250)
+    for value in range(50):
+        buffer.append(TOPIC, _data(value))
+
+    disk = buffer.stats["disk_bytes"]
+    assert 0 < disk <= 250
+    assert disk == sum(path.stat().st_size for path in tmp_path.iterdir())
+    assert buffer.dropped > 0
+
+    publish = Collector()
+    _replay(buffer, publish)
+    # What is left is the newest messages.
+    assert publish.values == list(range(50 - len(publish.values), 50))
+
+
+def test_zero_disk_cap_keeps_nothing(tmp_path: Path) -> None:
+    """With a ``max_disk`` of 0 spilled messages are dropped."""
+    buffer = _buffer(tmp_path, max_memory=0, max_disk=0)
+    for value in range(10):
+        buffer.append(TOPIC, _data(value))
+    buffer.close()
+
+    assert buffer.dropped == 10
+    assert buffer.stats["disk_bytes"] == 0
+    assert not os.listdir(tmp_path)
+
+
+def test_stale_rewrite_is_removed(tmp_path: Path) -> None:
+    """A rewrite interrupted by a crash is deleted, its segment is kept."""
+    buffer = _buffer(tmp_path, max_memory=0)
+    buffer.append(TOPIC, _data(1))
+    buffer.close()
+    (segment,) = os.listdir(tmp_path)
+    (tmp_path / f"{segment}.tmp").write_bytes(b"partial")
+
+    buffer = _buffer(tmp_path)
+
+    assert os.listdir(tmp_path) == [segment]
+    assert len(buffer) == 1
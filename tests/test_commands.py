@@ -0,0 +1,147 @@
+"""Tests of the DCMD to service call translation."""
+from __future__ import annotations
+
+import asyncio
+from typing import Any
+
+from homeassistant.core import HomeAssistant, ServiceCall
+import pytest
+
+from helixer import commands as commands_module, sparkplugb_pb2
+from helixer.commands import HelixerCommandHandler
+from helixer.registry import HelixerMetricRegistry
+
+
+def _topic(message_type: str, device_id: str) -> str:
+    return f"spBv1.0/homeassistant/{message_type}/helixer/{device_id}"
+
+
+def _command(**metrics: Any) -> bytes:
+    """Return a DCMD payload writing ``metrics``, ``attributes__x`` for ``/``."""
+    payload = sparkplugb_pb2.Payload()
+    for name, value in metrics.items():
+        metric = payload.metrics.add()
+        metric.name = name.replace("__", "/")
+        if type(value) is bool:
+            metric.datatype = sparkplugb_pb2.Boolean
+            metric.boolean_value = value
+        else:
+            metric.datatype = sparkplugb_pb2.Double
+            metric.double_value = value
+    return payload.SerializeToString()
+
+
+@pytest.fixture
+def calls(hass: HomeAssistant) -> list[ServiceCall]:
+    """Register the services commands are translated to and record calls."""
+    recorded: list[ServiceCall] = []
+
+    async def _record(call: ServiceCall) -> None:
+        recorded.append(call)
+
+    for domain, service in (
+        ("light", "turn_on"),
+        ("light", "turn_off"),
+        ("input_number", "set_value"),
+        ("climate", "set_temperature"),
+    ):
+        hass.services.async_register(domain, service, _record)
+    return recorded
+
+
+def _send(
+    hass: HomeAssistant, handler: HelixerCommandHandler, device_id: str, *payloads
+) -> None:
+    async def _run() -> None:
+        for payload in payloads:
+            handler.handle_message(_topic("DCMD", device_id), payload)
+        await asyncio.sleep(0.05)
+        await hass.async_block_till_done()
+
+    hass.loop.run_until_complete(_run())
+
+
+@pytest.fixture
+def handler(
+    hass: HomeAssistant, monkeypatch: pytest.MonkeyPatch
+) -> HelixerCommandHandler:
+    """Return a handler for every entity, dispatching without delay."""
+    monkeypatch.setattr(commands_module, "COALESCE_DELAY", 0)
+    hass.states.async_set("light.kitchen", "off")
+    hass.states.async_set("input_number.level", "5")
+    hass.states.async_set("climate.room", "heat", {"temperature": 20})
+    hass.states.async_set("sensor.power", "100")
+    return HelixerCommandHandler(
+        hass, HelixerMetricRegistry(hass), lambda entity_id: True, _topic
+    )
+
+
+def test_switch_metric_turns_on_and_off(
+    hass: HomeAssistant, handler: HelixerCommandHandler, calls: list[ServiceCall]
+) -> None:
+    """A truthy write turns the entity on, a write matching its state is dropped."""
+    _send(hass, handler, "light/kitchen", _command(state=True))
+    _send(hass, handler, "light/kitchen", _command(state=False))
+
+    assert [(call.domain, call.service) for call in calls] == [("light", "turn_on")]
+    assert calls[0].data == {"entity_id": "light.kitchen"}
+    assert handler.skipped == 1
+
+
+def test_value_metrics_call_the_mapped_service(
+    hass: HomeAssistant, handler: HelixerCommandHandler, calls: list[ServiceCall]
+) -> None:
+    """State and attribute writes are passed in the field of their service."""
+    _send(hass, handler, "input_number/level", _command(state=7.0))
+    _send(hass, handler, "input_number/level", _command(state=5.0))
+    _send(hass, handler, "climate/room", _command(attributes__temperature=22.5))
+
+    assert [(call.domain, call.service, call.data) for call in calls] == [
+        ("input_number", "set_value", {"entity_id": "input_number.level", "value": 7}),
+        (
+            "climate",
+            "set_temperature",
+            {"entity_id": "climate.room", "temperature": 22.5},
+        ),
+    ]
+    assert handler.skipped == 1
+
+
+def test_unmapped_metrics_are_rejected(
+    hass: HomeAssistant, handler: HelixerCommandHandler, calls: list[ServiceCall]
+) -> None:
+    """Writes without a service, or to unknown aliases, call nothing."""
+    payload = sparkplugb_pb2.Payload()
+    metric = payload.metrics.add()
+    metric.alias = 12345
+    metric.boolean_value = True
+
+    _send(hass, handler, "sensor/power", _command(state=1.0))
+    _send(hass, handler, "light/kitchen", payload.SerializeToString())
+
+    assert not calls
+    assert handler.rejected == 2
+
+
+def test_writes_are_coalesced_and_resolved_by_alias(
+    hass: HomeAssistant, handler: HelixerCommandHandler, calls: list[ServiceCall]
+) -> None:
+    """Writes queued together call the service once with the last value."""
+    registry = HelixerMetricRegistry(hass)
+    registry.register("input_number/level", "state", sparkplugb_pb2.Double)
+    handler = HelixerCommandHandler(hass, registry, lambda entity_id: True, _topic)
+    by_alias = sparkplugb_pb2.Payload()
+    metric = by_alias.metrics.add()
+    metric.alias = registry.alias("input_number/level", "state")
+    metric.double_value = 9
+
+    _send(
+        hass,
+        handler,
+        "input_number/level",
+        _command(state=8.0),
+        by_alias.SerializeToString(),
+    )
+
+    assert [call.data["value"] for call in calls] == [9]
+    assert handler.coalesced == 1
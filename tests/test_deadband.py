@@ -0,0 +1,79 @@
+"""Tests of the report-by-exception deadbands."""
+from __future__ import annotations
+
+from helixer.deadband import DeadbandRule, HelixerDeadband
+
+DEVICE = "sensor/power"
+
+
+def _deadband(**rule: float) -> HelixerDeadband:
+    deadband = HelixerDeadband({"sensor.power": rule})
+    deadband.set_rule(DEVICE, deadband.rule_for("sensor", "power"))
+    deadband.published(DEVICE, {"state": (100.0, 0)}, 0)
+    return deadband
+
+
+def test_rule_for_prefers_the_device_class() -> None:
+    """A ``domain.device_class`` rule wins over the domain rule."""
+    deadband = HelixerDeadband(
+        {"sensor": {"absolute": 1}, "sensor.power": {"percent": 5}, "bad": {"x": 1}}
+    )
+
+    assert deadband.rule_for("sensor", "power") == DeadbandRule(percent=5)
+    assert deadband.rule_for("sensor", "energy") == DeadbandRule(absolute=1)
+    assert deadband.rule_for("bad", None) is None
+
+
+def test_change_within_deadband_is_held() -> None:
+    """Small changes are held, larger ones and non numbers are sent."""
+    deadband = _deadband(absolute=1, percent=2)
+
+    assert deadband.filter(DEVICE, {"state": (101.5, 1)}, 1) == {}
+    assert deadband.filter(DEVICE, {"state": (102.5, 2)}, 2) == {
+        "state": (102.5, 2)
+    }
+    assert deadband.filter(DEVICE, {"state": ("unknown", 3)}, 3) == {
+        "state": ("unknown", 3)
+    }
+
+
+def test_min_interval_holds_then_flushes_the_latest_value() -> None:
+    """A rate limited value is released once the interval is over."""
+    deadband = _deadband(min_interval=10)
+
+    assert deadband.filter(DEVICE, {"state": (150.0, 1)}, 1) == {}
+    assert deadband.filter(DEVICE, {"state": (160.0, 2)}, 2) == {}
+    assert deadband.due(5, 5) == {}
+    assert deadband.due(10, 10) == {DEVICE: {"state": (160.0, 2)}}
+
+    deadband.published(DEVICE, {"state": (160.0, 2)}, 10)
+    assert deadband.due(25, 25) == {}
+
+
+def test_max_silence_sends_a_heartbeat() -> None:
+    """A silent metric is sent again, with the held value if there is one."""
+    deadband = _deadband(absolute=5, max_silence=60)
+
+    assert deadband.due(59, 59) == {}
+    assert deadband.due(60, 60000) == {DEVICE: {"state": (100.0, 60000)}}
+
+    deadband.published(DEVICE, {"state": (100.0, 60000)}, 60)
+    assert deadband.filter(DEVICE, {"state": (101.0, 61)}, 61) == {}
+    assert deadband.due(120, 120000) == {DEVICE: {"state": (101.0, 61)}}
+    # Past the silence, a change within the deadband is sent right away.
+    assert deadband.filter(DEVICE, {"state": (102.0, 121)}, 121) == {
+        "state": (102.0, 121)
+    }
+
+
+def test_devices_without_rule_are_not_filtered() -> None:
+    """Removing the rule of a device forgets what it held."""
+    deadband = _deadband(absolute=5)
+    assert deadband.filter(DEVICE, {"state": (101.0, 1)}, 1) == {}
+
+    deadband.set_rule(DEVICE, None)
+
+    assert deadband.filter(DEVICE, {"state": (101.0, 2)}, 2) == {
+        "state": (101.0, 2)
+    }
+    assert deadband.due(1000, 1000) == {}
@@ -0,0 +1,92 @@
+"""Tests of the metric codecs."""
+from __future__ import annotations
+
+from typing import Any
+
+import pytest
+
+from helixer import sparkplugb_pb2
+from helixer.encoder import (
+    DOUBLE,
+    INT64,
+    INT64_MAX,
+    INT64_MIN,
+    TEXT,
+    MetricCodec,
+    codec_for,
+    decode,
+    encode,
+    parse_state,
+)
+
+
+@pytest.mark.parametrize(
+    ("value", "declared", "expected"),
+    [
+        (INT64_MAX, None, INT64),
+        (INT64_MIN, None, INT64),
+        (INT64_MAX + 1, None, DOUBLE),
+        (INT64_MIN - 1, None, DOUBLE),
+        (2**70, INT64, DOUBLE),
+        (-(2**70), None, DOUBLE),
+        (10**400, None, TEXT),
+        (3, DOUBLE, DOUBLE),
+    ],
+)
+def test_codec_for_int(value: int, declared: MetricCodec | None, expected) -> None:
+    """Integers only use Int64 within its range."""
+    assert codec_for(value, declared) is expected
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (INT64_MIN, INT64_MIN),
+        (2**70, float(2**70)),
+        (-(2**70), float(-(2**70))),
+        (10**400, str(10**400)),
+    ],
+)
+def test_wide_int_round_trip(value: int, expected: Any) -> None:
+    """Integers outside the Int64 range are not masked."""
+    codec = codec_for(value)
+    metric = sparkplugb_pb2.Payload.Metric()
+    metric.datatype = codec.datatype
+    encode(metric, codec, value, 0)
+    assert decode(metric) == expected
+
+    value_only = sparkplugb_pb2.Payload.Metric()
+    codec.set_value(value_only, value)
+    assert codec.serialize(value) == value_only.SerializeToString()
+
+
+@pytest.mark.parametrize(
+    ("state", "expected"),
+    [
+        ("20", 20.0),
+        ("-20.5", -20.5),
+        ("+.5", 0.5),
+        ("5.", 5.0),
+        ("1e3", 1000.0),
+        ("2.5E-2", 0.025),
+        ("True", True),
+        ("false", False),
+        ("unavailable", None),
+        ("1_000", "1_000"),
+        (" 5 ", " 5 "),
+        ("nan", "nan"),
+        ("NaN", "NaN"),
+        ("-Infinity", "-Infinity"),
+        ("inf", "inf"),
+        ("1e999", "1e999"),
+        ("\u0665", "\u0665"),
+        (".", "."),
+        ("1e", "1e"),
+        ("0x10", "0x10"),
+    ],
+)
+def test_parse_state(state: str, expected: Any) -> None:
+    """Only plain decimal numerals become floats."""
+    value = parse_state(state)
+    assert value == expected
+    assert type(value) is type(expected)
@@ -0,0 +1,46 @@
+"""Tests of the primary host application tracking."""
+from __future__ import annotations
+
+import pytest
+
+from helixer.host import HelixerPrimaryHost, parse_host_state
+
+
+@pytest.mark.parametrize(
+    ("data", "expected"),
+    [
+        (b'{"online": true, "timestamp": 1700000000000}', (True, 1700000000000)),
+        (b'{"online": false, "timestamp": 1700000000001}', (False, 1700000000001)),
+        (b'{"online": true}', (True, None)),
+        (b'{"online": true, "timestamp": "soon"}', (True, None)),
+        (b"ONLINE", (True, None)),
+        (b" offline\n", (False, None)),
+        (b'{"online": "true"}', (None, None)),
+        (b"[true]", (None, None)),
+        (b"not json", (None, None)),
+        (b"\xff\xfe", (None, None)),
+    ],
+)
+def test_parse_host_state(data: bytes, expected: tuple) -> None:
+    """Sparkplug 3.0 JSON and legacy plain text STATE payloads are understood."""
+    assert parse_host_state(data) == expected
+
+
+def test_transitions_ignore_stale_and_repeated_messages() -> None:
+    """Callbacks fire on changes only, older timestamps are ignored."""
+    events: list[str] = []
+    host = HelixerPrimaryHost(
+        "scada", lambda: events.append("online"), lambda: events.append("offline")
+    )
+    assert host.topic == "spBv1.0/STATE/scada"
+    assert not host.online
+
+    host.handle_message(host.topic, b'{"online": true, "timestamp": 10}')
+    host.handle_message(host.topic, b'{"online": true, "timestamp": 11}')
+    # A retained message older than the last one seen.
+    host.handle_message(host.topic, b'{"online": false, "timestamp": 5}')
+    host.handle_message(host.topic, b"garbage")
+    host.handle_message(host.topic, b'{"online": false, "timestamp": 12}')
+
+    assert events == ["online", "offline"]
+    assert host.stats == {"online": False, "timestamp": 12, "transitions": 2}
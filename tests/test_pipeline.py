@@ -0,0 +1,208 @@
+"""Tests of the publishing pipeline."""
+from __future__ import annotations
+
+import threading
+import time
+
+from homeassistant.core import HomeAssistant, State
+import pytest
+
+from helixer import pipeline as pipeline_module, sparkplugb_pb2
+from helixer.deadband import HelixerDeadband
+from helixer.pipeline import HelixerPipeline
+from helixer.publisher import HelixerBatchPublisher
+from helixer.registry import HelixerMetricRegistry
+
+
+class RecordingClient:
+    """Stand-in for HelixerClient keeping every published payload."""
+
+    def __init__(self) -> None:
+        self.messages: list[tuple[str, sparkplugb_pb2.Payload]] = []
+        # Number of publishes that fail from now on.
+        self.failures = 0
+
+    def publish(self, topic: str, payload) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("broker unavailable")
+        self.messages.append(
+            (topic, sparkplugb_pb2.Payload.FromString(payload.SerializeToString()))
+        )
+
+    def start_replay(self, devices) -> None:
+        """Nothing is buffered."""
+
+    def births(self, device_id: str) -> list[sparkplugb_pb2.Payload]:
+        return [
+            payload
+            for topic, payload in self.messages
+            if topic.endswith(f"/DBIRTH/helixer/{device_id}")
+        ]
+
+
+def _publisher(hass: HomeAssistant, client: RecordingClient) -> HelixerBatchPublisher:
+    return HelixerBatchPublisher(
+        client,
+        HelixerMetricRegistry(hass),
+        HelixerDeadband({}),
+        "helixer",
+        min_interval=0.01,
+        max_interval=0.01,
+        max_metrics=1000,
+    )
+
+
+def _wait_for(predicate, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _state(entity_id: str, value: str) -> State:
+    return State(
+        entity_id,
+        value,
+        {"unit_of_measurement": "W", "friendly_name": entity_id},
+    )
+
+
+def test_live_change_during_snapshot_births_every_metric(
+    hass: HomeAssistant, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A device changed before the snapshot reaches it declares all metrics."""
+    monkeypatch.setattr(pipeline_module, "SNAPSHOT_CHUNK_SIZE", 10)
+    client = RecordingClient()
+    pipeline = HelixerPipeline(_publisher(hass, client), 1000, "drop_oldest")
+    states = [_state(f"sensor.s{index}", "1") for index in range(120)]
+    last = states[-1]
+
+    pipeline.request_rebirth(states)
+    pipeline.enqueue(last.entity_id, last, _state(last.entity_id, "2"))
+    pipeline.start()
+    _wait_for(lambda: client.births("sensor/s118"))
+    pipeline.stop()
+    pipeline.join()
+
+    births = client.births("sensor/s119")
+    assert len(births) == 1
+    assert {metric.name for metric in births[0].metrics} == {
+        "state",
+        "attributes/unit_of_measurement",
+        "attributes/friendly_name",
+    }
+    assert [
+        metric.double_value for metric in births[0].metrics if metric.name == "state"
+    ] == [2]
+    # The older snapshot state is not sent after the live change.
+    assert all(
+        not topic.endswith("/DDATA/helixer/sensor/s119")
+        for topic, _ in client.messages
+    )
+    assert all(len(client.births(f"sensor/s{index}")) == 1 for index in range(119))
+
+
+def test_failed_birth_is_retried_with_the_new_datatype(hass: HomeAssistant) -> None:
+    """A birth that could not be published is sent again without new changes."""
+    client = RecordingClient()
+    pipeline = HelixerPipeline(_publisher(hass, client), 1000, "drop_oldest")
+    old = _state("sensor.s0", "1")
+    pipeline.request_rebirth([old])
+    pipeline.start()
+    _wait_for(lambda: client.births("sensor/s0"))
+
+    client.failures = 1
+    pipeline.enqueue(old.entity_id, old, _state(old.entity_id, "on"))
+    _wait_for(lambda: len(client.births("sensor/s0")) == 2)
+    pipeline.stop()
+    pipeline.join()
+
+    state = next(
+        metric
+        for metric in client.births("sensor/s0")[1].metrics
+        if metric.name == "state"
+    )
+    assert state.datatype == sparkplugb_pb2.String
+    assert state.string_value == "on"
+    assert all(
+        not topic.endswith("/DDATA/helixer/sensor/s0") for topic, _ in client.messages
+    )
+
+
+@pytest.mark.parametrize(
+    ("drop_policy", "born"),
+    [("drop_oldest", {"s1", "s2"}), ("drop_newest", {"s0", "s1"})],
+)
+def test_full_queue_drops_by_policy(
+    hass: HomeAssistant, drop_policy: str, born: set[str]
+) -> None:
+    """A full queue drops the oldest or the newest state change."""
+    client = RecordingClient()
+    pipeline = HelixerPipeline(_publisher(hass, client), 2, drop_policy)
+    for name in ("s0", "s1", "s2"):
+        pipeline.enqueue(f"sensor.{name}", None, _state(f"sensor.{name}", "1"))
+    assert pipeline.dropped == 1
+
+    pipeline.start()
+    _wait_for(lambda: pipeline.stats["queue_depth"] == 0)
+    pipeline.stop()
+    pipeline.join()
+
+    assert {
+        name for name in ("s0", "s1", "s2") if client.births(f"sensor/{name}")
+    } == born
+
+
+def test_control_items_are_queued_beyond_the_limit(hass: HomeAssistant) -> None:
+    """Stopping is queued even when only history, never dropped, fills it."""
+    client = RecordingClient()
+    pipeline = HelixerPipeline(_publisher(hass, client), 1, "drop_newest")
+    assert pipeline.enqueue_history("sensor.s0", [(1000, 0.5)])
+    assert not pipeline.enqueue_history("sensor.s0", [(2000, 1.5)])
+    pipeline.stop()
+    assert pipeline.dropped == 0
+
+    pipeline.start()
+    pipeline.join()
+
+    assert client.births("sensor/s0")
+
+
+def test_pause_discards_changes_and_resume_is_a_rebirth(
+    hass: HomeAssistant,
+) -> None:
+    """Nothing is published while paused, resuming births the given states."""
+    client = RecordingClient()
+    pipeline = HelixerPipeline(
+        _publisher(hass, client), 100, "drop_oldest", paused=True
+    )
+    old = _state("sensor.s0", "1")
+    pipeline.start()
+    pipeline.enqueue(old.entity_id, None, old)
+    assert pipeline.enqueue_history(old.entity_id, [(1000, 0.5), (2000, 1.5)])
+    _wait_for(lambda: pipeline.stats["queue_depth"] == 0)
+    assert not client.messages
+
+    pipeline.resume([_state("sensor.s0", "2")])
+    _wait_for(
+        lambda: any(
+            topic.endswith("/DDATA/helixer/sensor/s0") for topic, _ in client.messages
+        )
+    )
+    pipeline.stop()
+    pipeline.join()
+
+    assert not pipeline.paused
+    births = client.births("sensor/s0")
+    assert [
+        metric.double_value for metric in births[-1].metrics if metric.name == "state"
+    ] == [2]
+    # The history queued while paused follows the birth.
+    history = [
+        metric
+        for topic, payload in client.messages
+        if topic.endswith("/DDATA/helixer/sensor/s0")
+        for metric in payload.metrics
+    ]
+    assert history and all(metric.is_historical for metric in history)
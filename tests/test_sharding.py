@@ -0,0 +1,66 @@
+"""Tests of the sharding of devices over edge nodes."""
+from __future__ import annotations
+
+from helixer.sharding import HelixerShardedClient, HelixerShardMap, shard_node_ids
+
+DEVICES = [f"sensor/s{index}" for index in range(2000)]
+
+
+class TopicClient:
+    """Stand-in for HelixerClient remembering the topics it published."""
+
+    def __init__(self) -> None:
+        self.topics: list[str] = []
+
+    def publish(self, topic: str, payload) -> None:
+        self.topics.append(topic)
+
+
+def test_shard_node_ids_keep_the_base_id_first() -> None:
+    """The first connection uses the configured edge node ID."""
+    assert shard_node_ids("helixer", 1) == ["helixer"]
+    assert shard_node_ids("helixer", 3) == ["helixer", "helixer-1", "helixer-2"]
+
+
+def test_assignment_is_stable_and_balanced() -> None:
+    """Every map of the same nodes agrees, and no node is left idle."""
+    node_ids = shard_node_ids("helixer", 4)
+    first, second = HelixerShardMap(node_ids), HelixerShardMap(list(node_ids))
+
+    assert [first.node_for(device) for device in DEVICES] == [
+        second.node_for(device) for device in DEVICES
+    ]
+    counts = first.stats
+    assert sum(counts.values()) == len(DEVICES)
+    assert min(counts.values()) > len(DEVICES) / len(node_ids) / 2
+
+
+def test_adding_a_node_only_moves_devices_to_it() -> None:
+    """Rendezvous hashing keeps every other assignment."""
+    before = HelixerShardMap(shard_node_ids("helixer", 3))
+    after = HelixerShardMap(shard_node_ids("helixer", 4))
+
+    moved = [
+        device
+        for device in DEVICES
+        if before.node_for(device) != after.node_for(device)
+    ]
+
+    assert moved
+    assert {after.node_for(device) for device in moved} == {"helixer-3"}
+
+
+def test_messages_are_routed_by_edge_node() -> None:
+    """Topics of a node go to its client, other topics to the first one."""
+    clients = {node_id: TopicClient() for node_id in shard_node_ids("helixer", 2)}
+    sharded = HelixerShardedClient(clients)
+
+    sharded.publish("spBv1.0/homeassistant/DDATA/helixer-1/sensor/s0", b"")
+    sharded.publish("spBv1.0/homeassistant/NBIRTH/helixer", b"")
+    sharded.publish("spBv1.0/homeassistant/NBIRTH/unknown", b"")
+    sharded.publish("spBv1.0/STATE/scada", b"")
+
+    assert clients["helixer-1"].topics == [
+        "spBv1.0/homeassistant/DDATA/helixer-1/sensor/s0"
+    ]
+    assert len(clients["helixer"].topics) == 3
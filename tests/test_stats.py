@@ -0,0 +1,25 @@
+"""Tests of the runtime statistics."""
+from __future__ import annotations
+
+from helixer.stats import HelixerStats
+
+
+def test_combined_adds_up_counters_and_histograms() -> None:
+    """Per client statistics are reported as one."""
+    first, second = HelixerStats(), HelixerStats()
+    first.events_received = 5
+    first.connects, first.reconnects = 3, 2
+    second.connects = 1
+    first.publish_latency.observe(0.002)
+    second.publish_latency.observe(0.2)
+    second.publish_latency.observe(0.2)
+
+    total = HelixerStats.combined((first, second)).as_dict()
+
+    assert total["events_received"] == 5
+    assert total["connects"] == 4
+    assert total["reconnects"] == 2
+    assert total["publish_latency"]["count"] == 3
+    assert total["publish_latency"]["p99"] == 0.5
+    # The parts are left alone.
+    assert first.publish_latency.count == 1
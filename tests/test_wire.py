@@ -0,0 +1,185 @@
+"""Differential tests of the streaming payload writer against protobuf."""
+from __future__ import annotations
+
+import random
+import string
+from typing import Any
+
+import pytest
+
+from helixer import sparkplugb_pb2
+from helixer.encoder import (
+    BOOLEAN,
+    BOOLEAN_ARRAY,
+    DOUBLE,
+    DOUBLE_ARRAY,
+    INT64,
+    INT64_ARRAY,
+    INT64_MAX,
+    INT64_MIN,
+    STRING,
+    STRING_ARRAY,
+    TEXT,
+    MetricCodec,
+    encode,
+)
+from helixer.wire import TIMESTAMP_CACHE_SIZE, PayloadWriter, self_check
+
+SEEDS = range(20)
+PAYLOADS_PER_SEED = 50
+UINT64_MAX = (1 << 64) - 1
+# Lengths around the one and two byte varint boundaries of names and strings.
+LENGTHS = (0, 1, 126, 127, 128, 129, 300, 16383, 16384, 70000)
+ALPHABET = string.ascii_letters + string.digits + "/_ -.é✓😀\0"
+
+
+def _text(rnd: random.Random) -> str:
+    size = rnd.choice(LENGTHS) if rnd.random() < 0.2 else rnd.randrange(24)
+    return "".join(rnd.choices(ALPHABET, k=size))
+
+
+def _int(rnd: random.Random) -> int:
+    return rnd.choice(
+        (
+            0,
+            -1,
+            INT64_MIN,
+            INT64_MAX,
+            rnd.randrange(-300, 300),
+            rnd.randrange(INT64_MIN, INT64_MAX),
+        )
+    )
+
+
+def _float(rnd: random.Random) -> float:
+    return rnd.choice(
+        (
+            0.0,
+            -0.0,
+            float("inf"),
+            float("-inf"),
+            rnd.uniform(-1e300, 1e300),
+            rnd.randrange(-1000, 1000) / 8,
+        )
+    )
+
+
+def _value(rnd: random.Random, codec: MetricCodec) -> Any:
+    if rnd.random() < 0.05:
+        return None
+    size = rnd.choice((0, 1, 3, 9, 200))
+    if codec is BOOLEAN:
+        return rnd.random() < 0.5
+    if codec is INT64:
+        return _int(rnd)
+    if codec is DOUBLE:
+        return _float(rnd) if rnd.random() < 0.8 else _int(rnd)
+    if codec is STRING:
+        return _text(rnd)
+    if codec is TEXT:
+        return {_text(rnd): [_int(rnd), _text(rnd)]}
+    if codec is INT64_ARRAY:
+        return tuple(_int(rnd) for _ in range(size))
+    if codec is DOUBLE_ARRAY:
+        return tuple(_float(rnd) for _ in range(size))
+    if codec is BOOLEAN_ARRAY:
+        return tuple(rnd.random() < 0.5 for _ in range(size))
+    return tuple(_text(rnd) for _ in range(size))
+
+
+def _alias(rnd: random.Random) -> int:
+    return rnd.choice(
+        (
+            0,
+            rnd.randrange(1, 128),
+            rnd.randrange(128, 1 << 14),
+            rnd.randrange(1 << 14, 1 << 35),
+            rnd.randrange(1 << 35, UINT64_MAX),
+            UINT64_MAX,
+        )
+    )
+
+
+def _timestamp(rnd: random.Random) -> int:
+    return rnd.choice(
+        (0, rnd.randrange(1 << 7), 1_700_000_000_000 + rnd.randrange(10**9), UINT64_MAX)
+    )
+
+
+def _expected(
+    timestamp: int,
+    metrics: list[tuple[int, str, tuple[Any, int]]],
+    codecs: dict[str, MetricCodec],
+    declare: bool,
+    seq: int | None,
+) -> bytes:
+    payload = sparkplugb_pb2.Payload()
+    payload.timestamp = timestamp
+    for alias, name, (value, metric_timestamp) in metrics:
+        metric = payload.metrics.add()
+        if declare:
+            metric.name = name
+            metric.datatype = codecs[name].datatype
+        metric.alias = alias
+        encode(metric, codecs[name], value, metric_timestamp)
+    if seq is not None:
+        payload.seq = seq
+    return payload.SerializeToString()
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_random_payloads_match_protobuf(seed: int) -> None:
+    """Random payloads serialize to the same bytes as the generated classes."""
+    rnd = random.Random(seed)
+    all_codecs = (
+        BOOLEAN,
+        INT64,
+        DOUBLE,
+        STRING,
+        TEXT,
+        INT64_ARRAY,
+        DOUBLE_ARRAY,
+        BOOLEAN_ARRAY,
+        STRING_ARRAY,
+    )
+    # One writer for every payload, as the publisher reuses it.
+    writer = PayloadWriter()
+    for _ in range(PAYLOADS_PER_SEED):
+        timestamp = _timestamp(rnd)
+        codecs: dict[str, MetricCodec] = {}
+        metrics = []
+        for index in range(rnd.randrange(12)):
+            name = f"{_text(rnd)}#{index}"
+            codecs[name] = codec = rnd.choice(all_codecs)
+            metrics.append(
+                (_alias(rnd), name, (_value(rnd, codec), _timestamp(rnd)))
+            )
+        declare = rnd.random() < 0.5
+        seq = rnd.choice((None, 0, 1, 127, 128, 255, rnd.randrange(256)))
+
+        writer.start(timestamp)
+        writer.add_metrics(metrics, codecs, declare)
+        if seq is not None:
+            writer.seq = seq
+
+        assert writer.SerializeToString() == _expected(
+            timestamp, metrics, codecs, declare, seq
+        )
+
+
+def test_timestamp_cache_overflow() -> None:
+    """Timestamps keep serializing correctly once their cache is cleared."""
+    writer = PayloadWriter()
+    codecs = {"state": DOUBLE}
+    for timestamp in range(TIMESTAMP_CACHE_SIZE * 3):
+        metrics = [(1, "state", (1.5, timestamp * 1000))]
+        writer.start(timestamp * 1000 + 1)
+        writer.add_metrics(metrics, codecs)
+        assert writer.SerializeToString() == _expected(
+            timestamp * 1000 + 1, metrics, codecs, False, None
+        )
+
+
+def test_self_check() -> None:
+    """The startup self check passes on the installed protobuf backend."""
+    assert self_check()